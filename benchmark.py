@@ -0,0 +1,29 @@
+# Tool to benchmark several memory configurations of a workflow in parallel and compare them with the predictions.
+import json
+import sys
+from sizer.workflow_benchmark import WorkflowBenchmark
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+
+    if len(argv) < 2:
+        print("Usage: <workflow-arn> <configurations.json> <executions> <payload.json> <report.json>")
+        print("       configurations.json: [{<lambda arn>: <memory size>, ...}, ...] or [[<memory size>, ...], ...]")
+        exit(0)
+
+    arn = argv[0]
+    with open(argv[1]) as f:
+        configurations = json.load(f)
+    executions = int(argv[2]) if len(argv) > 2 else 5
+    payload = None
+    if len(argv) > 3:
+        with open(argv[3]) as f:
+            payload = json.load(f)
+
+    benchmark = WorkflowBenchmark(arn, configurations, payload=payload, executions=executions)
+    report = [result.to_dict() for result in benchmark.run()]
+    print(json.dumps(report, indent=4))
+    if len(argv) > 4:
+        with open(argv[4], 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,38 @@
+# Tool to detect stale performance models from production telemetry and re-sample only the drifted functions.
+import json
+import sys
+from sizer.drift_monitor import DriftMonitor
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+
+    if len(argv) < 1:
+        print("Usage: <report.jsonl> <threshold> [--resample <payloads.json>]")
+        exit(0)
+
+    resample = '--resample' in argv
+    payloads = {}
+    if resample:
+        i = argv.index('--resample')
+        if len(argv) > i + 1:
+            with open(argv[i + 1]) as f:
+                payloads = json.load(f)
+        argv = argv[:i]
+
+    report = argv[0]
+    threshold = float(argv[1]) if len(argv) > 1 else 0.2
+
+    monitor = DriftMonitor(threshold=threshold)
+    with open(report, 'w') as out:
+        for result in monitor.check_all():
+            entry = result.to_dict()
+            if result.drifted:
+                print(f"{result.arn} drifted by {result.residual:+.1%}")
+                if resample:
+                    sizing_result, cost = monitor.resample(result, payloads.get(result.arn, {}))
+                    entry['resampled'] = {'architecture': sizing_result.architecture,
+                                          'memorySize': sizing_result.memory_size, 'cost': sizing_result.cost,
+                                          'duration': sizing_result.duration, 'total_cost': cost}
+            out.write(json.dumps(entry) + '\n')
+            out.flush()
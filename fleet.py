@@ -0,0 +1,32 @@
+# Tool to size all Lambda functions of an account from their fitted performance models.
+import json
+import sys
+from sizer.fleet_sizer import FleetSizer
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+
+    if len(argv) < 2:
+        print("Usage: <table-dir> <report.csv> <balanced_weight> [--sample <payloads.json>]")
+        exit(0)
+
+    sample = '--sample' in argv
+    payloads = None
+    if sample:
+        i = argv.index('--sample')
+        if len(argv) > i + 1:
+            with open(argv[i + 1]) as f:
+                payloads = json.load(f)
+        argv = argv[:i]
+
+    table_dir = argv[0]
+    report = argv[1]
+    balanced_weight = float(argv[2]) if len(argv) > 2 else 0.5
+
+    fleet = FleetSizer(table_dir, balanced_weight=balanced_weight)
+    missing = fleet.build_table(sample=sample, payloads=payloads)
+    print(f"{len(fleet.table)} functions in table, {missing} without model")
+    fleet.recommend()
+    with open(report, 'w', newline='') as f:
+        fleet.write_report(f)
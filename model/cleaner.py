@@ -1,18 +1,115 @@
-import boto3
-from model.lambda_function import LambdaFunction
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from model.lambda_function import LambdaFunction, SIZER_VERSION_DESCRIPTION
+from util.aws_clients import get_client_provider
+
+logger = logging.getLogger(__name__)
+
+# aliases created by the sizer, e.g. `512MB` or `512MB-arm64`
+SIZER_ALIAS_PATTERN = re.compile(r'^\d+MB(-arm64)?$')
+
+
+class TeardownReport:
+    def __init__(self, arn: str):
+        self.arn = arn
+        self.aliases = []
+        self.versions = []
+        # aliases named like the sizer's whose version was not published by the sizer, they are kept
+        self.skipped_aliases = []
+        self.reclaimed_bytes = 0
+        self.errors = []
+
+    def to_dict(self):
+        return {'arn': self.arn, 'aliases': self.aliases, 'versions': self.versions,
+                'skippedAliases': self.skipped_aliases, 'reclaimedBytes': self.reclaimed_bytes,
+                'errors': self.errors}
 
 
 class Cleaner:
 
-    def __init__(self):
-        self.s3 = boto3.resource('s3')
+    def __init__(self, client_provider=None, max_workers: int = 4):
+        """
+        :param max_workers: concurrent delete calls per function, throttled calls are retried by the clients
+        """
+        self.client_provider = client_provider if client_provider else get_client_provider()
+        self.s3 = self.client_provider.resource('s3')
+        self.max_workers = max_workers
 
     def clear_s3_bucket(self, bucket_name: str):
         bucket = self.s3.Bucket(bucket_name)
         bucket.objects.all().delete()
 
     @staticmethod
-    def delete_lambda_alias(lambda_func: LambdaFunction, alias: str):
-        version = lambda_func.get_alias(alias=alias)['FunctionVersion']
+    def delete_lambda_alias(lambda_func: LambdaFunction, alias: str, version: str = None):
+        """ Deletes an alias and the version it points to
+        :param version: (optional) version of the alias if already known, saves a `get_alias` call
+        """
+        if version is None:
+            version = lambda_func.get_alias(alias=alias)['FunctionVersion']
         lambda_func.delete_alias(alias=alias)
-        lambda_func.delete_version(version=version)
\ No newline at end of file
+        lambda_func.delete_version(version=version)
+
+    @staticmethod
+    def is_sizer_alias(alias: str):
+        return SIZER_ALIAS_PATTERN.match(alias) is not None
+
+    def _delete_all(self, func, items: list, report: TeardownReport):
+        """ Calls `func` for all items in parallel, returns the items that were deleted """
+        def delete(item):
+            try:
+                func(item)
+                return item
+            except Exception as e:
+                if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ResourceNotFoundException':
+                    # already deleted, e.g. by a concurrent teardown
+                    return item
+                logger.warning(f"Deleting {item} of {report.arn} failed: {e}")
+                report.errors.append(f"{item}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return [item for item in executor.map(delete, items) if item is not None]
+
+    def teardown(self, lambda_func: LambdaFunction):
+        """ Deletes all aliases created by the sizer and the versions published by the sizer (description
+        `SIZER_VERSION_DESCRIPTION`). Versions that are still referenced by other aliases are kept, as are aliases
+        named like the sizer's that point to other versions, e.g. a user's own `512MB` alias.
+        :return `TeardownReport`
+        """
+        report = TeardownReport(lambda_func.arn)
+        tagged = {v['Version']: v for v in lambda_func.list_versions()
+                  if v.get('Description', '').startswith(SIZER_VERSION_DESCRIPTION)}
+        sizer_aliases, referenced = [], set()
+        for alias in lambda_func.list_aliases():
+            if self.is_sizer_alias(alias['Name']) and alias['FunctionVersion'] in tagged:
+                sizer_aliases.append(alias)
+                continue
+            if self.is_sizer_alias(alias['Name']):
+                report.skipped_aliases.append(alias['Name'])
+            referenced.add(alias['FunctionVersion'])
+            referenced.update(alias.get('RoutingConfig', {}).get('AdditionalVersionWeights', {}).keys())
+        if report.skipped_aliases:
+            logger.warning(f"Keeping aliases {report.skipped_aliases} of {lambda_func.arn}, their versions were not "
+                           f"published by the sizer")
+        versions = {version: v for version, v in tagged.items() if version not in referenced}
+
+        report.aliases = self._delete_all(lambda a: lambda_func.delete_alias(alias=a),
+                                          [a['Name'] for a in sizer_aliases], report)
+        report.versions = self._delete_all(lambda v: lambda_func.delete_version(version=v),
+                                           sorted(versions, key=int), report)
+        report.reclaimed_bytes = sum(versions[v].get('CodeSize', 0) for v in report.versions)
+        logger.info(f"Deleted {len(report.aliases)} aliases and {len(report.versions)} versions of "
+                    f"{lambda_func.arn}, reclaimed {report.reclaimed_bytes} bytes")
+        return report
+
+    def teardown_all(self, arns: list = None):
+        """ Tears down the given functions, defaults to all functions of the account
+        :return generator of `TeardownReport`
+        """
+        lambda_client = self.client_provider.client('lambda')
+        if not arns:
+            arns = [f['FunctionArn'] for page in lambda_client.get_paginator('list_functions').paginate()
+                    for f in page['Functions']]
+        for arn in arns:
+            yield self.teardown(LambdaFunction(arn, lambda_client))
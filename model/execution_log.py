@@ -1,19 +1,34 @@
-from util.lambda_constants import MIN_COST, MIN_MEMORY_SIZE, STATIC_INVOCATION_COST
+from util.lambda_constants import STATIC_INVOCATION_COST
+from util.pricing import X86_64, gb_second_price
 
-def compute_cost(memory_size, billed_duration):
-    return MIN_COST * (memory_size / MIN_MEMORY_SIZE) * billed_duration + STATIC_INVOCATION_COST
+def compute_cost(memory_size, billed_duration, architecture: str = X86_64, region: str = None):
+    return gb_second_price(architecture, region) * (memory_size / 1024) * (billed_duration / 1000) + STATIC_INVOCATION_COST
 
 class ExecutionLog:
     """
     Class representing the execution log of a AWS Lambda function
     """
 
-    def __init__(self, duration, billed_duration, memory_size, init_duration=0):
+    def __init__(self, duration, billed_duration, memory_size, init_duration=0, architecture=X86_64, region=None,
+                 max_memory_used=None, error=None):
+        """
+        :param max_memory_used: (optional) peak memory of the invocation in MB
+        :param error: (optional) error of a failed invocation, e.g. `OutOfMemory`, `Timeout` or `FunctionError`
+        """
         self.duration = duration
         self.billed_duration = billed_duration
         self.memory_size = memory_size
         self.init_duration = init_duration
-        self.cost = compute_cost(memory_size, billed_duration)
+        self.architecture = architecture
+        self.region = region
+        self.max_memory_used = max_memory_used
+        self.error = error
+        self.cost = compute_cost(memory_size, billed_duration, architecture, region)
+
+    @property
+    def failed(self):
+        return self.error is not None
 
     def to_string(self):
-        return f"MemorySize: {self.memory_size} MB, Duration: {self.duration}, Billed Duration: {self.billed_duration}, Init Duration: {self.init_duration}, Cost: {'{0:.12f}'.format(self.cost)}"
+        error = f", Error: {self.error}" if self.error else ''
+        return f"Architecture: {self.architecture}, MemorySize: {self.memory_size} MB, Duration: {self.duration}, Billed Duration: {self.billed_duration}, Init Duration: {self.init_duration}, Max Memory Used: {self.max_memory_used} MB, Cost: {'{0:.12f}'.format(self.cost)}{error}"
@@ -1,28 +1,42 @@
 import json
 import base64
 import logging
-from util.lambda_utils import extract_data_from_log
+import math
+import time
+import requests
+from util.lambda_utils import extract_data_from_log, extract_error_from_log, FUNCTION_ERROR
 from model.execution_log import ExecutionLog
+from util.aws_clients import get_client_provider
+from util.metrics import get_metrics
+from util.pricing import X86_64, region_of_arn
 
 logger = logging.getLogger(__name__)
 
+# description of all versions published by the sizer, used to find orphaned versions during teardown
+SIZER_VERSION_DESCRIPTION = 'cat-sizer'
+
 
 class LambdaFunction:
     """ Class representing AWS Lambda function """
 
-    def __init__(self, arn: str, lambda_client):
+    def __init__(self, arn: str, lambda_client=None):
         self.arn = arn
-        self.client = lambda_client
+        self.region = region_of_arn(arn)
+        self.client = lambda_client if lambda_client else get_client_provider().client('lambda')
 
     def list_aliases(self):
         """ Returns all aliases of Lambda function """
-        return self.client.list_aliases(FunctionName=self.arn)['Aliases']
-
-    def delete_all_lambda_aliases(self):
-        aliases = self.list_aliases()
-        for alias in aliases:
-            self.delete_alias(alias=alias['Name'])
-            self.delete_version(version=alias['FunctionVersion'])
+        aliases = []
+        for page in self.client.get_paginator('list_aliases').paginate(FunctionName=self.arn):
+            aliases += page['Aliases']
+        return aliases
+
+    def list_versions(self):
+        """ Returns all published versions of Lambda function, without $LATEST """
+        versions = []
+        for page in self.client.get_paginator('list_versions_by_function').paginate(FunctionName=self.arn):
+            versions += [v for v in page['Versions'] if v['Version'] != '$LATEST']
+        return versions
 
     def get_alias(self, alias: str):
         """ Returns details about a Lambda alias
@@ -56,6 +70,42 @@ class LambdaFunction:
        """
         return self.get_config(alias)['Timeout']
 
+    def get_architecture(self, alias: str = None):
+        """ Returns the instruction set architecture of the Lambda
+        :param alias: Alias of Lambda
+        :return `x86_64` or `arm64`
+        """
+        return self.get_config(alias).get('Architectures', [X86_64])[0]
+
+    def wait_until_updated(self, poll_interval: float = 1, timeout: float = 300):
+        """ Waits until a configuration or code update of the Lambda has finished """
+        start = time.time()
+        while self.get_config().get('LastUpdateStatus') == 'InProgress':
+            if time.time() - start > timeout:
+                raise TimeoutError(f"Update of {self.arn} did not finish within {timeout}s")
+            time.sleep(poll_interval)
+
+    def set_architecture(self, architecture: str):
+        """ Changes the instruction set architecture of the Lambda by re-uploading its current code package.
+        Only supported for functions deployed as .zip archive.
+        :param architecture: `x86_64` or `arm64`
+        :return details about new Lambda configuration
+        """
+        if self.get_architecture() == architecture:
+            logger.info("Function already has given architecture")
+            return None
+        function = self.client.get_function(FunctionName=self.arn)
+        if function['Configuration'].get('PackageType', 'Zip') != 'Zip':
+            raise ValueError(f"Cannot change the architecture of image based function {self.arn}")
+        logger.info(f"Setting architecture to: {architecture}")
+        code = requests.get(function['Code']['Location'])
+        code.raise_for_status()
+        self.wait_until_updated()
+        res = self.client.update_function_code(FunctionName=self.arn, ZipFile=code.content,
+                                               Architectures=[architecture])
+        self.wait_until_updated()
+        return res
+
     def verify_alias_exists(self, alias: str) -> bool:
         """ Checks if an alias exists for the Lambda function
         :param alias: Alias to check
@@ -70,14 +120,18 @@ class LambdaFunction:
             # real exception
             raise err
 
-    def create_memory_config(self, value: int, alias: str):
+    def create_memory_config(self, value: int, alias: str, architecture: str = None):
         """ Creates a new Lambda alias with given memory size
         :param value: memory size for configuration
         :param alias: Alias for the memory config
+        :param architecture: (optional) architecture for the configuration, unchanged if not given
         """
         try:
+            if architecture:
+                self.set_architecture(architecture)
             self.set_memory_size(value)
-            version = self.publish_version()['Version']
+            self.wait_until_updated()
+            version = self.publish_version(description=f'{SIZER_VERSION_DESCRIPTION} {alias}')['Version']
             if self.verify_alias_exists(alias):
                 self.update_alias(alias, version)
             else:
@@ -97,9 +151,13 @@ class LambdaFunction:
         else:
             logger.info("Function already has given memory size")
 
-    def publish_version(self):
-        """ Create new version from current code and configuration """
+    def publish_version(self, description: str = None):
+        """ Create new version from current code and configuration
+        :param description: (optional) description of the version
+        """
         logger.info("Publishing new version")
+        if description:
+            return self.client.publish_version(FunctionName=self.arn, Description=description)
         return self.client.publish_version(FunctionName=self.arn)
 
     def create_alias(self, alias: str, version: str):
@@ -129,28 +187,42 @@ class LambdaFunction:
         logger.info(f"Deleting version: {version}")
         return self.client.delete_function(FunctionName=self.arn, Qualifier=version)
 
-    def invoke(self, alias: str, payload: dict, log_type: str = 'Tail'):
+    def invoke(self, alias: str, payload: dict, log_type: str = 'Tail', architecture: str = X86_64):
         """ Invokes Lambda function
         :param alias: alias of Lambda function to be invoked. If not given, the standard Lambda function will be invoked.
         :param payload: input payload for Lambda function
         :param log_type: (optional) log type
+        :param architecture: (optional) architecture of the invoked version, used to compute the cost
         :return `ExecutionLog` containing details about execution
         """
         logger.info(f"Invoking function {self.arn}:{alias if alias else '$LATEST'} with payload {payload}")
         bytes_payload = bytes(json.dumps(payload), "utf-8")
+        metrics = get_metrics()
+        ts = time.perf_counter()
         try:
-            if alias:
-                res = self.client.invoke(FunctionName=self.arn, Qualifier=alias, Payload=bytes_payload, LogType=log_type)
-            else:
-                res = self.client.invoke(FunctionName=self.arn, Payload=bytes_payload, LogType=log_type)
-            log_result = res['LogResult']
-            log_str = base64.b64decode(log_result).decode('utf-8')
-
-            log = extract_data_from_log(log_str)
+            with metrics.phase('invoke', function=self.arn):
+                if alias:
+                    res = self.client.invoke(FunctionName=self.arn, Qualifier=alias, Payload=bytes_payload, LogType=log_type)
+                else:
+                    res = self.client.invoke(FunctionName=self.arn, Payload=bytes_payload, LogType=log_type)
+            with metrics.phase('log_parsing', function=self.arn):
+                log_result = res['LogResult']
+                log_str = base64.b64decode(log_result).decode('utf-8')
+
+                log = extract_data_from_log(log_str, architecture, self.region)
+                if 'FunctionError' in res:
+                    response = res['Payload'].read().decode('utf-8')
+                    log.error = extract_error_from_log(log_str, res['FunctionError'], response)
+                    logger.error(f"Function invocation failed ({log.error}): {response}")
+        except self.client.exceptions.TooManyRequestsException:
+            # throttled invocations did not run, the caller decides whether to count or retry them
+            raise
         except Exception as e:
+            # no REPORT line, e.g. the connection failed, the client side wall time is the best estimate
             logger.error("Function invocation failed: " + str(e))
-            memory_size = self.get_memory_size(alias=alias)
-            timeout_ms = self.get_time_out(alias=alias) * 1000
-            log = ExecutionLog(memory_size=memory_size, init_duration=0, duration=timeout_ms,
-                               billed_duration=timeout_ms)
+            duration = (time.perf_counter() - ts) * 1000
+            log = ExecutionLog(memory_size=self.get_memory_size(alias=alias), init_duration=0, duration=duration,
+                               billed_duration=math.ceil(duration), architecture=architecture, region=self.region,
+                               error=FUNCTION_ERROR)
+        metrics.record_invocation(self.arn, log.cost)
         return log
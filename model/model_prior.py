@@ -0,0 +1,122 @@
+import math
+import logging
+import numpy as np
+from scipy.optimize import least_squares
+from model.model_repository import ModelRepository
+from model.performance_model import PerformanceModel
+from util.pricing import X86_64
+
+logger = logging.getLogger(__name__)
+
+# offsets of the log transform, `lambda` and `t_min` are often fitted as (almost) zero
+LOG_OFFSETS = np.array([1e-3, 1e-7, 1e-3])
+
+
+def to_log(params):
+    return np.log(np.maximum(np.asarray(params, dtype=float), 0) + LOG_OFFSETS)
+
+
+def from_log(z):
+    return np.maximum(np.exp(z) - LOG_OFFSETS, 0)
+
+
+class ModelPrior:
+    """ Gaussian prior over the log parameters `log(t0), log(lambda), log(t_min)` of exponential performance models,
+    built from the fitted models of similar functions in the repository.
+    """
+
+    def __init__(self, mean, covariance, models: int, max_memory_size: int = None):
+        """
+        :param max_memory_size: (optional) largest memory size sampled for any of the models
+        """
+        self.mean = np.asarray(mean, dtype=float)
+        self.covariance = np.asarray(covariance, dtype=float)
+        self.models = models
+        self.max_memory_size = max_memory_size
+        # whitening transform, ||L^-1 (z - mean)||^2 is the Mahalanobis distance to the prior mean
+        self.whitening = np.linalg.inv(np.linalg.cholesky(self.covariance))
+
+    @staticmethod
+    def _similar(entry: dict, runtime: str, code_size: int, max_size_ratio: float):
+        if runtime and entry.get('runtime') != runtime:
+            return False
+        if code_size and entry.get('code_size'):
+            if abs(math.log(entry['code_size'] / code_size)) > math.log(max_size_ratio):
+                return False
+        elif code_size:
+            return False
+        return True
+
+    @staticmethod
+    def from_repository(repository: ModelRepository = None, architecture: str = X86_64, runtime: str = None,
+                        code_size: int = None, max_size_ratio: float = 4, min_models: int = 3,
+                        min_variance: float = 0.25, exclude: str = None):
+        """ Builds the prior from the exponential models of the repository, grouped by runtime and package size.
+        Falls back to the runtime group and then to all models if a group has fewer than `min_models` models.
+        :param runtime: (optional) only use models of functions with this runtime, e.g. `python3.12`
+        :param code_size: (optional) only use models of functions whose package is at most `max_size_ratio` times
+            larger or smaller
+        :param min_variance: lower bound of the prior variance of each log parameter
+        :param exclude: (optional) ARN of the function that is being fitted
+        :return `ModelPrior` or None if the repository has fewer than `min_models` usable models
+        """
+        repository = repository if repository else ModelRepository()
+        entries = []
+        for arn in repository.arns():
+            entry = repository.entry(arn, architecture)
+            if arn == exclude or not entry or entry.get('family', PerformanceModel.family) != PerformanceModel.family:
+                continue
+            entries.append(entry)
+
+        for group_runtime, group_code_size in [(runtime, code_size), (runtime, None), (None, None)]:
+            group = [entry for entry in entries if ModelPrior._similar(entry, group_runtime, group_code_size,
+                                                                       max_size_ratio)]
+            if len(group) >= min_models:
+                break
+        else:
+            return None
+
+        z = np.array([to_log(entry['params'][:3]) for entry in group])
+        covariance = np.cov(z, rowvar=False) if len(z) > 1 else np.zeros((3, 3))
+        covariance = covariance + np.diag(np.maximum(min_variance - np.diag(covariance), 0))
+        logger.info(f"Prior from {len(group)} models (runtime {group_runtime}, code size {group_code_size})")
+        sampled = [entry['max_sampled_memory_size'] for entry in group if entry.get('max_sampled_memory_size')]
+        return ModelPrior(z.mean(axis=0), covariance, len(group), max(sampled) if sampled else None)
+
+
+def fit_map(xdata, ydata, prior: ModelPrior, noise: float = 0.05, architecture: str = X86_64, region: str = None):
+    """ Maximum a posteriori fit of an exponential model with a Laplace approximation of the posterior
+    :param xdata: memory sizes
+    :param ydata: (averaged) durations
+    :param noise: relative standard deviation of the durations
+    :return `PerformanceModel`, posterior covariance of the log parameters
+    """
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.asarray(ydata, dtype=float)
+
+    def residuals(z):
+        t0, _lambda, t_min = from_log(z)
+        predicted = PerformanceModel.function(xdata, t0, _lambda, t_min)
+        return np.concatenate([(predicted - ydata) / (noise * ydata), prior.whitening @ (z - prior.mean)])
+
+    result = least_squares(residuals, prior.mean, method='lm')
+    jacobian = result.jac
+    covariance = np.linalg.pinv(jacobian.T @ jacobian)
+    model = PerformanceModel(*from_log(result.x), architecture=architecture, region=region)
+    return model, covariance
+
+
+def predictive_relative_std(model: PerformanceModel, covariance, memory_sizes):
+    """ Relative standard deviation of the predicted durations (delta method on the log parameters) """
+    memory_sizes = np.asarray(memory_sizes, dtype=float)
+    z = to_log(model.params)
+    duration = model.get_duration(memory_sizes)
+    gradients = []
+    for i in range(3):
+        step = np.zeros(3)
+        step[i] = 1e-6
+        shifted = PerformanceModel(*from_log(z + step))
+        gradients.append((shifted.get_duration(memory_sizes) - duration) / 1e-6)
+    gradients = np.array(gradients).T
+    variance = np.einsum('ni,ij,nj->n', gradients, covariance, gradients)
+    return np.sqrt(np.maximum(variance, 0)) / duration
@@ -0,0 +1,85 @@
+import json
+import os
+from model.performance_model import PerformanceModel, PayloadPerformanceModel, create_model
+from util.pricing import X86_64, region_of_arn
+
+REPOSITORY_PATH = './performance_model_repository.json'
+
+
+def model_key(arn: str, architecture: str = X86_64):
+    """ Returns the repository key of a function, models of other architectures than x86_64 are stored under
+    `<arn>#<architecture>`
+    """
+    if architecture != X86_64:
+        return f'{arn}#{architecture}'
+    return arn
+
+
+class ModelRepository:
+    """ JSON file mapping Lambda ARNs to fitted performance models.
+
+    Entries are either the plain parameter list `[t0, lambda, t_min]` or a dict with `params` and additional
+    metadata such as `fit_quality`, `architecture` and the model `family` (entries without it are exponential models).
+    Functions sampled with several payload classes additionally have a `payload_model`, `params` is then the model of
+    the weighted mean input size.
+    """
+
+    def __init__(self, path: str = REPOSITORY_PATH):
+        self.path = path
+        self.models = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.models = json.load(f)
+
+    @staticmethod
+    def _normalize(entry):
+        if isinstance(entry, list):
+            return {'params': entry}
+        return entry
+
+    def __contains__(self, arn: str):
+        return arn in self.models
+
+    def arns(self):
+        """ Returns the ARNs of all functions with at least one model """
+        arns = []
+        for key in self.models.keys():
+            arn = key.split('#')[0]
+            if arn not in arns:
+                arns.append(arn)
+        return arns
+
+    def entry(self, arn: str, architecture: str = X86_64):
+        """ Returns the repository entry of a function as dict with at least `params`, or None """
+        key = model_key(arn, architecture)
+        if key not in self.models:
+            return None
+        return self._normalize(self.models[key])
+
+    def get(self, arn: str, architecture: str = X86_64):
+        """ Returns the performance model of a function or None if there is none """
+        entry = self.entry(arn, architecture)
+        if not entry:
+            return None
+        model = create_model(entry['params'][:3], entry.get('family', PerformanceModel.family), architecture,
+                             region_of_arn(arn))
+        model.min_memory_size = entry.get('min_memory_size', model.min_memory_size)
+        return model
+
+    def get_payload_model(self, arn: str, architecture: str = X86_64):
+        """ Returns the `PayloadPerformanceModel` of a function or None if it was sampled with a single payload """
+        entry = self.entry(arn, architecture)
+        if not entry or 'payload_model' not in entry:
+            return None
+        return PayloadPerformanceModel.from_dict(entry['payload_model'], architecture, region_of_arn(arn))
+
+    def put(self, arn: str, params: list, architecture: str = X86_64, **metadata):
+        """ Stores the fitted parameters (and optional metadata) of a function and writes the repository """
+        entry = {'params': [float(p) for p in params], 'architecture': architecture}
+        entry.update(metadata)
+        self.models[model_key(arn, architecture)] = entry
+        self.save()
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.models, f, indent=4)
@@ -0,0 +1,149 @@
+import os
+import numpy as np
+from model.performance_model import MODEL_FAMILIES, PerformanceModel
+from util.lambda_constants import MIN_MEMORY_SIZE
+from util.pricing import ARCHITECTURES, X86_64, gb_second_price
+
+
+# columns of the model of one architecture
+MODEL_COLUMNS = {
+    'family': np.int8,
+    't0': np.float64,
+    'lambda': np.float64,
+    't_min': np.float64,
+    'fit_quality': np.float64,
+    'min_memory_size': np.int32,
+    'price': np.float64,
+}
+
+
+def model_column(name: str, architecture: str = X86_64):
+    """ Returns the name of the column of an architecture's model, x86_64 columns have no suffix """
+    if architecture != X86_64:
+        return f'{name}_{architecture}'
+    return name
+
+
+class ModelTable:
+    """ Memory-mapped columnar table of fitted performance models, one row per Lambda function.
+
+    Every column is a raw binary file in `path`, rows are appended in chunks and read back as `np.memmap`, so
+    tables of many thousands of functions never have to be materialized as Python objects. ARNs are stored as
+    lines of `arns.txt`, `arn_offset` holds the byte offset of each line for random access. `architecture` is the
+    index of the deployed architecture in `ARCHITECTURES`. Every architecture has its own model columns (see
+    `model_column`): `family` is the index of the model family in `FAMILIES` or -1 if the function has no model for
+    the architecture, `t0`, `lambda` and `t_min` hold the three parameters of the model in the order of its family and
+    `price` the price per GB-second in the region of the function.
+    """
+
+    COLUMNS = {
+        'arn_index': np.int32,
+        'arn_offset': np.int64,
+        'memory_size': np.int32,
+        'architecture': np.int8,
+        **{model_column(name, architecture): dtype for architecture in ARCHITECTURES
+           for name, dtype in MODEL_COLUMNS.items()},
+    }
+
+    FAMILIES = list(MODEL_FAMILIES.keys())
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _column_path(self, name: str):
+        return os.path.join(self.path, f'{name}.bin')
+
+    def __len__(self):
+        column_path = self._column_path('arn_index')
+        if not os.path.exists(column_path):
+            return 0
+        return os.path.getsize(column_path) // np.dtype(self.COLUMNS['arn_index']).itemsize
+
+    def column(self, name: str, dtype=None, mode: str = 'r'):
+        """ Returns a column as memory-mapped array
+        :param name: column name
+        :param dtype: dtype of columns that are not part of `COLUMNS`, e.g. computed recommendations
+        :param mode: 'r' to read an existing column, 'w+' to create a new column with one entry per row
+        """
+        dtype = dtype if dtype else self.COLUMNS[name]
+        if len(self) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._column_path(name), dtype=dtype, mode=mode, shape=(len(self),))
+
+    def arn(self, index: int):
+        """ Returns the ARN of a row """
+        return next(self.arns([index]))
+
+    def arns(self, indices):
+        """ Yields the ARNs of the given rows in the given order """
+        offsets = self.column('arn_offset')
+        with open(os.path.join(self.path, 'arns.txt'), 'rb') as f:
+            for index in indices:
+                f.seek(int(offsets[index]))
+                yield f.readline().decode('utf-8').rstrip('\n')
+
+    def writer(self, chunk_size: int = 1024):
+        """ Returns a `ModelTableWriter` that replaces the content of the table """
+        return ModelTableWriter(self, chunk_size)
+
+
+class ModelTableWriter:
+    """ Appends rows to a `ModelTable` in chunks, use as context manager """
+
+    def __init__(self, table: ModelTable, chunk_size: int):
+        self.table = table
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.offset = 0
+        self.buffer = {name: [] for name in ModelTable.COLUMNS}
+        self.files = {}
+        self.arns = None
+
+    def __enter__(self):
+        os.makedirs(self.table.path, exist_ok=True)
+        self.arns = open(os.path.join(self.table.path, 'arns.txt'), 'wb')
+        self.files = {name: open(self.table._column_path(name), 'wb') for name in ModelTable.COLUMNS}
+        return self
+
+    def append(self, arn: str, memory_size: int, entries: dict, architecture: str = X86_64, region: str = None):
+        """
+        :param memory_size: deployed memory size
+        :param entries: architecture -> repository entry (`params` and optional `family`, `fit_quality` and
+            `min_memory_size`) of the architectures the function has a model for
+        :param architecture: deployed architecture
+        :param region: (optional) region of the function, used for its prices
+        """
+        line = (arn + '\n').encode('utf-8')
+        self.arns.write(line)
+        row = {'arn_index': self.rows, 'arn_offset': self.offset, 'memory_size': memory_size,
+               'architecture': ARCHITECTURES.index(architecture)}
+        for model_architecture in ARCHITECTURES:
+            entry = entries.get(model_architecture)
+            fit_quality = entry.get('fit_quality') if entry else None
+            values = {
+                'family': ModelTable.FAMILIES.index(entry.get('family', PerformanceModel.family)) if entry else -1,
+                't0': entry['params'][0] if entry else np.nan,
+                'lambda': entry['params'][1] if entry else np.nan,
+                't_min': entry['params'][2] if entry else np.nan,
+                'fit_quality': np.nan if fit_quality is None else fit_quality,
+                'min_memory_size': entry.get('min_memory_size', MIN_MEMORY_SIZE) if entry else MIN_MEMORY_SIZE,
+                'price': gb_second_price(model_architecture, region),
+            }
+            row.update({model_column(name, model_architecture): value for name, value in values.items()})
+        for name, value in row.items():
+            self.buffer[name].append(value)
+        self.offset += len(line)
+        self.rows += 1
+        if len(self.buffer['arn_index']) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        for name, dtype in ModelTable.COLUMNS.items():
+            np.asarray(self.buffer[name], dtype=dtype).tofile(self.files[name])
+            self.buffer[name] = []
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.arns.close()
@@ -1,23 +1,59 @@
 import math
+import logging
 import numpy as np
+from scipy.optimize import curve_fit
 from model.execution_log import compute_cost, ExecutionLog
+from util.lambda_constants import MIN_MEMORY_SIZE
+from util.pricing import X86_64
+
+logger = logging.getLogger(__name__)
+
+# memory size at which a function has the equivalent of one full vCPU
+MEMORY_PER_VCPU = 1769
 
 
 class PerformanceModel:
-    def __init__(self, t0, _lambda, t_min):
+    """ Exponential performance model `t0 * exp(-lambda * m) + t_min` """
+    family = 'exponential'
+
+    def __init__(self, t0, _lambda, t_min, architecture=X86_64, region=None):
         self.t0 = t0
         self._lambda = _lambda
         self.t_min = t_min
+        self.architecture = architecture
+        self.region = region
+        # smaller memory sizes ran out of memory or timed out while sampling
+        self.min_memory_size = MIN_MEMORY_SIZE
         self.durations = {}
         self.costs = {}
 
+    @property
+    def params(self):
+        return [self.t0, self._lambda, self.t_min]
+
+    @staticmethod
+    def function(x, a, b, c):
+        return a * np.exp(-b * x) + c
+
+    @staticmethod
+    def initial_values(xdata, ydata):
+        return [50, 0, 1]
+
+    @staticmethod
+    def bounds(xdata, ydata):
+        return [0, 0, 0], [100000, 10, min(ydata)]
+
+    def gekko_duration(self, m, x):
+        """ Returns the duration as GEKKO expression of the memory size variable `x` """
+        return self.t0 * math.e ** (-self._lambda * x) + self.t_min
+
     def evaluate(self, x):
         return self.get_duration(x), self.get_cost(x)
 
     def get_cost(self, memory_size):
         duration = self.get_duration(memory_size)
-        billed_duration = math.ceil(duration)
-        cost = compute_cost(memory_size, billed_duration)
+        billed_duration = np.ceil(duration)
+        cost = compute_cost(memory_size, billed_duration, self.architecture, self.region)
         return cost
 
     def get_duration(self, memory_size):
@@ -28,7 +64,8 @@ class PerformanceModel:
         logs = []
         for size in sizes:
             duration = self.get_duration(size)
-            logs.append(ExecutionLog(duration, math.ceil(duration), size))
+            logs.append(ExecutionLog(duration, math.ceil(duration), size, architecture=self.architecture,
+                                     region=self.region))
 
         return logs
 
@@ -36,3 +73,194 @@ class PerformanceModel:
     def _nearest_config(memory_size):
         x = 64 * round(memory_size / 64)
         return x
+
+
+class AmdahlPerformanceModel(PerformanceModel):
+    """ Amdahl-style performance model over the vCPU regimes of Lambda.
+
+    CPU share grows linearly with memory, one full vCPU is reached at `MEMORY_PER_VCPU`. The serial part of the
+    `work` only speeds up until then, the `parallel_fraction` keeps speeding up with additional vCPUs:
+    `t_min + work * ((1 - p) / min(share, 1) + p / share)` with `share = m / MEMORY_PER_VCPU`
+    """
+    family = 'amdahl'
+
+    def __init__(self, work, parallel_fraction, t_min, architecture=X86_64, region=None):
+        super().__init__(t0=work, _lambda=parallel_fraction, t_min=t_min, architecture=architecture, region=region)
+        self.work = work
+        self.parallel_fraction = parallel_fraction
+
+    @staticmethod
+    def function(x, work, p, t_min):
+        share = x / MEMORY_PER_VCPU
+        return t_min + work * ((1 - p) / np.minimum(share, 1) + p / share)
+
+    @staticmethod
+    def initial_values(xdata, ydata):
+        work = max((max(ydata) - min(ydata)) * min(xdata) / MEMORY_PER_VCPU, 1e-3)
+        return [work, 0.5, min(ydata) / 2]
+
+    @staticmethod
+    def bounds(xdata, ydata):
+        return [0, 0, 0], [max(ydata), 1, min(ydata)]
+
+    def gekko_duration(self, m, x):
+        share = x / MEMORY_PER_VCPU
+        return self.t_min + self.work * ((1 - self.parallel_fraction) / m.min2(share, 1) +
+                                         self.parallel_fraction / share)
+
+    def get_duration(self, memory_size):
+        return self.function(np.asarray(memory_size, dtype=float), self.work, self.parallel_fraction, self.t_min)
+
+
+MODEL_FAMILIES = {
+    PerformanceModel.family: PerformanceModel,
+    AmdahlPerformanceModel.family: AmdahlPerformanceModel,
+}
+
+
+def create_model(params, family: str = PerformanceModel.family, architecture=X86_64, region=None):
+    """ Creates a performance model of the given family from its fitted parameters """
+    if family not in MODEL_FAMILIES:
+        raise ValueError(f"Unknown model family {family}")
+    return MODEL_FAMILIES[family](*params, architecture=architecture, region=region)
+
+
+def _fit_family(model_class, xdata, ydata):
+    popt, pcov = curve_fit(model_class.function, xdata, ydata, p0=model_class.initial_values(xdata, ydata),
+                           bounds=model_class.bounds(xdata, ydata))
+    return popt
+
+
+def held_out_error(model_class, xdata, ydata):
+    """ Mean relative error of a model family when predicting each memory size from the other ones
+    (leave-one-out), falls back to the in-sample error if there are too few memory sizes
+    """
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.asarray(ydata, dtype=float)
+    if len(xdata) <= 3:
+        popt = _fit_family(model_class, xdata, ydata)
+        return float(np.mean(np.abs(model_class.function(xdata, *popt) - ydata) / ydata))
+
+    errors = []
+    for i in range(len(xdata)):
+        mask = np.arange(len(xdata)) != i
+        popt = _fit_family(model_class, xdata[mask], ydata[mask])
+        errors.append(abs(model_class.function(xdata[i], *popt) - ydata[i]) / ydata[i])
+    return float(np.mean(errors))
+
+
+def fit_performance_model(xdata, ydata, families: list = None, architecture=X86_64, region=None):
+    """ Fits all model families and selects the one with the lowest held-out error
+    :param xdata: memory sizes
+    :param ydata: durations
+    :param families: (optional) model families to consider, defaults to all of `MODEL_FAMILIES`
+    :return fitted model of the selected family, dict of held-out error per family
+    """
+    families = families if families else list(MODEL_FAMILIES.keys())
+    errors = {}
+    for family in families:
+        try:
+            errors[family] = held_out_error(MODEL_FAMILIES[family], xdata, ydata)
+        except (RuntimeError, ValueError) as e:
+            logger.info(f"Fitting {family} model failed: {e}")
+    if not errors:
+        raise ValueError("No model family could be fitted")
+    family = min(errors, key=errors.get)
+    popt = _fit_family(MODEL_FAMILIES[family], np.asarray(xdata, dtype=float), np.asarray(ydata, dtype=float))
+    logger.info(f"Selected {family} model, held-out errors: {errors}")
+    return create_model(list(popt), family, architecture, region), errors
+
+
+class PayloadPerformanceModel:
+    """ Exponential performance model over memory size `m` and input size `s` (in MB), both offsets of the
+    exponential model grow linearly with the input size:
+    `(t0 + t0_per_mb * s) * exp(-lambda * m) + t_min + t_min_per_mb * s`
+    """
+    family = 'payload'
+
+    def __init__(self, t0, t0_per_mb, _lambda, t_min, t_min_per_mb, architecture=X86_64, region=None,
+                 input_sizes: list = None, min_memory_sizes: list = None):
+        """
+        :param input_sizes: (optional) sampled input sizes in MB
+        :param min_memory_sizes: (optional) smallest feasible memory size of each sampled input size
+        """
+        self.t0 = t0
+        self.t0_per_mb = t0_per_mb
+        self._lambda = _lambda
+        self.t_min = t_min
+        self.t_min_per_mb = t_min_per_mb
+        self.architecture = architecture
+        self.region = region
+        self.input_sizes = list(input_sizes) if input_sizes else []
+        self.min_memory_sizes = list(min_memory_sizes) if min_memory_sizes else [MIN_MEMORY_SIZE] * len(
+            self.input_sizes)
+
+    @property
+    def params(self):
+        return [self.t0, self.t0_per_mb, self._lambda, self.t_min, self.t_min_per_mb]
+
+    @staticmethod
+    def function(x, a, a_s, b, c, c_s):
+        m, s = x
+        return (a + a_s * s) * np.exp(-b * m) + c + c_s * s
+
+    def get_duration(self, memory_size, input_size):
+        return self.function((np.asarray(memory_size, dtype=float), np.asarray(input_size, dtype=float)),
+                             *self.params)
+
+    def get_cost(self, memory_size, input_size):
+        billed_duration = np.ceil(self.get_duration(memory_size, input_size))
+        return compute_cost(memory_size, billed_duration, self.architecture, self.region)
+
+    def min_memory_size(self, input_size):
+        """ Smallest feasible memory size of the next larger sampled input size, larger inputs than sampled get
+        the one of the largest sampled input size
+        """
+        if not self.input_sizes:
+            return MIN_MEMORY_SIZE
+        order = np.argsort(self.input_sizes)
+        sizes = np.asarray(self.input_sizes, dtype=float)[order]
+        index = min(int(np.searchsorted(sizes, input_size)), len(sizes) - 1)
+        return int(np.asarray(self.min_memory_sizes)[order][index])
+
+    def at(self, input_size):
+        """ Returns the exponential `PerformanceModel` of a fixed input size """
+        model = PerformanceModel(self.t0 + self.t0_per_mb * input_size, self._lambda,
+                                 self.t_min + self.t_min_per_mb * input_size, architecture=self.architecture,
+                                 region=self.region)
+        model.min_memory_size = self.min_memory_size(input_size)
+        return model
+
+    def to_dict(self):
+        return {
+            'params': [float(p) for p in self.params],
+            'input_sizes': [float(s) for s in self.input_sizes],
+            'min_memory_sizes': [int(m) for m in self.min_memory_sizes],
+        }
+
+    @staticmethod
+    def from_dict(entry: dict, architecture=X86_64, region=None):
+        return PayloadPerformanceModel(*entry['params'], architecture=architecture, region=region,
+                                       input_sizes=entry.get('input_sizes'),
+                                       min_memory_sizes=entry.get('min_memory_sizes'))
+
+
+def fit_payload_model(memory_sizes, input_sizes, durations, architecture=X86_64, region=None):
+    """ Fits a `PayloadPerformanceModel`, starting from the exponential model of all samples
+    :param memory_sizes: memory sizes
+    :param input_sizes: input sizes in MB, at least two distinct ones
+    :param durations: durations
+    :return fitted model
+    """
+    memory_sizes = np.asarray(memory_sizes, dtype=float)
+    input_sizes = np.asarray(input_sizes, dtype=float)
+    durations = np.asarray(durations, dtype=float)
+    if len(np.unique(input_sizes)) < 2:
+        raise ValueError("Fitting a payload model needs at least two input sizes")
+
+    t0, _lambda, t_min = _fit_family(PerformanceModel, memory_sizes, durations)
+    popt, pcov = curve_fit(PayloadPerformanceModel.function, (memory_sizes, input_sizes), durations,
+                           p0=[t0, 0, _lambda, min(t_min, min(durations)) / 2, 0],
+                           bounds=([0, 0, 0, 0, 0], [np.inf, np.inf, 10, min(durations), np.inf]))
+    return PayloadPerformanceModel(*popt, architecture=architecture, region=region,
+                                   input_sizes=sorted(set(input_sizes.tolist())))
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+from model.execution_log import ExecutionLog
+from util.pricing import X86_64
+
+
+class SamplingJournal:
+    """ Durable, append-only journal (JSON lines) of a sampling session.
+
+    Every completed invocation is written and fsynced as soon as it returns, so an interrupted session can be
+    resumed: completed samples are replayed from the journal and the original memory size and architecture of the
+    function are known even if the crash left the function with a different configuration. Sessions are only resumed
+    with the same fingerprint of the sampling parameters (e.g. payload, code and runs per memory size).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.original_memory_size = None
+        self.original_architecture = None
+        self.fingerprint = None
+        self.finished = False
+        self._logs = {}
+        self._costs = {}
+        self._loads = {}
+        self._incomplete_line = False
+        if os.path.exists(path):
+            self._replay()
+
+    @staticmethod
+    def fingerprint_of(parameters: dict):
+        """ Returns the fingerprint of the parameters that determine the samples of a session """
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def _replay(self):
+        with open(self.path) as f:
+            for line in f:
+                self._incomplete_line = not line.endswith('\n')
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line of a crashed session may be incomplete
+                    continue
+                self._apply(entry)
+
+    def _apply(self, entry: dict):
+        key = (entry.get('architecture', X86_64), entry.get('memory_size'))
+        if entry['event'] == 'start':
+            self.original_memory_size = entry['memory_size']
+            self.original_architecture = entry.get('architecture')
+            self.fingerprint = entry.get('fingerprint')
+        elif entry['event'] == 'invocation':
+            log = ExecutionLog(duration=entry['duration'], billed_duration=entry['billed_duration'],
+                               memory_size=entry['memory_size'], init_duration=entry['init_duration'],
+                               architecture=key[0], region=entry.get('region'),
+                               max_memory_used=entry.get('max_memory_used'), error=entry.get('error'))
+            self._logs.setdefault(key, []).append(log)
+            self._costs[key] = self._costs.get(key, 0.0) + entry['cost']
+        elif entry['event'] == 'warmup':
+            self._costs[key] = self._costs.get(key, 0.0) + entry['cost']
+        elif entry['event'] == 'load':
+            self._loads[key] = entry['summary']
+            self._costs[key] = self._costs.get(key, 0.0) + entry['cost']
+        elif entry['event'] == 'finish':
+            self.finished = True
+
+    def _write(self, entry: dict):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a') as f:
+                if self._incomplete_line:
+                    f.write('\n')
+                    self._incomplete_line = False
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(entry)
+
+    def start(self, memory_size: int, architecture: str = None, fingerprint: str = None):
+        """ Starts a new session, or resumes the unfinished one if it has the same fingerprint
+        :param memory_size: current memory size of the function, only recorded for new sessions
+        :param architecture: (optional) current architecture of the function, only recorded for new sessions
+        :param fingerprint: (optional) fingerprint of the sampling parameters, samples of a session with another
+            fingerprint are discarded
+        :return the original memory size of the function
+        """
+        if self.finished:
+            os.remove(self.path)
+            self.__init__(self.path)
+        elif self.original_memory_size is not None and self.fingerprint != fingerprint:
+            # the unfinished session still knows the configuration the function had before it was sampled
+            memory_size, architecture = self.original_memory_size, self.original_architecture
+            os.remove(self.path)
+            self.__init__(self.path)
+        if self.original_memory_size is None:
+            self._write({'event': 'start', 'memory_size': memory_size, 'architecture': architecture,
+                         'fingerprint': fingerprint})
+        return self.original_memory_size
+
+    def record(self, log: ExecutionLog, cost: float, region: str = None):
+        """ Records a completed invocation
+        :param log: execution log of the measured invocation
+        :param cost: cost of the invocation including discarded (e.g. cold start) invocations
+        :param region: (optional) region of the function, used to price replayed logs
+        """
+        self._write({'event': 'invocation', 'memory_size': log.memory_size, 'architecture': log.architecture,
+                     'region': region, 'duration': log.duration, 'billed_duration': log.billed_duration,
+                     'init_duration': log.init_duration, 'max_memory_used': log.max_memory_used, 'error': log.error,
+                     'cost': cost})
+
+    def record_warmup(self, memory_size: int, cost: float, architecture: str = X86_64):
+        """ Records the cost of warming up the execution environments of a memory size """
+        self._write({'event': 'warmup', 'memory_size': memory_size, 'architecture': architecture, 'cost': cost})
+
+    def record_load(self, memory_size: int, summary: dict, cost: float, architecture: str = X86_64):
+        """ Records the latency distribution summary of a completed load run """
+        self._write({'event': 'load', 'memory_size': memory_size, 'architecture': architecture, 'summary': summary,
+                     'cost': cost})
+
+    def load_summary(self, memory_size: int, architecture: str = X86_64):
+        """ Returns the summary of the completed load run of a memory size or None """
+        return self._loads.get((architecture, memory_size))
+
+    def logs(self, memory_size: int, architecture: str = X86_64):
+        """ Returns the completed invocations of a memory size """
+        return list(self._logs.get((architecture, memory_size), []))
+
+    def cost(self, memory_size: int = None, architecture: str = X86_64):
+        """ Returns the already paid sampling cost of a memory size or of the whole session """
+        if memory_size is None:
+            return sum(self._costs.values())
+        return self._costs.get((architecture, memory_size), 0.0)
+
+    def finish(self):
+        """ Marks the session as finished, the next `start` begins a new session """
+        self._write({'event': 'finish'})
@@ -0,0 +1,457 @@
+import copy
+import math
+from functools import reduce
+import numpy as np
+from model.step_function import TIME_PER_TRANSITION
+
+# inline Map states without MaxConcurrency run up to 40 iterations at the same time
+MAP_DEFAULT_CONCURRENCY = 40
+# loops are unrolled until the remaining probability of another iteration is below `LOOP_TAIL_PROBABILITY`, but at most
+# `MAX_LOOP_ITERATIONS` times, the remaining probability is assigned to the last iteration
+LOOP_TAIL_PROBABILITY = 1e-3
+MAX_LOOP_ITERATIONS = 100
+
+
+class State:
+    def __init__(self, name, arn, state_dict, start, end):
+        self.name = name
+        self.arn = arn
+        self.state_dict = state_dict
+
+        self.start = start
+        self.end = end
+        self.next = []
+
+    def to(self, other):
+        self.next.append(other)
+
+
+def parse_state_machine(definition, next=None, name_to_state=None):
+    if name_to_state is None:
+        name_to_state = {}
+    states = []
+    items = reversed(list(definition['States'].items()))
+
+    for item in items:
+        state_name, state_dict = item[0], item[1]
+        end = state_dict.get('End', False)
+        state = State(name=state_name, arn=state_dict.get('Resource', ''), state_dict=state_dict, start=state_name == definition['StartAt'], end=end)
+        name_to_state[state_name] = state
+
+        if state_dict['Type'] in ['Parallel', 'Map']:
+            if state_dict['Type'] == 'Parallel':
+                branches = state_dict['Branches']
+            else:
+                branches = [state_dict.get('ItemProcessor', state_dict.get('Iterator'))]
+            branch_next = name_to_state.get(state_dict.get('Next'), next)
+            for branch in branches:
+                states += parse_state_machine(branch, branch_next, name_to_state)
+
+            for branch in branches:
+                state.to(name_to_state[branch['StartAt']])
+
+        else:
+            if next and end:
+                state.to(next)
+            elif 'Next' in state_dict:
+                state.to(name_to_state[state_dict['Next']])
+        states.append(state)
+
+    return states
+
+
+def unqualified_lambda_arn(arn: str):
+    """ Strips a version or alias qualifier (e.g. `:128MB`) from a Lambda ARN """
+    return ':'.join(arn.split(':')[:7])
+
+
+def lambda_arn_of_state(state_dict: dict):
+    """ Returns the unqualified Lambda ARN invoked by a Task state or None for all other states """
+    if state_dict.get('Type') != 'Task':
+        return None
+    resource = state_dict.get('Resource', '')
+    if resource.startswith('arn:aws:states:::lambda:invoke'):
+        resource = state_dict.get('Parameters', {}).get('FunctionName', '')
+    if ':lambda:' not in resource or ':function:' not in resource:
+        return None
+    return unqualified_lambda_arn(resource)
+
+
+def _collapse(outcomes: list):
+    """ Merges the outcomes of a latency distribution that have equal latencies by adding their probabilities """
+    merged = {}
+    for p, v in outcomes:
+        value = np.asarray(v, dtype=float)
+        key = (value.shape, value.tobytes())
+        merged[key] = (merged[key][0] + p, merged[key][1]) if key in merged else (p, v)
+    return list(merged.values())
+
+
+def _combine(outcomes_a: list, outcomes_b: list, op):
+    """ Combines two independent latency distributions given as lists of (probability, latency) """
+    return _collapse([(p_a * p_b, op(v_a, v_b)) for p_a, v_a in outcomes_a for p_b, v_b in outcomes_b])
+
+
+def latency_percentile(outcomes: list, percentile: float):
+    """ Returns the latency percentile of a discrete latency distribution
+    :param outcomes: list of (probability, latency), latencies can be numbers or numpy arrays of the same shape
+    :param percentile: percentile in (0, 1], 1 is the worst case over all outcomes with a non zero probability
+    :return latency (number or array)
+    """
+    if len(outcomes) == 1:
+        return outcomes[0][1]
+    probabilities = np.array([p for p, _ in outcomes])
+    values = np.stack(np.broadcast_arrays(*[np.asarray(v, dtype=float) for _, v in outcomes]))
+    order = np.argsort(values, axis=0)
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    cumulative = np.cumsum(probabilities[order], axis=0)
+    index = np.argmax(cumulative >= percentile - 1e-9, axis=0)
+    return np.take_along_axis(sorted_values, np.expand_dims(index, 0), axis=0)[0]
+
+
+class StateNode:
+    """ A state that does not invoke a Lambda function, it only adds a transition.
+
+    `latencies` returns the latency distribution of a node as a list of (probability, latency),
+    `cost` the expected cost.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def latencies(self, durations):
+        return [(1.0, TIME_PER_TRANSITION)]
+
+    def cost(self, costs):
+        return 0
+
+
+class TaskNode(StateNode):
+    """ A Task state invoking the Lambda function `lambda_arns[index]` of the workflow """
+
+    def __init__(self, name: str, index: int):
+        super().__init__(name)
+        self.index = index
+
+    def latencies(self, durations):
+        return [(1.0, TIME_PER_TRANSITION + durations[self.index])]
+
+    def cost(self, costs):
+        return costs[self.index]
+
+
+class SequenceNode:
+    def __init__(self, nodes: list):
+        self.nodes = nodes
+
+    def latencies(self, durations):
+        return reduce(lambda a, b: _combine(a, b, np.add), [node.latencies(durations) for node in self.nodes],
+                      [(1.0, 0)])
+
+    def cost(self, costs):
+        return sum(node.cost(costs) for node in self.nodes)
+
+
+class ParallelNode(StateNode):
+    def __init__(self, name: str, branches: list):
+        super().__init__(name)
+        self.branches = branches
+
+    def latencies(self, durations):
+        outcomes = reduce(lambda a, b: _combine(a, b, np.maximum),
+                          [branch.latencies(durations) for branch in self.branches])
+        return [(p, TIME_PER_TRANSITION + v) for p, v in outcomes]
+
+    def cost(self, costs):
+        return sum(branch.cost(costs) for branch in self.branches)
+
+
+class MapNode(StateNode):
+    """ A Map state running its iterator `iterations` times with at most `max_concurrency` parallel iterations.
+
+    Latency is modeled as consecutive waves of parallel iterations, cost as iterations x cost of one iteration.
+    """
+
+    def __init__(self, name: str, body: SequenceNode, max_concurrency: int, iterations: float):
+        super().__init__(name)
+        self.body = body
+        self.max_concurrency = max_concurrency if max_concurrency else MAP_DEFAULT_CONCURRENCY
+        self.iterations = iterations
+
+    @property
+    def waves(self):
+        return math.ceil(self.iterations / self.max_concurrency)
+
+    def latencies(self, durations):
+        return [(p, TIME_PER_TRANSITION + self.waves * v) for p, v in self.body.latencies(durations)]
+
+    def cost(self, costs):
+        return self.iterations * self.body.cost(costs)
+
+
+class ChoiceNode(StateNode):
+    """ A Choice state taking `branches[i]` with probability `probabilities[i]` """
+
+    def __init__(self, name: str, targets: list, branches: list, probabilities: list,
+                 transition: float = TIME_PER_TRANSITION):
+        """
+        :param transition: time of the state's own transition, 0 if it is already counted by a `LoopNode`
+        """
+        super().__init__(name)
+        self.targets = targets
+        self.branches = branches
+        self.probabilities = probabilities
+        self.transition = transition
+
+    def latencies(self, durations):
+        return _collapse([(p * q, self.transition + v)
+                          for p, branch in zip(self.probabilities, self.branches) if p > 0
+                          for q, v in branch.latencies(durations)])
+
+    def cost(self, costs):
+        return sum(p * branch.cost(costs) for p, branch in zip(self.probabilities, self.branches))
+
+
+class LoopNode(StateNode):
+    """ The states of `body` repeated by the Choice state `name`, which goes back to the start of the body with
+    probability `probability`.
+
+    The number of iterations is geometric with mean 1 / (1 - probability). Latency is the distribution over the
+    unrolled iterations, each of them taking the same outcome of the body and the transition of the Choice state,
+    cost is the expected number of iterations x cost of one iteration.
+    """
+
+    def __init__(self, name: str, target: str, body: SequenceNode, probability: float):
+        super().__init__(name)
+        self.target = target
+        self.body = body
+        self.probability = probability
+
+    @property
+    def iterations(self):
+        return 1 / (1 - self.probability)
+
+    def iteration_probabilities(self):
+        """ Returns the probabilities of 1, 2, ... iterations, the last one includes the remaining tail """
+        p = self.probability
+        count = 1 if p == 0 else min(MAX_LOOP_ITERATIONS, max(1, math.ceil(math.log(LOOP_TAIL_PROBABILITY) /
+                                                                          math.log(p))))
+        probabilities = [(1 - p) * p ** i for i in range(count)]
+        probabilities[-1] += p ** count
+        return probabilities
+
+    def latencies(self, durations):
+        body = self.body.latencies(durations)
+        return _collapse([(r * q, k * (TIME_PER_TRANSITION + v))
+                          for k, r in enumerate(self.iteration_probabilities(), 1) for q, v in body])
+
+    def cost(self, costs):
+        return self.iterations * self.body.cost(costs)
+
+
+class Workflow:
+    """ Compiled state machine, estimates latency and cost from per function durations and costs.
+
+    `durations`/`costs` are aligned with `lambda_arns`, entries can be numbers or numpy arrays of the same shape.
+    """
+
+    def __init__(self, root: SequenceNode, lambda_arns: list, map_states: list, choice_states: list):
+        self.root = root
+        self.lambda_arns = lambda_arns
+        self.map_states = map_states
+        self.choice_states = choice_states
+
+    def elat(self, durations, percentile: float = 1.0):
+        """ Returns the latency percentile over all Choice branch combinations """
+        return latency_percentile(self.root.latencies(durations), percentile)
+
+    def cost(self, costs):
+        """ Returns the expected cost, Choice branches are weighted by their probability """
+        return self.root.cost(costs)
+
+    def elat_over_inputs(self, durations: list, weights: list, percentile: float = 1.0):
+        """ Returns the latency percentile over all Choice branch combinations and input classes
+        :param durations: per input class, durations aligned with `lambda_arns`
+        :param weights: probability of each input class
+        """
+        outcomes = [(weight * p, v) for weight, class_durations in zip(weights, durations) if weight > 0
+                    for p, v in self.root.latencies(class_durations)]
+        return latency_percentile(outcomes, percentile)
+
+    def cost_over_inputs(self, costs: list, weights: list):
+        """ Returns the expected cost over input classes
+        :param costs: per input class, costs aligned with `lambda_arns`
+        :param weights: probability of each input class
+        """
+        return sum(weight * self.root.cost(class_costs) for weight, class_costs in zip(weights, costs))
+
+
+def _successors(state_dict: dict):
+    if state_dict['Type'] == 'Choice':
+        targets = [choice['Next'] for choice in state_dict['Choices']]
+        if 'Default' in state_dict:
+            targets.append(state_dict['Default'])
+        return targets
+    if state_dict.get('End', False) or 'Next' not in state_dict:
+        return []
+    return [state_dict['Next']]
+
+
+def _reachable(states: dict, start: str, exclude: list = ()):
+    """ Returns all states reachable from `start` without passing `exclude` in breadth first order """
+    order = [start]
+    for name in order:
+        for successor in _successors(states[name]):
+            if successor not in order and successor not in exclude:
+                order.append(successor)
+    return order
+
+
+class _WorkflowCompiler:
+    def __init__(self, map_iterations: dict, choice_probabilities: dict):
+        self.map_iterations = map_iterations
+        self.choice_probabilities = choice_probabilities
+        self.lambda_arns = []
+        self.map_states = []
+        self.choice_states = []
+        # states of the sequences that are currently compiled, used to detect loops
+        self._path = []
+
+    def _probabilities(self, name: str, targets: list):
+        """ Returns the mined probabilities of the targets of a Choice state, equally likely if never observed """
+        observed = self.choice_probabilities.get(name, {})
+        total = sum(observed.get(target, 0) for target in targets)
+        if total > 0:
+            return [observed.get(target, 0) / total for target in targets]
+        return [1 / len(targets)] * len(targets)
+
+    def _choice(self, states: dict, name: str, targets: list, transition: float = TIME_PER_TRANSITION):
+        # branches end where all of them meet again, or at the end of the workflow, going back is a loop
+        reachable = [_reachable(states, target, self._path) for target in targets]
+        join = next((s for s in reachable[0] if all(s in r for r in reachable[1:])), None)
+
+        probabilities = self._probabilities(name, targets)
+        branches = [self.compile(states, target, join) for target in targets]
+        node = ChoiceNode(name, targets, branches, probabilities, transition)
+        self.choice_states.append(node)
+        return node, join
+
+    def _loop(self, states: dict, name: str, targets: list, nodes: list, starts: dict):
+        """ Compiles a Choice state that goes back to a state of the current sequence into a `LoopNode` over the
+        nodes since that state, replacing them. Its other targets leave the loop.
+        :param starts: state name -> index of its node in `nodes` for the states of the current sequence
+        :return loop node (followed by the Choice over the exits if there are several) and next state
+        """
+        back = [target for target in targets if target in starts]
+        if len(back) > 1:
+            raise ValueError(f"Choice state {name} loops back to several states {back}, which is not supported")
+        exits = [target for target in targets if target not in back]
+        if not exits:
+            raise ValueError(f"Loop over state {back[0]} never exits at Choice state {name}")
+        probability = self._probabilities(name, targets)[targets.index(back[0])]
+        if probability >= 1:
+            raise ValueError(f"Loop over state {back[0]} was never left at Choice state {name}")
+
+        start = starts[back[0]]
+        loop = LoopNode(name, back[0], SequenceNode(nodes[start:]), probability)
+        del nodes[start:]
+        self.choice_states.append(loop)
+        if len(exits) == 1:
+            return loop, exits[0]
+        # the transition of the Choice state is part of every iteration of the loop
+        exit_node, join = self._choice(states, name, exits, transition=0)
+        return SequenceNode([loop, exit_node]), join
+
+    def compile(self, states: dict, start: str, stop: str = None):
+        nodes = []
+        starts = {}
+        path_length = len(self._path)
+        name = start
+        while name and name != stop:
+            if name in self._path:
+                raise ValueError(f"Loop over state {name} is only supported through a Choice state going back to "
+                                 f"a state of the same branch")
+            self._path.append(name)
+            starts[name] = len(nodes)
+            state_dict = states[name]
+            state_type = state_dict['Type']
+            next_name = None if state_dict.get('End', False) else state_dict.get('Next')
+            if state_type == 'Parallel':
+                branches = [self.compile(branch['States'], branch['StartAt']) for branch in state_dict['Branches']]
+                node = ParallelNode(name, branches)
+            elif state_type == 'Map':
+                iterator = state_dict.get('ItemProcessor', state_dict.get('Iterator'))
+                body = self.compile(iterator['States'], iterator['StartAt'])
+                node = MapNode(name, body, state_dict.get('MaxConcurrency', 0), self.map_iterations.get(name, 1))
+                self.map_states.append(node)
+            elif state_type == 'Choice':
+                targets = []
+                for target in _successors(state_dict):
+                    if target not in targets:
+                        targets.append(target)
+                if any(target in starts for target in targets):
+                    node, next_name = self._loop(states, name, targets, nodes, starts)
+                else:
+                    node, next_name = self._choice(states, name, targets)
+            else:
+                arn = lambda_arn_of_state(state_dict)
+                if arn:
+                    if arn not in self.lambda_arns:
+                        self.lambda_arns.append(arn)
+                    node = TaskNode(name, self.lambda_arns.index(arn))
+                else:
+                    node = StateNode(name)
+            nodes.append(node)
+            name = next_name
+        del self._path[path_length:]
+        return SequenceNode(nodes)
+
+
+def compile_workflow(definition: dict, map_iterations: dict = None, choice_probabilities: dict = None):
+    """ Compiles a state machine definition into a `Workflow`
+    :param definition: parsed state machine definition
+    :param map_iterations: (optional) average number of iterations per Map state name, defaults to 1
+    :param choice_probabilities: (optional) how often each target state of a Choice state was taken
+    (Choice state name -> target state name -> count or probability), defaults to equally likely branches. A Choice
+    state going back to an earlier state of its branch is a loop, repeated with the probability of that target.
+    :return `Workflow`
+    """
+    compiler = _WorkflowCompiler(map_iterations if map_iterations else {},
+                                 choice_probabilities if choice_probabilities else {})
+    root = compiler.compile(definition['States'], definition['StartAt'])
+    return Workflow(root, compiler.lambda_arns, compiler.map_states, compiler.choice_states)
+
+
+def get_lambda_arns(definition: dict):
+    """ Returns the unique, unqualified Lambda ARNs referenced by a state machine definition
+    :param definition: parsed state machine definition
+    :return list of Lambda ARNs in order of first appearance
+    """
+    return compile_workflow(definition).lambda_arns
+
+
+def qualify_lambda_arns(definition: dict, qualifiers: dict):
+    """ Returns a copy of a state machine definition whose Task states invoke the given alias of their function
+    :param definition: parsed state machine definition
+    :param qualifiers: unqualified Lambda ARN -> alias (e.g. `512MB`), functions without alias are unchanged
+    :return new definition
+    """
+    definition = copy.deepcopy(definition)
+
+    def qualify(states: dict):
+        for state_dict in states.values():
+            if state_dict.get('Type') == 'Parallel':
+                for branch in state_dict['Branches']:
+                    qualify(branch['States'])
+            elif state_dict.get('Type') == 'Map':
+                qualify(state_dict.get('ItemProcessor', state_dict.get('Iterator'))['States'])
+            arn = lambda_arn_of_state(state_dict)
+            if arn not in qualifiers:
+                continue
+            if state_dict['Resource'].startswith('arn:aws:states:::lambda:invoke'):
+                state_dict['Parameters']['FunctionName'] = f'{arn}:{qualifiers[arn]}'
+            else:
+                state_dict['Resource'] = f'{arn}:{qualifiers[arn]}'
+
+    qualify(definition['States'])
+    return definition
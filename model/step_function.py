@@ -1,8 +1,10 @@
-import boto3
 import logging
 import json
+import time
 from util.lambda_utils import extract_data_from_log
 from util.utils import get_recursively
+from util.aws_clients import get_client_provider
+from util.metrics import get_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +14,12 @@ COST_PER_TRANSITION = 0.000025
 
 class StepFunction:
 
-    def __init__(self, arn: str):
+    def __init__(self, arn: str, client_provider=None):
         self.state_machine_arn = arn
-        self.logs_client = boto3.client('logs')
-        self.step_functions = boto3.client('stepfunctions')
+        client_provider = client_provider if client_provider else get_client_provider()
+        self.client_provider = client_provider
+        self.logs_client = client_provider.client('logs')
+        self.step_functions = client_provider.client('stepfunctions')
 
     def calculate_execution_cost(self, execution_arn: str):
         """ Calculate aggregated cost of a StepFunction execution
@@ -39,7 +43,8 @@ class StepFunction:
             if events:
                 last_report = list(filter(lambda e: e['message'].startswith('REPORT'), events))[-1]
                 if last_report:
-                    execution_log = extract_data_from_log(last_report['message'])
+                    with get_metrics().phase('log_parsing', function=arn):
+                        execution_log = extract_data_from_log(last_report['message'])
                     logs.append(execution_log)
         for log in logs:
             logger.info(log.to_string())
@@ -53,6 +58,71 @@ class StepFunction:
         """
         return self.step_functions.get_execution_history(executionArn=execution_arn)
 
+    def get_execution_events(self, execution_arn: str):
+        """ Returns all events of a StepFunction execution, following pagination
+        :param execution_arn: ARN of StepFunction execution
+        :return list of history events
+        """
+        paginator = self.step_functions.get_paginator('get_execution_history')
+        events = []
+        for page in paginator.paginate(executionArn=execution_arn):
+            events += page['events']
+        return events
+
+    def list_recent_executions(self, max_executions: int = 10, status: str = 'SUCCEEDED'):
+        """ Returns the ARNs of the most recent executions of the state machine
+        :param max_executions: maximum number of executions to return
+        :param status: only return executions with this status
+        :return list of execution ARNs, most recent first
+        """
+        res = self.step_functions.list_executions(stateMachineArn=self.state_machine_arn, statusFilter=status,
+                                                  maxResults=max_executions)
+        return [e['executionArn'] for e in res['executions']]
+
+    def get_execution_statistics(self, max_executions: int = 10):
+        """ Mines Map iteration counts and Choice branch frequencies from recent executions
+        :param max_executions: number of recent executions to analyze
+        :return tuple of (Map state name -> average iteration count,
+                          Choice state name -> target state name -> number of times the target was taken)
+        """
+        lengths = {}
+        choices = {}
+        for execution_arn in self.list_recent_executions(max_executions):
+            # MapStateStarted points to the MapStateEntered event of the same Map state,
+            # the state entered after a Choice state points to its ChoiceStateExited event
+            entered = {}
+            exited_choices = {}
+            for event in self.get_execution_events(execution_arn):
+                if event['type'] == 'MapStateEntered':
+                    entered[event['id']] = event['stateEnteredEventDetails']['name']
+                elif event['type'] == 'MapStateStarted' and event.get('previousEventId') in entered:
+                    name = entered[event['previousEventId']]
+                    lengths.setdefault(name, []).append(event['mapStateStartedEventDetails']['length'])
+                elif event['type'] == 'ChoiceStateExited':
+                    exited_choices[event['id']] = event['stateExitedEventDetails']['name']
+                elif event['type'].endswith('StateEntered') and event.get('previousEventId') in exited_choices:
+                    choice = choices.setdefault(exited_choices[event['previousEventId']], {})
+                    target = event['stateEnteredEventDetails']['name']
+                    choice[target] = choice.get(target, 0) + 1
+        map_iterations = {name: sum(values) / len(values) for name, values in lengths.items()}
+        return map_iterations, choices
+
+    def get_map_iterations(self, max_executions: int = 10):
+        """ Returns the observed average number of iterations of each Map state over recent executions
+        :param max_executions: number of recent executions to analyze
+        :return dict mapping Map state names to their average iteration count
+        """
+        return self.get_execution_statistics(max_executions)[0]
+
+    def get_choice_probabilities(self, max_executions: int = 10):
+        """ Returns how often each branch of each Choice state was taken over recent executions
+        :param max_executions: number of recent executions to analyze
+        :return dict mapping Choice state names to dicts of target state name -> probability
+        """
+        choices = self.get_execution_statistics(max_executions)[1]
+        return {name: {target: count / sum(counts.values()) for target, count in counts.items()}
+                for name, counts in choices.items()}
+
     def check_if_execution_finished(self, execution_arn: str):
         """ Check execution history to see if execution has finished
         :param execution_arn: ARN of StepFunction execution
@@ -84,13 +154,73 @@ class StepFunction:
         """
         return self.step_functions.start_execution(stateMachineArn=self.state_machine_arn, input=payload)
 
+    def describe(self):
+        """ Returns the description of the state machine (definition, role, type, ...) """
+        return self.step_functions.describe_state_machine(stateMachineArn=self.state_machine_arn)
+
+    def create_variant(self, name: str, definition: dict):
+        """ Creates a new state machine with the role and type of this one and the given definition
+        :param name: name of the new state machine
+        :param definition: parsed definition of the new state machine
+        :return `StepFunction` of the new state machine
+        """
+        description = self.describe()
+        res = self.step_functions.create_state_machine(name=name, definition=json.dumps(definition),
+                                                       roleArn=description['roleArn'], type=description['type'])
+        return StepFunction(res['stateMachineArn'], self.client_provider)
+
+    def delete(self):
+        """ Deletes the state machine """
+        logger.info(f"Deleting state machine {self.state_machine_arn}")
+        self.step_functions.delete_state_machine(stateMachineArn=self.state_machine_arn)
+
+    def wait_for_execution(self, execution_arn: str, poll_interval: float = 2):
+        """ Polls an execution until it is no longer running
+        :return description of the finished execution
+        """
+        while True:
+            description = self.step_functions.describe_execution(executionArn=execution_arn)
+            if description['status'] != 'RUNNING':
+                return description
+            time.sleep(poll_interval)
+
+    def get_task_durations(self, execution_arn: str):
+        """ Returns the Lambda steps of an execution from its history
+        :param execution_arn: ARN of StepFunction execution
+        :return list of (qualified Lambda ARN, step duration in ms), number of state transitions
+        """
+        scheduled = {}
+        started = {}
+        steps = []
+        transitions = 0
+        for event in self.get_execution_events(execution_arn):
+            event_type = event['type']
+            if event_type.endswith('StateEntered'):
+                transitions += 1
+            elif event_type == 'LambdaFunctionScheduled':
+                scheduled[event['id']] = event['lambdaFunctionScheduledEventDetails']['resource']
+            elif event_type == 'TaskScheduled' and event['taskScheduledEventDetails']['resourceType'] == 'lambda':
+                parameters = json.loads(event['taskScheduledEventDetails']['parameters'])
+                scheduled[event['id']] = parameters.get('FunctionName', '')
+            elif event_type in ['LambdaFunctionStarted', 'TaskStarted'] and event.get('previousEventId') in scheduled:
+                started[event['id']] = (scheduled[event['previousEventId']], event['timestamp'])
+            elif event_type in ['LambdaFunctionSucceeded', 'LambdaFunctionFailed', 'LambdaFunctionTimedOut',
+                                'TaskSucceeded', 'TaskFailed', 'TaskTimedOut'] and \
+                    event.get('previousEventId') in started:
+                arn, timestamp = started[event['previousEventId']]
+                steps.append((arn, (event['timestamp'] - timestamp).total_seconds() * 1000))
+        return steps, transitions
+
+    def get_definition(self):
+        """ Returns the parsed definition of the state machine """
+        definition = self.step_functions.describe_state_machine(stateMachineArn=self.state_machine_arn)['definition']
+        return json.loads(definition)
+
     def get_lambda_resources(self):
         """
         Extracts all Lambda ARNs from state machine definition
         """
-        definition = self.step_functions.describe_state_machine(stateMachineArn=self.state_machine_arn)['definition']
-        definition = json.loads(definition)
-        return get_recursively(definition, 'Resource')
+        return get_recursively(self.get_definition(), 'Resource')
 
     @staticmethod
     def _extract_lambda_arns(history: dict):
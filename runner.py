@@ -1,7 +1,6 @@
 # Tool to run individual or worklfow experimentes for fixed siezes.
 from model.execution_log import ExecutionLog
 from model.lambda_function import LambdaFunction
-import boto3
 import os
 import csv
 from util.utils import timeit
@@ -10,10 +9,9 @@ import numpy as np
 import time
 import json
 from model.step_function import StepFunction
+from model.sampling_journal import SamplingJournal
 from util.utils import get_recursively
-
-
-client = boto3.client('lambda')
+from util.metrics import get_metrics
 
 
 class StepFunctionExecutionLog:
@@ -55,10 +53,11 @@ def get_alias_for_memory_size(memory_size: int):
 
 def create_alias_if_needed(lambda_function, memory_size: int):
     alias = get_alias_for_memory_size(memory_size)
-    if lambda_function.verify_alias_exists(alias):
-        print(f'{alias} already exists, skipping creation.')
-    else:
-        lambda_function.create_memory_config(value=memory_size, alias=alias)
+    with get_metrics().phase('alias_provisioning', function=lambda_function.arn):
+        if lambda_function.verify_alias_exists(alias):
+            print(f'{alias} already exists, skipping creation.')
+        else:
+            lambda_function.create_memory_config(value=memory_size, alias=alias)
 
     return alias
 
@@ -81,34 +80,45 @@ def execute_function(lambda_function: LambdaFunction, memory_size: int, payload:
 
 @timeit
 def run(arn: str, payload: dict, memory_sizes: list, runs_per_size: int = 5):
-    f = LambdaFunction(arn, client)
+    f = LambdaFunction(arn)
     avg_logs = []
-    total_sampling_cost = 0.0
-    initial_memory_size = f.get_memory_size()
+    # resumes an interrupted run, completed invocations are not repeated
+    journal = SamplingJournal(f'./logs/{arn}/session.jsonl')
+    config = f.get_config()
+    # samples of an earlier session are only reused with the same payload, code and runs per memory size
+    fingerprint = SamplingJournal.fingerprint_of({'payload': payload, 'code': config.get('CodeSha256'),
+                                                  'runs_per_size': runs_per_size})
+    initial_memory_size = journal.start(config['MemorySize'], fingerprint=fingerprint)
+    total_sampling_cost = journal.cost()
     all_logs = []
-    for memory_size in memory_sizes:
-        logs = []
-        for i in range(runs_per_size):
-            log, cost = execute_function(lambda_function=f, memory_size=memory_size, payload=payload)
-            # parse_from_csv(f"./logs/{self.function_name}/{memory_size}.csv")
-            logs.append(log)
-            all_logs.append(log)
-            total_sampling_cost += cost
-
-        avg_duration = sum(log.duration for log in logs) / len(logs)
-        avg_billed_duration = sum(log.billed_duration for log in logs) / len(logs)
-        avg_logs.append(
-            ExecutionLog(memory_size=memory_size, duration=avg_duration, billed_duration=avg_billed_duration))
+    try:
+        for memory_size in memory_sizes:
+            logs = journal.logs(memory_size)
+            all_logs += logs
+            for i in range(len(logs), runs_per_size):
+                log, cost = execute_function(lambda_function=f, memory_size=memory_size, payload=payload)
+                # parse_from_csv(f"./logs/{self.function_name}/{memory_size}.csv")
+                journal.record(log, cost)
+                logs.append(log)
+                all_logs.append(log)
+                total_sampling_cost += cost
+
+            avg_duration = sum(log.duration for log in logs) / len(logs)
+            avg_billed_duration = sum(log.billed_duration for log in logs) / len(logs)
+            avg_logs.append(
+                ExecutionLog(memory_size=memory_size, duration=avg_duration, billed_duration=avg_billed_duration))
+    finally:
+        # reset to initial memory size
+        f.set_memory_size(initial_memory_size)
+    journal.finish()
     timestamp = datetime.now().strftime("%d_%b_%Y_%H_%M_%S")
     save_logs(all_logs, filepath=f'./logs/{arn}/raw_{timestamp}.csv')
-    # reset to initial memory size
-    f.set_memory_size(initial_memory_size)
 
     logs_path = f'./logs/{arn}/avg.csv'
     save_logs(avg_logs, filepath=logs_path)
     return avg_logs, logs_path, total_sampling_cost
 
-def save_logs(logs, file_name):
+def save_workflow_logs(logs, file_name):
     fieldnames = ['Duration', 'Cost']
 
     with open(f'./logs/{file_name}.csv', 'w+') as file:
@@ -158,10 +168,10 @@ def run_workflow(arn, sizes, outfile,lambdas ,number_of_runs = 6):
             continue
         logs.append(log)
 
-    save_logs(logs, outfile + '_raw')
+    save_workflow_logs(logs, outfile + '_raw')
     avg_duration = sum(log.duration for log in logs) / len(logs)
     avg_cost = sum(log.cost for log in logs) / len(logs)
-    save_logs([StepFunctionExecutionLog(avg_duration, avg_cost)],
+    save_workflow_logs([StepFunctionExecutionLog(avg_duration, avg_cost)],
               file_name=outfile + '_avg')
     print(f"Average duration: {avg_duration}")
     print(f"Average cost: {'{0:.10f}'.format(avg_cost)}")
\ No newline at end of file
@@ -0,0 +1,31 @@
+# Long-running local sizing service, answers repeated recommendation requests from models kept in memory.
+import sys
+from sizer.sizing_service import SizingService, create_server
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+
+    if len(argv) > 0 and argv[0] in ['-h', '--help']:
+        print("Usage: [<port>] [<cache-size>]  (defaults to port 8080 on 127.0.0.1 and 1024 cached results)")
+        print("       --socket <path> [<cache-size>]")
+        exit(0)
+
+    socket_path = None
+    port = 8080
+    if len(argv) > 1 and argv[0] == '--socket':
+        socket_path = argv[1]
+        argv = argv[2:]
+    elif len(argv) > 0:
+        port = int(argv[0])
+        argv = argv[1:]
+    cache_size = int(argv[0]) if len(argv) > 0 else 1024
+
+    server = create_server(SizingService(cache_size=cache_size), port=port, socket_path=socket_path)
+    print(f"Listening on {socket_path if socket_path else f'http://127.0.0.1:{port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,54 +1,22 @@
 
+import atexit
 import json
 from util.utils import get_recursively
+from util.metrics import get_metrics
+from model.state_machine import parse_state_machine
 from sizer.regression_sizer import RegressionSizer
 from sizer.workflow_sizer import WorkflowSizer
-class State:
-    def __init__(self, name, arn, state_dict, start, end):
-        self.name = name
-        self.arn = arn
-        self.state_dict = state_dict
-
-        self.start = start
-        self.end = end
-        self.next = []
-
-    def to(self, other):
-        self.next.append(other)
-
-
-
-def parse_state_machine(definition, next=None):
-    states = []
-    items = reversed(list(definition['States'].items()))
-
-    for item in items:
-        state_name, state_dict = item[0], item[1]
-        end = state_dict.get('End', False)
-        state = State(name=state_name, arn=state_dict.get('Resource', ''), state_dict=state_dict, start=state_name == definition['StartAt'], end=end)
-        name_to_state[state_name] = state
-
-        if state_dict['Type'] == 'Parallel':
-            branch_next = name_to_state[state_dict['Next']]
-            for branch in state_dict['Branches']:
-                states += parse_state_machine(branch, branch_next)
-
-            for branch in state_dict['Branches']:
-                state.to(name_to_state[branch['StartAt']])
-
-        else:
-            if next and end:
-                state.to(next)
-            elif 'Next' in state_dict:
-                state.to(name_to_state[state_dict['Next']])
-        states.append(state)
-
-    return states
-
-
-
+from sizer.batch_sizer import BatchSizer, load_manifest
 
 
+def pop_option(argv, name):
+    """ Removes `name <value>` from argv and returns the value """
+    if name in argv:
+        i = argv.index(name)
+        value = argv[i + 1]
+        del argv[i:i + 2]
+        return value
+    return None
 
 
 if __name__ == '__main__':
@@ -62,15 +30,31 @@ if __name__ == '__main__':
     sizes = [128,256,512,1024,2048,3096]
     name_to_state = {}
 
+    metrics_json = pop_option(argv, '--metrics-json')
+    metrics_prom = pop_option(argv, '--metrics-prom')
+    if metrics_json or metrics_prom:
+        atexit.register(get_metrics().export, metrics_json, metrics_prom)
+
     if len(argv) <= 1:
         print("Usage: <workflow-arn> <workflow.json> <elat_constraint> <payloads> <sizes>")
+        print("       --manifest <manifest.json> [<results.jsonl>]")
+        print("       optional: --metrics-json <report.json> --metrics-prom <metrics.prom>")
+        exit(0)
+
+    if argv[0] == '--manifest':
+        batch = BatchSizer(load_manifest(argv[1]))
+        if len(argv) > 2:
+            with open(argv[2], 'w') as out:
+                batch.stream(out)
+        else:
+            batch.stream()
         exit(0)
 
     #TODO: needs content validation ;)
     arn = argv[0]
     file = argv[1]
     if len(argv) > 2:
-        elat_constraint=argv[2]
+        elat_constraint=float(argv[2])
     if len(argv) > 3:
         with open(argv[3]) as f:
             payloads = json.load(f)
@@ -83,11 +67,9 @@ if __name__ == '__main__':
         json_content = json.load(f)
 
     print(get_recursively(json_content, 'Resource'))
-    states = list(reversed(parse_state_machine(json_content)))
-
+    states = list(reversed(parse_state_machine(json_content, name_to_state=name_to_state)))
 
 
-    lambda_client = boto3.client('lambda')
     lambdas = []
     transitions = []
     states_list = []
@@ -128,7 +110,7 @@ if __name__ == '__main__':
         total_cost += total_cost
         total_duration += result.duration
     
-    wfs = WorkflowSizer(arn,elat_constraint)
+    wfs = WorkflowSizer(arn,elat_constraint,definition=json_content)
     
     sizes,elat,cost = wfs.run()
     res = {
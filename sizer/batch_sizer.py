@@ -0,0 +1,196 @@
+import json
+import logging
+import sys
+from model.state_machine import get_lambda_arns, unqualified_lambda_arn
+from model.step_function import StepFunction
+from sizer.bayesian_sizer import BayesianRegressionSizer
+from sizer.payload_sizer import PayloadRegressionSizer
+from sizer.regression_sizer import RegressionSizer
+from sizer.workflow_sizer import WorkflowSizer
+from util.aws_clients import get_client_provider
+from util.load_generator import LoadProfile
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(path: str):
+    """ Loads a batch manifest and resolves file references relative to the working directory
+
+    Expected format:
+    {
+        "memory_sizes": [128, 256, 512, 1024, 2048, 3008],  (optional)
+        "sample_runs": 5,                                     (optional)
+        "concurrency": 1,                                     (optional, concurrent invocations when sampling)
+        "architectures": ["x86_64", "arm64"],                 (optional, default is the deployed architecture)
+        "change_architecture": true,                          (optional, allow sampling other architectures than the
+                                                               deployed one, switches the live function meanwhile)
+        "balanced_weight": 0.5,                               (optional)
+        "optimizer": "annealing" or "genetic",               (optional)
+        "load_profile": {"concurrency": 10} or {"rate": 50, "duration": 30},  (optional, sample under load)
+        "load_statistic": "p95",                              (optional, statistic the models are fitted on)
+        "bayesian": true,                                     (optional, few samples and a prior from the repository)
+        "workflows": [
+            {
+                "arn": "<state machine arn>",
+                "definition": "<workflow.json>",              (optional, fetched from AWS if missing)
+                "elat_constraint": 2000,                      (optional)
+                "map_iterations": {<map state name>: 100},    (optional, mined from recent executions if missing)
+                "choice_probabilities": {<choice state name>: {<target state name>: 0.9}},  (optional, mined)
+                "percentile": 0.95,                           (optional, latency percentile over Choice branches)
+                "payloads": "<payloads.json>" or {<lambda arn>: <payload>}  (optional, a list of payload classes
+                    [{"payload": {...}, "input_size": <MB>, "weight": 0.8}, ...] samples several input sizes)
+                "input_distribution": [{"input_size": <MB>, "weight": 0.8}, ...]  (optional, workflow inputs)
+            }
+        ]
+    }
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    for workflow in manifest['workflows']:
+        for key in ['definition', 'payloads']:
+            if isinstance(workflow.get(key), str):
+                with open(workflow[key]) as f:
+                    workflow[key] = json.load(f)
+    return manifest
+
+
+class BatchSizer:
+    """ Sizes many workflows in one process.
+
+    Lambda functions shared between workflows are sampled and fitted only once, all workflows share the clients
+    of one `ClientProvider`.
+    """
+
+    def __init__(self, manifest: dict, client_provider=None):
+        self.manifest = manifest
+        self.memory_sizes = manifest.get('memory_sizes', [128, 256, 512, 1024, 2048, 3008])
+        self.sample_runs = manifest.get('sample_runs', 5)
+        self.concurrency = manifest.get('concurrency', 1)
+        self.architectures = manifest.get('architectures')
+        self.change_architecture = manifest.get('change_architecture', False)
+        self.balanced_weight = manifest.get('balanced_weight', 0.5)
+        self.optimizer = manifest.get('optimizer', 'annealing')
+        self.load_profile = LoadProfile.from_dict(manifest['load_profile']) if 'load_profile' in manifest else None
+        self.load_statistic = manifest.get('load_statistic', 'median')
+        self.bayesian = manifest.get('bayesian', False)
+
+        self.client_provider = client_provider if client_provider else get_client_provider()
+
+        # arn -> performance model / per function result, shared across all workflows
+        self.models = {}
+        self.payload_models = {}
+        self.function_results = {}
+        self.payloads = {}
+
+    def _size_function(self, arn: str, payload: dict):
+        if arn in self.models:
+            if payload != self.payloads[arn]:
+                logger.warning(f"{arn} is shared with a different payload, reusing the first sampled model")
+            return self.function_results[arn], 0.0
+
+        if isinstance(payload, list):
+            # payload classes of different input sizes
+            sizer = PayloadRegressionSizer(lambda_arn=arn, payload_classes=payload,
+                                           balanced_weight=self.balanced_weight, sample_runs=self.sample_runs,
+                                           memory_sizes=self.memory_sizes, client_provider=self.client_provider,
+                                           concurrency=self.concurrency, architectures=self.architectures,
+                                           change_architecture=self.change_architecture,
+                                           load_profile=self.load_profile, load_statistic=self.load_statistic)
+        elif self.bayesian:
+            # few sampled sizes, the remaining ones of `memory_sizes` are only sampled if the model is not confident
+            sizer = BayesianRegressionSizer(lambda_arn=arn, payload=payload, balanced_weight=self.balanced_weight,
+                                            client_provider=self.client_provider, concurrency=self.concurrency,
+                                            architectures=self.architectures,
+                                            change_architecture=self.change_architecture,
+                                            load_profile=self.load_profile, load_statistic=self.load_statistic,
+                                            candidate_memory_sizes=self.memory_sizes)
+        else:
+            sizer = RegressionSizer(lambda_arn=arn, payload=payload, balanced_weight=self.balanced_weight,
+                                    sample_runs=self.sample_runs, memory_sizes=self.memory_sizes,
+                                    client_provider=self.client_provider, concurrency=self.concurrency,
+                                    architectures=self.architectures, change_architecture=self.change_architecture,
+                                    load_profile=self.load_profile, load_statistic=self.load_statistic)
+        result, logs, popt, cost = sizer.configure_function()
+        self.models[arn] = sizer.models[result.architecture]
+        self.payload_models[arn] = getattr(sizer, 'payload_models', {}).get(result.architecture)
+        self.payloads[arn] = payload
+        self.function_results[arn] = {
+            'arn': arn,
+            'architecture': result.architecture,
+            'memorySize': result.memory_size,
+            'cost': result.cost,
+            'duration': result.duration,
+            'total_cost': cost,
+        }
+        return self.function_results[arn], cost
+
+    @staticmethod
+    def _payloads_by_function(payloads: dict, lambda_arns: list, workflow_arn: str):
+        """ Keys the payloads of a workflow by unqualified Lambda ARN, like the functions of its definition
+        :raise ValueError for payloads of functions that are not part of the workflow
+        """
+        normalized = {}
+        for arn, payload in payloads.items():
+            function_arn = unqualified_lambda_arn(arn)
+            if function_arn in normalized and normalized[function_arn] != payload:
+                raise ValueError(f"Different payloads for {function_arn} in workflow {workflow_arn}")
+            normalized[function_arn] = payload
+        unknown = [arn for arn in normalized if arn not in lambda_arns]
+        if unknown:
+            raise ValueError(f"Payloads for {unknown} which are not invoked by workflow {workflow_arn}")
+        return normalized
+
+    def size_workflow(self, workflow: dict):
+        """ Sizes all functions of a single workflow (reusing already fitted models) and optimizes the workflow
+        :param workflow: workflow entry of the manifest
+        :return dict with the sizing result of the workflow
+        """
+        arn = workflow['arn']
+        step_function = StepFunction(arn=arn, client_provider=self.client_provider)
+        definition = workflow.get('definition') or step_function.get_definition()
+        lambda_arns = get_lambda_arns(definition)
+        payloads = self._payloads_by_function(workflow.get('payloads') or {}, lambda_arns, arn)
+
+        total_cost = 0
+        total_duration = 0
+        functions = []
+        for f in lambda_arns:
+            res, cost = self._size_function(f, payloads.get(f, {}))
+            functions.append(res)
+            total_cost += cost
+            total_duration += res['duration']
+
+        performance_models = [self.models[f['arn']] for f in functions]
+        wfs = WorkflowSizer(arn, workflow.get('elat_constraint', 2000), performance_models=performance_models,
+                            step_function=step_function, definition=definition,
+                            map_iterations=workflow.get('map_iterations'),
+                            choice_probabilities=workflow.get('choice_probabilities'),
+                            percentile=workflow.get('percentile', 0.95),
+                            input_distribution=workflow.get('input_distribution'),
+                            payload_models=[self.payload_models[f['arn']] for f in functions])
+        sizes, elat, cost = wfs.run(method=self.optimizer)
+        return {
+            'arn': arn,
+            'cost': cost,
+            'elat': elat,
+            'total_cost': total_cost,
+            'total_duration': total_duration,
+            'sizes': sizes,
+            'functions': functions,
+        }
+
+    def run(self):
+        """ Sizes all workflows of the manifest, yielding one result per workflow as soon as it is finished """
+        for workflow in self.manifest['workflows']:
+            try:
+                yield self.size_workflow(workflow)
+            except Exception as e:
+                logger.error(f"Sizing of {workflow['arn']} failed: {e}")
+                yield {'arn': workflow['arn'], 'error': str(e)}
+
+    def stream(self, out=sys.stdout):
+        """ Writes each workflow result as a single JSON line to `out` as soon as it is available """
+        for res in self.run():
+            out.write(json.dumps(res) + '\n')
+            out.flush()
@@ -0,0 +1,128 @@
+import logging
+import numpy as np
+from model.model_prior import ModelPrior, fit_map, predictive_relative_std
+from model.sampling_journal import SamplingJournal
+from sizer.population_optimizer import memory_grid
+from sizer.regression_sizer import RegressionSizer
+from util.lambda_constants import MAX_MEMORY_SIZE
+from util.metrics import get_metrics
+from util.pricing import X86_64
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CANDIDATE_MEMORY_SIZES = [128, 1024, 3008, MAX_MEMORY_SIZE]
+# largest default candidate if the prior does not know the sampled memory sizes of its models
+DEFAULT_MAX_CANDIDATE_MEMORY_SIZE = 3008
+
+
+class BayesianRegressionSizer(RegressionSizer):
+    """ Sizes a new function with few invocations by combining them with a prior built from the models of similar
+    functions in the repository.
+
+    Samples `memory_sizes` first, fits the maximum a posteriori model and adds memory sizes from
+    `candidate_memory_sizes` (the one with the most uncertain prediction first) until the relative standard deviation
+    of the predicted durations is at most `max_relative_std`. Without a usable prior it falls back to the regular
+    fit of `RegressionSizer`.
+    """
+
+    def __init__(self, lambda_arn: str, payload: dict, balanced_weight: float = 0.5, sample_runs: int = 2,
+                 memory_sizes: list = [512, 2048], candidate_memory_sizes: list = None,
+                 max_relative_std: float = 0.1, noise: float = 0.05, prior: ModelPrior = None,
+                 group_by_function: bool = True, **kwargs):
+        """
+        :param candidate_memory_sizes: memory sizes that are sampled if the model is not confident yet, defaults to
+            `DEFAULT_CANDIDATE_MEMORY_SIZES` up to the largest memory size sampled for the models of the prior
+        :param max_relative_std: maximum relative standard deviation of the predicted durations on the memory grid
+        :param noise: relative standard deviation of averaged durations
+        :param prior: (optional) prior to use, built from the repository if not given
+        :param group_by_function: build the prior from functions with the same runtime and a similar package size
+        """
+        super().__init__(lambda_arn, payload, balanced_weight=balanced_weight, sample_runs=sample_runs,
+                         memory_sizes=memory_sizes, **kwargs)
+        self.candidate_memory_sizes = candidate_memory_sizes
+        self.max_relative_std = max_relative_std
+        self.noise = noise
+        self.group_by_function = group_by_function
+        self.priors = {}
+        if prior:
+            self.priors = {architecture: prior for architecture in self.architectures}
+        self.relative_std = None
+
+    def _prior(self, architecture: str):
+        if architecture not in self.priors:
+            runtime, code_size = None, None
+            if self.group_by_function:
+                config = self.lambda_function.get_config()
+                runtime, code_size = config.get('Runtime'), config.get('CodeSize')
+            self.priors[architecture] = ModelPrior.from_repository(architecture=architecture, runtime=runtime,
+                                                                   code_size=code_size,
+                                                                   exclude=self.lambda_function.arn)
+        return self.priors[architecture]
+
+    def _candidates(self, architecture: str):
+        """ Returns the given candidate memory sizes, or the defaults up to the largest size sampled for the prior """
+        if self.candidate_memory_sizes is not None:
+            return list(self.candidate_memory_sizes)
+        prior = self._prior(architecture)
+        max_memory_size = prior.max_memory_size if prior and prior.max_memory_size else \
+            DEFAULT_MAX_CANDIDATE_MEMORY_SIZE
+        return [size for size in DEFAULT_CANDIDATE_MEMORY_SIZES if size <= max_memory_size]
+
+    def _posterior(self, logs_path: str, architecture: str):
+        """ Returns the MAP model, the posterior covariance of its log parameters and the largest relative standard
+        deviation of its predictions on the memory grid
+        """
+        xdata, ydata = self._read_logs(logs_path)
+        with get_metrics().phase('fitting', function=self.lambda_function.arn):
+            model, covariance = fit_map(xdata, ydata, self._prior(architecture), self.noise, architecture,
+                                        self.lambda_function.region)
+        grid = memory_grid(self.min_memory_size(architecture))
+        relative_std = predictive_relative_std(model, covariance, grid)
+        return model, covariance, float(relative_std.max())
+
+    def _sample_architecture(self, journal: SamplingJournal, architecture: str):
+        if self._prior(architecture) is None:
+            logger.info("No prior available, sampling all candidate memory sizes")
+            memory_sizes = self.memory_sizes
+            self.memory_sizes = sorted(set(memory_sizes + self._candidates(architecture)))
+            try:
+                return super()._sample_architecture(journal, architecture)
+            finally:
+                self.memory_sizes = memory_sizes
+
+        memory_sizes = self.memory_sizes
+        candidates = self._candidates(architecture)
+        total_cost = 0.0
+        try:
+            while True:
+                # sizes sampled in earlier rounds are replayed from the journal
+                logs_path, cost = super()._sample_architecture(journal, architecture)
+                total_cost += cost
+                model, covariance, relative_std = self._posterior(logs_path, architecture)
+                # sizes that were already sampled do not reduce the uncertainty
+                candidates = [size for size in candidates
+                              if size >= self.min_memory_size(architecture) and size not in self.memory_sizes]
+                logger.info(f"Posterior relative std {relative_std:.3f} with memory sizes {self.memory_sizes}")
+                if relative_std <= self.max_relative_std or not candidates:
+                    return logs_path, total_cost
+                # sample where the prediction is the most uncertain
+                stds = predictive_relative_std(model, covariance, candidates)
+                self.memory_sizes = self.memory_sizes + [candidates.pop(int(np.argmax(stds)))]
+        finally:
+            self.memory_sizes = memory_sizes
+
+    def _fit(self, logs_path: str, architecture: str = X86_64):
+        """ Fits and saves the MAP model of an architecture, falls back to the regular fit without prior
+        :return fitted performance model
+        """
+        if self._prior(architecture) is None:
+            return super()._fit(logs_path, architecture)
+        model, covariance, self.relative_std = self._posterior(logs_path, architecture)
+        model.min_memory_size = self.min_memory_size(architecture)
+        xdata, ydata = self._read_logs(logs_path)
+        self.fit_quality = self._r_squared(ydata, model.get_duration(xdata))
+        self.held_out_errors = None
+
+        self._save_model(model, architecture, max_sampled_memory_size=int(max(xdata)))
+        self.models[architecture] = model
+        return model
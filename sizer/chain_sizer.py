@@ -1,9 +1,10 @@
-import json
 import math
 from gekko import GEKKO
 from model.step_function import StepFunction, TIME_PER_TRANSITION, COST_PER_TRANSITION
-from model.performance_model import PerformanceModel
-from util.lambda_constants import MIN_MEMORY_SIZE, MIN_COST
+from model.model_repository import ModelRepository
+from util.lambda_constants import MIN_MEMORY_SIZE, MAX_MEMORY_SIZE, STATIC_INVOCATION_COST
+from util.metrics import get_metrics
+from util.pricing import gb_second_price
 
 
 class ChainSizer:
@@ -14,40 +15,38 @@ class ChainSizer:
         self.cost_constraint = cost_constraint
         self.step_function = StepFunction(arn=state_machine_arn)
 
-    def run(self, performance_models=None):
+    def run(self, performance_models=None, max_memory_size: int = MAX_MEMORY_SIZE):
         # extract lambda arns from state machine
         if not performance_models:
             lambda_arns = self.step_function.get_lambda_resources()
             print(lambda_arns)
             performance_models = self.load_performance_models(lambda_arns)
 
-        a = [p.t0 for p in performance_models]
-        b = [p._lambda for p in performance_models]
-        c = [p.t_min for p in performance_models]
-
         m = GEKKO(remote=True)
 
-        max_memory_size = 3008
-
         # create variables
         x = m.Array(m.Var, len(performance_models), lb=MIN_MEMORY_SIZE, ub=max_memory_size)
+        for var, model in zip(x, performance_models):
+            var.lower = model.min_memory_size
         I = range(len(x))
 
         state_machine_transition_time = TIME_PER_TRANSITION * (len(x) + 1)
         state_machine_transition_cost = COST_PER_TRANSITION * (len(x) + 1)
 
         def duration(i):
-            return a[i] * math.e ** (-b[i] * x[i]) + c[i]
+            return performance_models[i].gekko_duration(m, x[i])
 
         def base_cost(i):
-            return MIN_COST * (x[i] / MIN_MEMORY_SIZE)
+            # price per ms of the memory size, priced like `compute_cost`
+            model = performance_models[i]
+            return gb_second_price(model.architecture, model.region) / 1000 * (x[i] / 1024)
 
         def aggr_duration():
             y = state_machine_transition_time + m.sum([duration(i) for i in I])
             return y
 
         def aggr_cost():
-            y = state_machine_transition_cost + m.sum([base_cost(i) * duration(i) for i in I])
+            y = state_machine_transition_cost + m.sum([base_cost(i) * duration(i) + STATIC_INVOCATION_COST for i in I])
             return y
 
         if self.constraint_type == 'Cost':
@@ -59,7 +58,8 @@ class ChainSizer:
             m.Equation(aggr_duration() < self.duration_constraint)
             m.Minimize(aggr_cost())
 
-        m.solve(disp=False)
+        with get_metrics().phase('optimization', function=self.state_machine_arn):
+            m.solve(disp=False)
         res = [var.value[0] for var in x]
 
         sum_d = state_machine_transition_time
@@ -91,11 +91,4 @@ class ChainSizer:
 
     @staticmethod
     def load_performance_model(arn):
-        with open('./performance_model_repository.json', 'r') as f:
-            repo = json.load(f)
-
-        if arn in repo:
-            variables = repo[arn]
-            return PerformanceModel(t0=variables[0], _lambda=variables[1], t_min=variables[2])
-
-        return None
+        return ModelRepository().get(arn)
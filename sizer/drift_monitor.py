@@ -0,0 +1,168 @@
+import logging
+import re
+import time
+from collections import deque
+import numpy as np
+from botocore.exceptions import ClientError
+from model.cleaner import Cleaner
+from model.lambda_function import LambdaFunction
+from model.model_repository import ModelRepository
+from sizer.population_optimizer import memory_grid
+from sizer.regression_sizer import RegressionSizer
+from util.aws_clients import get_client_provider
+from util.lambda_constants import MIN_MEMORY_SIZE, MAX_MEMORY_SIZE, MEMORY_STEP_SIZE
+from util.lambda_utils import extract_data_from_log
+from util.metrics import get_metrics
+from util.pricing import X86_64
+
+logger = logging.getLogger(__name__)
+
+
+class DriftResult:
+    def __init__(self, arn: str, memory_size: int, architecture: str, predicted: float, observed: float,
+                 samples: int, threshold: float):
+        self.arn = arn
+        self.memory_size = memory_size
+        self.architecture = architecture
+        self.predicted = predicted
+        self.observed = observed
+        self.samples = samples
+        self.residual = (observed - predicted) / predicted if samples else 0.0
+        self.drifted = samples > 0 and abs(self.residual) > threshold
+
+    def to_dict(self):
+        return {'arn': self.arn, 'memorySize': self.memory_size, 'architecture': self.architecture,
+                'predicted': self.predicted, 'observed': self.observed, 'samples': self.samples,
+                'residual': self.residual, 'drifted': self.drifted}
+
+
+class DriftMonitor:
+    """ Compares production REPORT durations at the deployed memory size with the models of the repository and
+    re-samples only the functions whose models drifted, around the optimum of the stale model.
+    """
+
+    def __init__(self, repository: ModelRepository = None, client_provider=None, threshold: float = 0.2,
+                 lookback_hours: float = 24, max_reports: int = 500, min_reports: int = 20,
+                 balanced_weight: float = 0.5, window_hours: float = 1):
+        """
+        :param threshold: maximum relative residual of the median production duration
+        :param lookback_hours: age of the oldest REPORT line considered
+        :param max_reports: maximum number of REPORT lines read per function, the most recent ones are kept
+        :param min_reports: functions with fewer REPORT lines are not flagged
+        :param balanced_weight: weight used to find the current optimum and for re-sampling
+        :param window_hours: length of the windows the lookback is read in, newest first
+        """
+        self.repository = repository if repository else ModelRepository()
+        self.client_provider = client_provider if client_provider else get_client_provider()
+        self.logs_client = self.client_provider.client('logs')
+        self.threshold = threshold
+        self.lookback_hours = lookback_hours
+        self.max_reports = max_reports
+        self.min_reports = min_reports
+        self.balanced_weight = balanced_weight
+        self.window_hours = window_hours
+
+    @staticmethod
+    def _log_group_name(arn: str):
+        function_name = arn.split(':function:')[-1].split(':')[0]
+        return f'/aws/lambda/{function_name}'
+
+    @staticmethod
+    def production_versions(lambda_function: LambdaFunction):
+        """ Returns `$LATEST` and the versions production aliases point to. Invocations of all other versions, e.g.
+        the ones published by the sizer (also after teardown deleted them), are no production traffic.
+        """
+        return {'$LATEST'} | {alias['FunctionVersion'] for alias in lambda_function.list_aliases()
+                              if not Cleaner.is_sizer_alias(alias['Name'])}
+
+    def production_logs(self, arn: str, memory_size: int, architecture: str, versions: set = None):
+        """ Returns the execution logs of the most recent production invocations at the given memory size.
+
+        CloudWatch Logs returns events oldest first, so the lookback window is read in windows of
+        `window_hours` from the newest one backwards until `max_reports` REPORT lines were found.
+        :param versions: (optional) versions whose log streams (`<date>/[<version>]<id>`) are production traffic,
+            see `production_versions`, all other streams are skipped
+        """
+        paginator = self.logs_client.get_paginator('filter_log_events')
+        end_time = int(time.time() * 1000)
+        oldest = end_time - int(self.lookback_hours * 3600 * 1000)
+        logs = []
+        with get_metrics().phase('log_parsing', function=arn):
+            while end_time > oldest and len(logs) < self.max_reports:
+                start_time = max(oldest, end_time - int(self.window_hours * 3600 * 1000))
+                # newest REPORT lines of the window, older ones are only needed if the window has too few
+                window = deque(maxlen=self.max_reports - len(logs))
+                pages = paginator.paginate(logGroupName=self._log_group_name(arn), startTime=start_time,
+                                           endTime=end_time - 1, filterPattern='"REPORT RequestId"')
+                for page in pages:
+                    for event in page['events']:
+                        stream_version = re.search(r'\[([^\]]+)\]', event.get('logStreamName', ''))
+                        if versions is not None and stream_version and stream_version.group(1) not in versions:
+                            continue
+                        log = extract_data_from_log(event['message'], architecture)
+                        if log.memory_size == memory_size:
+                            window.append(log)
+                logs = list(window) + logs
+                end_time = start_time
+        return logs
+
+    def check(self, arn: str):
+        """ Checks the model of a function against its production durations
+        :return `DriftResult` or None if the function has no model for its deployed architecture
+        """
+        lambda_function = LambdaFunction(arn, self.client_provider.client('lambda'))
+        config = lambda_function.get_config()
+        memory_size = config['MemorySize']
+        architecture = config.get('Architectures', [X86_64])[0]
+        model = self.repository.get(arn, architecture)
+        if not model:
+            logger.info(f"No {architecture} model for {arn}")
+            return None
+
+        logs = self.production_logs(arn, memory_size, architecture, self.production_versions(lambda_function))
+        # the median is robust against the occasional slow (e.g. cold or throttled) invocation
+        observed = float(np.median([log.duration for log in logs])) if logs else float('nan')
+        result = DriftResult(arn, memory_size, architecture, float(model.get_duration(memory_size)), observed,
+                             len(logs) if len(logs) >= self.min_reports else 0, self.threshold)
+        logger.info(f"{arn}: predicted {result.predicted:.1f} ms, observed {observed:.1f} ms "
+                    f"({len(logs)} reports)")
+        return result
+
+    def check_all(self, arns: list = None):
+        """ Yields the `DriftResult` of all given functions, defaults to all functions of the repository """
+        for arn in arns if arns else self.repository.arns():
+            try:
+                result = self.check(arn)
+            except ClientError as e:
+                # deleted functions may still have a model, functions that were never invoked have no log group
+                if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                    raise
+                logger.info(f"Skipping {arn}: {e.response['Error'].get('Message')}")
+                continue
+            if result:
+                yield result
+
+    def resample_sizes(self, result: DriftResult, factors=(0.5, 1, 2), max_memory_size: int = MAX_MEMORY_SIZE):
+        """ Returns the reduced set of memory sizes around the optimum of the stale model and the deployed size """
+        model = self.repository.get(result.arn, result.architecture)
+        grid = memory_grid(max_memory_size=max_memory_size)
+        durations, costs = model.get_duration(grid), model.get_cost(grid)
+        w = self.balanced_weight
+        optimum = int(grid[np.argmin(w * costs / costs.max() + (1 - w) * durations / durations.max())])
+        sizes = {result.memory_size}
+        for factor in factors:
+            size = MEMORY_STEP_SIZE * round(optimum * factor / MEMORY_STEP_SIZE)
+            sizes.add(int(min(max(size, MIN_MEMORY_SIZE), max_memory_size)))
+        return sorted(sizes)
+
+    def resample(self, result: DriftResult, payload: dict, sample_runs: int = 3):
+        """ Re-samples a drifted function with the reduced set of memory sizes and refits its model
+        :return `SizingResult` of the refitted model and the sampling cost
+        """
+        memory_sizes = self.resample_sizes(result)
+        logger.info(f"Re-sampling {result.arn} with memory sizes {memory_sizes}")
+        sizer = RegressionSizer(lambda_arn=result.arn, payload=payload, balanced_weight=self.balanced_weight,
+                                sample_runs=sample_runs, memory_sizes=memory_sizes,
+                                client_provider=self.client_provider, architectures=[result.architecture])
+        sizing_result, logs, popt, cost = sizer.configure_function()
+        return sizing_result, cost
@@ -0,0 +1,193 @@
+import csv
+import logging
+import numpy as np
+from model.model_repository import ModelRepository
+from model.model_table import ModelTable, model_column
+from model.performance_model import MODEL_FAMILIES
+from sizer.population_optimizer import memory_grid
+from sizer.regression_sizer import RegressionSizer
+from util.aws_clients import get_client_provider
+from util.lambda_constants import MAX_MEMORY_SIZE, STATIC_INVOCATION_COST
+from util.pricing import ARCHITECTURES, X86_64, region_of_arn
+
+logger = logging.getLogger(__name__)
+
+
+class FleetSizer:
+    """ Computes recommendations for all Lambda functions of an account.
+
+    Models of all architectures are collected into a memory-mapped `ModelTable`, recommendations are the best
+    (architecture, memory size) pairs, computed as vectorized passes over chunks of the table, and the savings report
+    is streamed row by row.
+    """
+
+    def __init__(self, table_path: str, balanced_weight: float = 0.5, max_memory_size: int = MAX_MEMORY_SIZE,
+                 client_provider=None, repository: ModelRepository = None):
+        self.table = ModelTable(table_path)
+        self.balanced_weight = balanced_weight
+        self.grid = memory_grid(max_memory_size=max_memory_size)
+        self.client_provider = client_provider if client_provider else get_client_provider()
+        self.repository = repository if repository else ModelRepository()
+
+    def list_functions(self):
+        """ Yields (arn, memory size, architecture) of all functions in the account """
+        paginator = self.client_provider.client('lambda').get_paginator('list_functions')
+        for page in paginator.paginate():
+            for function in page['Functions']:
+                yield function['FunctionArn'], function['MemorySize'], function.get('Architectures', [X86_64])[0]
+
+    def build_table(self, sample: bool = False, payloads: dict = None, sample_runs: int = 3):
+        """ Writes the model table of all functions of the account
+        :param sample: sample and fit functions without a model in the repository, else they are skipped
+        :param payloads: (optional) payloads per function ARN used for sampling
+        :param sample_runs: runs per memory size when sampling
+        :return number of functions without model
+        """
+        payloads = payloads if payloads else {}
+        missing = 0
+        with self.table.writer() as writer:
+            for arn, memory_size, architecture in self.list_functions():
+                entries = {model_architecture: self.repository.entry(arn, model_architecture)
+                           for model_architecture in ARCHITECTURES}
+                entries = {model_architecture: entry for model_architecture, entry in entries.items() if entry}
+                if not entries and sample:
+                    sizer = RegressionSizer(lambda_arn=arn, payload=payloads.get(arn, {}), sample_runs=sample_runs,
+                                            client_provider=self.client_provider, architectures=[architecture])
+                    result, logs, popt, cost = sizer.configure_function()
+                    model = sizer.models[result.architecture]
+                    entries = {result.architecture: {'params': popt, 'fit_quality': sizer.fit_quality,
+                                                     'family': model.family,
+                                                     'min_memory_size': model.min_memory_size}}
+                if not entries:
+                    logger.info(f"No model for {arn}, skipping")
+                    missing += 1
+                    continue
+                writer.append(arn, memory_size, entries, architecture, region_of_arn(arn))
+        return missing
+
+    def _durations(self, rows: slice, memory_sizes, architecture: str = X86_64):
+        """ Evaluates the models of an architecture for a chunk of rows at the given memory sizes, broadcasting rows
+        over axis 0, rows without a model of the architecture are NaN
+        """
+        family = self.table.column(model_column('family', architecture))[rows]
+        params = [self.table.column(model_column(name, architecture))[rows] for name in ['t0', 'lambda', 't_min']]
+        if memory_sizes.ndim == 2:
+            family = family[:, None]
+            params = [p[:, None] for p in params]
+        durations = np.full(np.broadcast(family, memory_sizes).shape, np.nan)
+        for index, name in enumerate(ModelTable.FAMILIES):
+            selected = family == index
+            if np.any(selected):
+                durations = np.where(selected, MODEL_FAMILIES[name].function(memory_sizes, *params), durations)
+        return durations
+
+    def _costs(self, rows: slice, memory_sizes, durations, architecture: str = X86_64):
+        """ Prices durations at the given memory sizes like `compute_cost`, with the price of each row's region """
+        price = self.table.column(model_column('price', architecture))[rows]
+        if np.ndim(memory_sizes) == 2:
+            price = price[:, None]
+        return price * (memory_sizes / 1024) * (np.ceil(durations) / 1000) + STATIC_INVOCATION_COST
+
+    def _evaluate(self, rows: slice):
+        """ Returns durations and costs of all (architecture, memory size) candidates for a chunk of rows, shape
+        (rows, architectures x grid), candidates without a model or below the smallest feasible size are infinite
+        """
+        all_durations, all_costs = [], []
+        for architecture in ARCHITECTURES:
+            durations = self._durations(rows, self.grid[None, :].astype(float), architecture)
+            costs = self._costs(rows, self.grid[None, :], durations, architecture)
+            min_memory_size = self.table.column(model_column('min_memory_size', architecture))[rows, None]
+            feasible = (self.grid[None, :] >= min_memory_size) & ~np.isnan(durations)
+            all_durations.append(np.where(feasible, durations, np.inf))
+            all_costs.append(np.where(feasible, costs, np.inf))
+        return np.concatenate(all_durations, axis=1), np.concatenate(all_costs, axis=1)
+
+    def recommend(self, chunk_size: int = 4096):
+        """ Computes the cheapest, fastest and balanced (architecture, memory size) pair of every function as well as
+        the savings per invocation of the balanced pair compared to the deployed configuration, stored as additional
+        table columns. Functions without a feasible candidate (or without a model of the deployed architecture) get
+        size 0 and NaN savings.
+        """
+        n = len(self.table)
+        if n == 0:
+            logger.info("Model table is empty, nothing to recommend")
+            return
+        recommendations = {}
+        for name in ['cheapest', 'fastest', 'balanced']:
+            recommendations[name] = (self.table.column(f'{name}_size', np.int32, 'w+'),
+                                     self.table.column(f'{name}_architecture', np.int8, 'w+'))
+        current_cost = self.table.column('current_cost', np.float64, 'w+')
+        balanced_cost = self.table.column('balanced_cost', np.float64, 'w+')
+        savings = self.table.column('savings', np.float64, 'w+')
+        memory_size = self.table.column('memory_size')
+        deployed_architecture = self.table.column('architecture')
+        # candidates are the grid of every architecture, one after another
+        candidate_sizes = np.tile(self.grid, len(ARCHITECTURES))
+        candidate_architectures = np.repeat(np.arange(len(ARCHITECTURES)), len(self.grid))
+        w = self.balanced_weight
+
+        for start in range(0, n, chunk_size):
+            rows = slice(start, min(start + chunk_size, n))
+            durations, costs = self._evaluate(rows)
+            index = np.arange(durations.shape[0])
+
+            finite = np.isfinite(costs)
+            # functions that need more memory than the largest size of the grid have no recommendation
+            sizable = finite.any(axis=1)
+            max_cost = np.where(finite, costs, 0).max(axis=1, keepdims=True)
+            max_duration = np.where(finite, durations, 0).max(axis=1, keepdims=True)
+            weighted = w * costs / np.where(sizable[:, None], max_cost, 1) + \
+                (1 - w) * durations / np.where(sizable[:, None], max_duration, 1)
+            best = {
+                'cheapest': np.lexsort((durations, costs), axis=1)[:, 0],
+                'fastest': np.lexsort((costs, durations), axis=1)[:, 0],
+                'balanced': np.argmin(weighted, axis=1),
+            }
+            for name, (sizes, architectures) in recommendations.items():
+                sizes[rows] = np.where(sizable, candidate_sizes[best[name]], 0)
+                architectures[rows] = np.where(sizable, candidate_architectures[best[name]], -1)
+            balanced_cost[rows] = np.where(sizable, costs[index, best['balanced']], np.nan)
+
+            deployed = memory_size[rows]
+            current = np.full(deployed.shape, np.nan)
+            for architecture_index, architecture in enumerate(ARCHITECTURES):
+                selected = deployed_architecture[rows] == architecture_index
+                cost = self._costs(rows, deployed, self._durations(rows, deployed.astype(float), architecture),
+                                   architecture)
+                current = np.where(selected, cost, current)
+            current_cost[rows] = current
+            savings[rows] = current_cost[rows] - balanced_cost[rows]
+
+        for column in [current_cost, balanced_cost, savings] + [c for pair in recommendations.values() for c in pair]:
+            column.flush()
+
+    def write_report(self, out):
+        """ Streams the functions ranked by savings per invocation as CSV to `out`, functions without savings (no
+        feasible memory size or no model of the deployed architecture) are left out
+        """
+        savings = self.table.column('savings', np.float64)
+        order = np.argsort(-savings, kind='stable')
+        order = order[~np.isnan(savings[order])]
+        if len(order) < len(savings):
+            logger.warning(f"{len(savings) - len(order)} functions have no feasible memory size up to "
+                           f"{self.grid[-1]} MB or no model of their deployed architecture")
+        columns = {name: self.table.column(name, dtype) for name, dtype in
+                   [('memory_size', np.int32), ('architecture', np.int8), ('cheapest_size', np.int32),
+                    ('cheapest_architecture', np.int8), ('fastest_size', np.int32),
+                    ('fastest_architecture', np.int8), ('balanced_size', np.int32),
+                    ('balanced_architecture', np.int8), ('current_cost', np.float64), ('balanced_cost', np.float64)]}
+        # fit quality of the model of the deployed architecture
+        fit_quality = {index: self.table.column(model_column('fit_quality', architecture))
+                       for index, architecture in enumerate(ARCHITECTURES)}
+        writer = csv.writer(out)
+        writer.writerow(['Rank', 'Function ARN', 'Architecture', 'Memory Size', 'Cheapest Architecture',
+                         'Cheapest Size', 'Fastest Architecture', 'Fastest Size', 'Balanced Architecture',
+                         'Balanced Size', 'Current Cost', 'Balanced Cost', 'Savings', 'Fit Quality'])
+        for rank, (i, arn) in enumerate(zip(order, self.table.arns(order))):
+            writer.writerow([rank + 1, arn, ARCHITECTURES[columns['architecture'][i]], columns['memory_size'][i],
+                             ARCHITECTURES[columns['cheapest_architecture'][i]], columns['cheapest_size'][i],
+                             ARCHITECTURES[columns['fastest_architecture'][i]], columns['fastest_size'][i],
+                             ARCHITECTURES[columns['balanced_architecture'][i]], columns['balanced_size'][i],
+                             '{0:.12f}'.format(columns['current_cost'][i]),
+                             '{0:.12f}'.format(columns['balanced_cost'][i]), '{0:.12f}'.format(savings[i]),
+                             fit_quality[columns['architecture'][i]][i]])
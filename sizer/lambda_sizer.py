@@ -1,27 +1,32 @@
 import logging
-import boto3
 import csv
 import os
 from model.lambda_function import LambdaFunction
 from util.lambda_utils import get_function_name
 from model.cleaner import Cleaner
+from util.aws_clients import get_client_provider
+from util.metrics import get_metrics
+from util.pricing import X86_64
 
 logger = logging.getLogger(__name__)
 
 
 class LambdaSizer:
 
-    def __init__(self, lambda_arn: str, payload: dict, balanced_weight: float):
-        self.client = boto3.client('lambda')
+    def __init__(self, lambda_arn: str, payload: dict, balanced_weight: float, client_provider=None):
+        client_provider = client_provider if client_provider else get_client_provider()
+        self.client_provider = client_provider
+        self.client = client_provider.client('lambda')
         self.lambda_function = LambdaFunction(arn=lambda_arn, lambda_client=self.client)
         self.function_name = get_function_name(lambda_arn)
         self.payload = payload
         self.balanced_weight = balanced_weight
-        self.cleaner = Cleaner()
+        self.cleaner = Cleaner(client_provider)
 
     @staticmethod
     def _save_logs(logs: list, function_name: str, filepath: str):
-        fieldnames = ['Function Name', 'Memory Size', 'Init Duration', 'Duration', 'Billed Duration', 'Cost']
+        fieldnames = ['Function Name', 'Memory Size', 'Init Duration', 'Duration', 'Billed Duration', 'Cost',
+                      'Max Memory Used', 'Error']
 
         try:
             os.makedirs(os.path.dirname(filepath))
@@ -36,21 +41,28 @@ class LambdaSizer:
                 writer.writerow({'Function Name': function_name, 'Memory Size': log.memory_size,
                                  'Init Duration': log.init_duration,
                                  'Duration': log.duration, 'Billed Duration': log.billed_duration,
-                                 'Cost': '{0:.10f}'.format(log.cost)})
+                                 'Cost': '{0:.10f}'.format(log.cost), 'Max Memory Used': log.max_memory_used,
+                                 'Error': log.error})
 
     @staticmethod
-    def get_alias_for_memory_size(memory_size: int):
+    def get_alias_for_memory_size(memory_size: int, architecture: str = X86_64):
+        if architecture != X86_64:
+            return f"{memory_size}MB-{architecture}"
         return f"{memory_size}MB"
 
-    def _create_alias_if_needed(self, memory_size: int):
-        alias = self.get_alias_for_memory_size(memory_size)
-        if self.lambda_function.verify_alias_exists(alias):
-            logger.info(f'{alias} already exists, skipping creation.')
-        else:
-            self.lambda_function.create_memory_config(value=memory_size, alias=alias)
+    def _create_alias_if_needed(self, memory_size: int, architecture: str = X86_64):
+        alias = self.get_alias_for_memory_size(memory_size, architecture)
+        with get_metrics().phase('alias_provisioning', function=self.lambda_function.arn):
+            if self.lambda_function.verify_alias_exists(alias):
+                logger.info(f'{alias} already exists, skipping creation.')
+            else:
+                self.lambda_function.create_memory_config(value=memory_size, alias=alias, architecture=architecture)
 
         return alias
 
     def _remove_aliases(self, aliases: list):
+        versions = {a['Name']: a['FunctionVersion'] for a in self.lambda_function.list_aliases()}
         for alias in aliases:
-            self.cleaner.delete_lambda_alias(lambda_func=self.lambda_function, alias=alias)
+            if alias in versions:
+                self.cleaner.delete_lambda_alias(lambda_func=self.lambda_function, alias=alias,
+                                                 version=versions[alias])
@@ -0,0 +1,175 @@
+import csv
+import json
+import logging
+import math
+import os
+import numpy as np
+from model.execution_log import ExecutionLog
+from model.performance_model import fit_payload_model
+from model.sampling_journal import SamplingJournal
+from sizer.regression_sizer import RegressionSizer
+from util.metrics import get_metrics
+from util.pricing import X86_64
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadClass:
+    """ Example payload of a class of inputs of a function """
+
+    def __init__(self, payload: dict, input_size: float = None, weight: float = 1, name: str = None):
+        """
+        :param input_size: (optional) input size in MB, e.g. of the S3 object the payload refers to, defaults to the
+            size of the JSON payload
+        :param weight: share of the class in the production traffic
+        :param name: (optional) name of the class, used for its log directory
+        """
+        self.payload = payload
+        self.input_size = input_size if input_size is not None else len(json.dumps(payload)) / 2 ** 20
+        self.weight = weight
+        self.name = name if name else f'{self.input_size:g}MB'
+
+    @staticmethod
+    def from_dict(entry: dict):
+        return PayloadClass(entry.get('payload', {}), entry.get('input_size'), entry.get('weight', 1),
+                            entry.get('name'))
+
+    def to_dict(self):
+        return {'name': self.name, 'input_size': self.input_size, 'weight': self.weight}
+
+
+class PayloadRegressionSizer(RegressionSizer):
+    """ Samples a function with several payload classes and fits a `PayloadPerformanceModel` of memory and input
+    size.
+
+    Every payload class is sampled like a single payload by `RegressionSizer`, with its own logs, journal and
+    infeasible memory sizes. Recommendations minimize the expected cost and duration over the payload classes
+    (weighted by `weight`) among the memory sizes that fit all of them. The repository stores the payload model as
+    `payload_model` and, as `params`, the exponential model of the weighted mean input size.
+    """
+
+    def __init__(self, lambda_arn: str, payload_classes: list, balanced_weight: float = 0.5, **kwargs):
+        """
+        :param payload_classes: `PayloadClass`es or dicts with `payload`, `input_size` (in MB), `weight` and `name`,
+            at least two different input sizes
+        """
+        payload_classes = [c if isinstance(c, PayloadClass) else PayloadClass.from_dict(c) for c in payload_classes]
+        if len(set(c.input_size for c in payload_classes)) < 2:
+            raise ValueError("Payload classes need at least two different input sizes")
+        if len(set(c.name for c in payload_classes)) < len(payload_classes):
+            raise ValueError("Payload classes need unique names")
+        super().__init__(lambda_arn, payload_classes[0].payload, balanced_weight, **kwargs)
+        self.payload_classes = sorted(payload_classes, key=lambda c: c.input_size)
+        self.payload_models = {}
+        # architecture -> payload class name -> smallest feasible memory size
+        self.class_min_memory_sizes = {}
+        self._journals = {}
+        self._replayed_cost = 0.0
+
+    @property
+    def weights(self):
+        total_weight = sum(c.weight for c in self.payload_classes)
+        return [c.weight / total_weight for c in self.payload_classes]
+
+    @property
+    def reference_input_size(self):
+        """ Weighted mean input size of the payload classes """
+        return float(np.dot(self.weights, [c.input_size for c in self.payload_classes]))
+
+    def _class_journal(self, journal: SamplingJournal, payload_class: PayloadClass):
+        if payload_class.name not in self._journals:
+            class_journal = SamplingJournal(f'./logs/{self.function_name}/session.jsonl')
+            class_journal.start(journal.original_memory_size, journal.original_architecture, self._fingerprint())
+            self._replayed_cost += class_journal.cost()
+            self._journals[payload_class.name] = class_journal
+        return self._journals[payload_class.name]
+
+    def _sample(self):
+        self._journals = {}
+        self._replayed_cost = 0.0
+        logs_paths, total_cost = super()._sample()
+        for journal in self._journals.values():
+            journal.finish()
+        return logs_paths, total_cost + self._replayed_cost
+
+    def _sample_architecture(self, journal: SamplingJournal, architecture: str):
+        function_name, payload = self.function_name, self.payload
+        rows = []
+        total_cost = 0.0
+        max_memory_used = []
+        infeasible_memory_size = []
+        self.class_min_memory_sizes[architecture] = {}
+        try:
+            for payload_class in self.payload_classes:
+                # smaller inputs may fit into less memory, feasibility is tracked per payload class
+                self.function_name = f'{function_name}/{payload_class.name}'
+                self.payload = payload_class.payload
+                self.max_memory_used.pop(architecture, None)
+                self.infeasible_memory_size.pop(architecture, None)
+                logger.info(f"Sampling payload class {payload_class.name} ({payload_class.input_size:g} MB)")
+
+                logs_path, cost = super()._sample_architecture(self._class_journal(journal, payload_class),
+                                                                architecture)
+                total_cost += cost
+                xdata, ydata = self._read_logs(logs_path)
+                rows += [(payload_class.input_size, x, y) for x, y in zip(xdata, ydata)]
+                self.class_min_memory_sizes[architecture][payload_class.name] = self.min_memory_size(architecture)
+                max_memory_used.append(self.max_memory_used.get(architecture, 0))
+                infeasible_memory_size.append(self.infeasible_memory_size.get(architecture, 0))
+        finally:
+            self.function_name, self.payload = function_name, payload
+
+        # recommendations have to fit all payload classes
+        if max(max_memory_used):
+            self.max_memory_used[architecture] = max(max_memory_used)
+        if max(infeasible_memory_size):
+            self.infeasible_memory_size[architecture] = max(infeasible_memory_size)
+
+        suffix = '' if architecture == X86_64 else f'-{architecture}'
+        logs_path = f'./logs/{self.function_name}/avg-payload{suffix}.csv'
+        os.makedirs(os.path.dirname(logs_path), exist_ok=True)
+        with open(logs_path, 'w+') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Input Size', 'Memory Size', 'Duration'])
+            writer.writerows(rows)
+        return logs_path, total_cost
+
+    def _predict(self, memory_size, model):
+        """ Predicts the expected duration and cost over the payload classes """
+        payload_model = self.payload_models.get(model.architecture)
+        if not payload_model:
+            return super()._predict(memory_size, model)
+        input_sizes = [c.input_size for c in self.payload_classes]
+        duration = float(np.dot(self.weights, [payload_model.get_duration(memory_size, s) for s in input_sizes]))
+        log = ExecutionLog(memory_size=memory_size, duration=duration, billed_duration=math.ceil(duration),
+                           architecture=model.architecture, region=self.lambda_function.region)
+        log.cost = float(np.dot(self.weights, [payload_model.get_cost(memory_size, s) for s in input_sizes]))
+        return log
+
+    def _fit(self, logs_path: str, architecture: str = X86_64):
+        """ Fits and saves the payload model of an architecture
+        :return exponential model of the weighted mean input size
+        """
+        data = np.genfromtxt(logs_path, delimiter=',', skip_header=1, ndmin=2)
+        input_sizes, xdata, ydata = data[:, 0], data[:, 1], data[:, 2]
+
+        with get_metrics().phase('fitting', function=self.lambda_function.arn):
+            payload_model = fit_payload_model(xdata, input_sizes, ydata, architecture, self.lambda_function.region)
+        # classes with the same input size share one feasible memory size, the larger one
+        min_memory_sizes = {}
+        for c in self.payload_classes:
+            min_memory_sizes[c.input_size] = max(self.class_min_memory_sizes[architecture][c.name],
+                                                 min_memory_sizes.get(c.input_size, 0))
+        payload_model.min_memory_sizes = [min_memory_sizes[s] for s in payload_model.input_sizes]
+        self.fit_quality = self._r_squared(ydata, payload_model.get_duration(xdata, input_sizes))
+        self.held_out_errors = None
+
+        model = payload_model.at(self.reference_input_size)
+        model.min_memory_size = self.min_memory_size(architecture)
+        payload_entry = payload_model.to_dict()
+        payload_entry['classes'] = [c.to_dict() for c in self.payload_classes]
+        self._save_model(model, architecture, payload_model=payload_entry,
+                         max_sampled_memory_size=int(max(xdata)))
+        self.payload_models[architecture] = payload_model
+        self.models[architecture] = model
+        return model
@@ -0,0 +1,142 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from util.lambda_constants import MIN_MEMORY_SIZE, MAX_MEMORY_SIZE, MEMORY_STEP_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def memory_grid(min_memory_size: int = MIN_MEMORY_SIZE, max_memory_size: int = MAX_MEMORY_SIZE,
+                step_size: int = MEMORY_STEP_SIZE):
+    """ Returns all memory sizes between min and max memory size in steps of `step_size` """
+    if min_memory_size > max_memory_size:
+        raise ValueError(f"Smallest feasible memory size {min_memory_size} MB exceeds the largest memory size "
+                         f"{max_memory_size} MB")
+    grid = np.arange(min_memory_size, max_memory_size + 1, step_size)
+    if grid[-1] != max_memory_size:
+        grid = np.append(grid, max_memory_size)
+    return grid
+
+
+class WorkflowObjective:
+    """ Vectorized objective of a workflow, evaluates a whole population of memory size vectors at once.
+
+    Picklable, so it can be shipped to worker processes.
+    """
+
+    def __init__(self, workflow, performance_models: list, elat_constraint: float, percentile: float = 1.0,
+                 input_models: list = None, input_weights: list = None):
+        """
+        :param input_models: (optional) per input class, models aligned with `performance_models` of the input size
+            of the class, elat and cost are then taken over the distribution of input classes
+        :param input_weights: probability of each input class
+        """
+        self.workflow = workflow
+        self.performance_models = performance_models
+        self.elat_constraint = elat_constraint
+        self.percentile = percentile
+        self.input_models = input_models
+        self.input_weights = input_weights
+
+    def __call__(self, population):
+        """
+        :param population: array of shape (population size, number of functions) with memory sizes
+        :return tuple of arrays (cost, constraint violation, elat), each of shape (population size,)
+        """
+        population = np.asarray(population, dtype=float)
+        if self.input_models:
+            durations = [[model.get_duration(population[:, i]) for i, model in enumerate(models)]
+                         for models in self.input_models]
+            costs = [[model.get_cost(population[:, i]) for i, model in enumerate(models)]
+                     for models in self.input_models]
+            elat = self.workflow.elat_over_inputs(durations, self.input_weights, self.percentile)
+            cost = self.workflow.cost_over_inputs(costs, self.input_weights)
+        else:
+            durations = [model.get_duration(population[:, i]) for i, model in enumerate(self.performance_models)]
+            costs = [model.get_cost(population[:, i]) for i, model in enumerate(self.performance_models)]
+            elat = self.workflow.elat(durations, self.percentile)
+            cost = self.workflow.cost(costs)
+        elat = np.broadcast_to(elat, population.shape[:1])
+        cost = np.broadcast_to(cost, population.shape[:1])
+        violation = np.maximum(elat - self.elat_constraint, 0)
+        # memory sizes below the smallest feasible size of a function are infeasible as well
+        models = self.input_models if self.input_models else [self.performance_models]
+        min_memory_sizes = np.array([[model.min_memory_size for model in class_models]
+                                     for class_models in models]).max(axis=0)
+        violation = violation + np.maximum(min_memory_sizes[None, :] - population, 0).sum(axis=1)
+        return cost, violation, elat
+
+
+def _rank(cost, violation):
+    """ Ranks individuals by Deb's feasibility rules: feasible before infeasible, feasible ones by cost,
+    infeasible ones by their constraint violation
+    """
+    order = np.lexsort((cost, violation))
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    return ranks
+
+
+def _evolve(objective, grid, dimensions: int, population_size: int, generations: int, mutation_rate: float,
+            elite: int, seed: int):
+    rng = np.random.default_rng(seed)
+    population = rng.integers(0, len(grid), size=(population_size, dimensions))
+    cost, violation, _ = objective(grid[population])
+
+    for _ in range(generations):
+        ranks = _rank(cost, violation)
+
+        # binary tournament selection
+        a = rng.integers(0, population_size, size=(population_size, 2))
+        parents = np.where(ranks[a[:, 0]] < ranks[a[:, 1]], a[:, 0], a[:, 1])
+        mothers = population[parents]
+        fathers = population[np.roll(parents, 1)]
+
+        # uniform crossover and mutation by small steps on the memory grid
+        children = np.where(rng.random((population_size, dimensions)) < 0.5, mothers, fathers)
+        mutate = rng.random((population_size, dimensions)) < mutation_rate
+        steps = np.rint(rng.normal(0, 2, size=(population_size, dimensions))).astype(int)
+        children = np.clip(children + mutate * steps, 0, len(grid) - 1)
+
+        # keep the best individuals of the last generation
+        elites = population[np.argsort(ranks)[:elite]]
+        children[:elite] = elites
+
+        population = children
+        cost, violation, _ = objective(grid[population])
+
+    best = np.lexsort((cost, violation))[0]
+    return grid[population[best]].tolist(), float(cost[best]), float(violation[best])
+
+
+class GeneticOptimizer:
+    """ Genetic algorithm over the discrete memory grid with independent restarts spread over a process pool """
+
+    def __init__(self, grid=None, population_size: int = 64, generations: int = 200, mutation_rate: float = 0.2,
+                 elite: int = 2, restarts: int = 4, processes: int = None, seed: int = 0):
+        self.grid = grid if grid is not None else memory_grid()
+        self.population_size = population_size
+        self.generations = generations
+        self.mutation_rate = mutation_rate
+        self.elite = elite
+        self.restarts = restarts
+        self.processes = processes
+        self.seed = seed
+
+    def minimize(self, objective, dimensions: int):
+        """ Minimizes the cost returned by `objective` subject to a zero constraint violation
+        :param objective: vectorized objective, see `WorkflowObjective`
+        :param dimensions: number of functions
+        :return tuple of (memory sizes, cost, constraint violation) of the best individual over all restarts
+        """
+        args = [(objective, self.grid, dimensions, self.population_size, self.generations, self.mutation_rate,
+                 self.elite, self.seed + restart) for restart in range(self.restarts)]
+        if self.processes == 1 or self.restarts == 1:
+            results = [_evolve(*a) for a in args]
+        else:
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                results = list(executor.map(_evolve, *zip(*args)))
+
+        for sizes, cost, violation in results:
+            logger.info(f"Restart result: {sizes}, cost: {cost}, violation: {violation}")
+        return min(results, key=lambda r: (r[2], r[1]))
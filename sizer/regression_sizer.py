@@ -1,75 +1,307 @@
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import math
-import json
-import os
 from sizer.lambda_sizer import LambdaSizer
-from scipy.optimize import curve_fit
 from model.execution_log import ExecutionLog
+from model.model_repository import ModelRepository
+from model.performance_model import fit_performance_model
+from model.lambda_function import LambdaFunction
+from model.sampling_journal import SamplingJournal
+from util.aws_clients import ClientProvider
+from util.load_generator import LoadGenerator, LoadProfile
+from util.lambda_constants import MIN_MEMORY_SIZE, MAX_MEMORY_SIZE, MEMORY_STEP_SIZE
+from util.lambda_utils import OUT_OF_MEMORY_ERROR, TIMEOUT_ERROR
+from util.metrics import get_metrics
+from util.pricing import X86_64
 import base64
 
 logger = logging.getLogger(__name__)
 
 
 class SizingResult:
-    def __init__(self, memory_size: int, cost: float, duration: float ):
+    def __init__(self, memory_size: int, cost: float, duration: float, architecture: str = X86_64):
         self.memory_size = memory_size
         self.cost = cost
         self.duration = duration
+        self.architecture = architecture
 
 
 class RegressionSizer(LambdaSizer):
 
-    def __init__(self, lambda_arn: str, payload: dict, balanced_weight: float = 0.5, sample_runs: int = 5 , memory_sizes: list = [128, 512, 1024, 2048, 3008]):
-        super().__init__(lambda_arn, payload, balanced_weight)
+    def __init__(self, lambda_arn: str, payload: dict, balanced_weight: float = 0.5, sample_runs: int = 5 , memory_sizes: list = [128, 512, 1024, 2048, 3008], client_provider=None, concurrency: int = 1,
+                 prewarm: bool = True, max_prewarm_rounds: int = 3, architectures: list = None,
+                 load_profile: LoadProfile = None, load_statistic: str = 'median', load_metric: str = 'duration',
+                 memory_headroom: float = 0.1, change_architecture: bool = False):
+        """
+        :param architectures: architectures to sample, defaults to the deployed one, recommendations cover all
+            (architecture, memory size) pairs
+        :param change_architecture: allow sampling other architectures than the deployed one. This re-uploads the
+            code of `$LATEST` with the other architecture while it is sampled, unqualified invocations of the live
+            function run on it in the meantime and fail if the code or its layers only support the deployed one.
+        :param concurrency: number of concurrent invocations per sampling batch
+        :param prewarm: warm `concurrency` execution environments of each alias before measuring
+        :param max_prewarm_rounds: maximum number of concurrent warm-up rounds per alias
+        :param load_profile: (optional) sample each alias under this load instead of `sample_runs` isolated runs
+        :param load_statistic: statistic of the load run's distribution the model is fitted on, `mean`, `median`,
+            `p90`, `p95` or `p99`
+        :param load_metric: `duration` reported by Lambda or client side `latency` including throttling
+        :param memory_headroom: memory sizes below the observed peak memory plus this fraction are not sampled
+            and not recommended
+        """
+        super().__init__(lambda_arn, payload, balanced_weight, client_provider)
         self.sample_runs = sample_runs
         self.memory_sizes = memory_sizes
+        self.concurrency = concurrency
+        self.prewarm = prewarm
+        self.max_prewarm_rounds = max_prewarm_rounds
+        self.architectures = architectures if architectures else [self.lambda_function.get_architecture()]
+        self.change_architecture = change_architecture
+        self.load_profile = load_profile
+        self.load_statistic = load_statistic
+        self.load_metric = load_metric
+        self._load_function = None
+        self.memory_headroom = memory_headroom
+        # architecture -> peak memory used of all successful invocations / largest memory size that ran out of
+        # memory or timed out
+        self.max_memory_used = {}
+        self.infeasible_memory_size = {}
+        self.fit_quality = None
+        self.held_out_errors = None
+        self.models = {}
 
-    def _execute_function(self, memory_size: int, payload: dict):
-        logger.info(f'Running function with memory size: {memory_size} MB')
-        alias = f'{memory_size}MB'
+    def _execute_function(self, memory_size: int, payload: dict, architecture: str = X86_64):
+        logger.info(f'Running function with memory size: {memory_size} MB ({architecture})')
         cost = 0.0
-        self._create_alias_if_needed(memory_size)
+        alias = self._create_alias_if_needed(memory_size, architecture)
 
-        log = self.lambda_function.invoke(alias=alias, payload=payload)
+        log = self.lambda_function.invoke(alias=alias, payload=payload, architecture=architecture)
         cost += log.cost
-        if log.init_duration > 0:
+        if log.init_duration > 0 and not log.failed:
             # ignore cold start invocations
-            log = self.lambda_function.invoke(alias=alias, payload=payload)
-            cost += log.cost
-        else:
             logger.info("droping execution due to cold_start " + log.to_string())
+            log = self.lambda_function.invoke(alias=alias, payload=payload, architecture=architecture)
+            cost += log.cost
         logger.info("Execution log: " + log.to_string())
         return log, cost
 
-    def _sample(self):
+    def _prewarm(self, memory_size: int, architecture: str = X86_64):
+        """ Warms `concurrency` execution environments of the alias of a memory size.
+
+        Each round invokes the alias `concurrency` times at once, the environments are warm once a whole round
+        reports no init duration.
+        :return cost and logs of the warm-up invocations
+        """
+        alias = self._create_alias_if_needed(memory_size, architecture)
+        cost = 0.0
+        warmup_logs = []
+        with get_metrics().phase('prewarm', function=self.lambda_function.arn), \
+                ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for i in range(self.max_prewarm_rounds):
+                logs = list(executor.map(lambda _: self.lambda_function.invoke(alias=alias, payload=self.payload,
+                                                                               architecture=architecture),
+                                         range(self.concurrency)))
+                cost += sum(log.cost for log in logs)
+                warmup_logs += logs
+                if any(self._is_fatal(log) for log in logs):
+                    break
+                cold_starts = sum(1 for log in logs if log.init_duration > 0)
+                logger.info(f"Warm-up round {i + 1} of {alias}: {cold_starts}/{self.concurrency} cold starts")
+                if cold_starts == 0:
+                    break
+            else:
+                logger.warning(f"Could not confirm {self.concurrency} warm environments for {alias}")
+        return cost, warmup_logs
+
+    @staticmethod
+    def _is_fatal(log: ExecutionLog):
+        """ Out of memory and timeouts will not go away with more runs of the same memory size """
+        return log.error in [OUT_OF_MEMORY_ERROR, TIMEOUT_ERROR]
+
+    def _update_feasibility(self, memory_size: int, architecture: str, logs: list):
+        """ Updates peak memory and infeasible memory sizes from the logs of a memory size """
+        peaks = [log.max_memory_used for log in logs if not log.failed and log.max_memory_used]
+        if peaks:
+            self.max_memory_used[architecture] = max(peaks + [self.max_memory_used.get(architecture, 0)])
+        if any(self._is_fatal(log) for log in logs):
+            self.infeasible_memory_size[architecture] = max(memory_size,
+                                                            self.infeasible_memory_size.get(architecture, 0))
+
+    def min_memory_size(self, architecture: str = X86_64):
+        """ Smallest feasible memory size: above all sizes that ran out of memory or timed out and above the
+        observed peak memory plus headroom
+        """
+        min_memory_size = MIN_MEMORY_SIZE
+        if architecture in self.max_memory_used:
+            with_headroom = self.max_memory_used[architecture] * (1 + self.memory_headroom)
+            min_memory_size = max(min_memory_size, MEMORY_STEP_SIZE * math.ceil(with_headroom / MEMORY_STEP_SIZE))
+        if architecture in self.infeasible_memory_size:
+            min_memory_size = max(min_memory_size, self.infeasible_memory_size[architecture] + MEMORY_STEP_SIZE)
+        return min_memory_size
+
+    def _sample_under_load(self, memory_size: int, architecture: str = X86_64):
+        """ Drives the alias of a memory size with the load profile
+        :return `LoadResult`
+        """
+        alias = self._create_alias_if_needed(memory_size, architecture)
+        if not self._load_function:
+            # no client side retries or rate limiting, throttles have to be observed rather than smoothed away
+            provider = ClientProvider(session=self.client_provider.session, max_attempts=0, retry_mode='standard',
+                                      max_pool_connections=self.load_profile.workers)
+            self._load_function = LambdaFunction(self.lambda_function.arn, provider.client('lambda'))
+        logger.info(f"Sampling {alias} under load {self.load_profile.to_dict()}")
+        generator = LoadGenerator(lambda: self._load_function.invoke(alias=alias, payload=self.payload,
+                                                                     architecture=architecture),
+                                  self.load_profile)
+        with get_metrics().phase('load', function=self.lambda_function.arn):
+            result = generator.run()
+        self._save_logs(result.logs, function_name=self.function_name,
+                        filepath=f'./logs/{self.function_name}/{alias}-load.csv')
+        return result
+
+    def _sample_architecture_under_load(self, journal: SamplingJournal, architecture: str):
         avg_logs = []
         total_cost = 0.0
-        initial_memory_size = self.lambda_function.get_memory_size()
-        for memory_size in self.memory_sizes:
-            logs = []
-            for i in range(self.sample_runs):
-                log, cost = self._execute_function(memory_size=memory_size, payload=self.payload)
-                logs.append(log)
+        for memory_size in sorted(self.memory_sizes, reverse=True):
+            if memory_size < self.min_memory_size(architecture):
+                logger.info(f"Skipping infeasible memory size {memory_size} MB ({architecture})")
+                continue
+            summary = journal.load_summary(memory_size, architecture)
+            if summary is None:
+                result = self._sample_under_load(memory_size, architecture)
+                summary = result.to_dict()
+                journal.record_load(memory_size, summary, result.cost, architecture)
+                total_cost += result.cost
+            if summary.get('fatal_errors', 0) > 0:
+                self.infeasible_memory_size[architecture] = max(memory_size,
+                                                                self.infeasible_memory_size.get(architecture, 0))
+            if summary.get('max_memory_used'):
+                self.max_memory_used[architecture] = max(summary['max_memory_used'],
+                                                         self.max_memory_used.get(architecture, 0))
+            if summary['invocations'] == 0 or summary.get('fatal_errors', 0) > 0:
+                logger.warning(f"No feasible invocations of {memory_size} MB under load, "
+                               f"{summary['throttles']} throttles, {summary['errors']} errors")
+                continue
+            logger.info(f"{memory_size} MB under load: {summary}")
+            duration = summary[f'{self.load_metric}_{self.load_statistic}']
+            avg_logs.append(ExecutionLog(memory_size=memory_size, duration=duration,
+                                         billed_duration=math.ceil(duration), architecture=architecture,
+                                         region=self.lambda_function.region))
+        return avg_logs[::-1], total_cost
+
+    def _sample_architecture(self, journal: SamplingJournal, architecture: str):
+        suffix = '' if architecture == X86_64 else f'-{architecture}'
+        logs_path = f'../logs/{self.function_name}/avg{suffix}.csv'
+        if self.load_profile:
+            avg_logs, total_cost = self._sample_architecture_under_load(journal, architecture)
+            self._save_logs(avg_logs, function_name=self.function_name, filepath=logs_path)
+            return logs_path, total_cost
+
+        avg_logs = []
+        total_cost = 0.0
+        region = self.lambda_function.region
+        # largest memory size first, the observed peak memory then rules out small sizes before they are invoked
+        for memory_size in sorted(self.memory_sizes, reverse=True):
+            if memory_size < self.min_memory_size(architecture):
+                logger.info(f"Skipping infeasible memory size {memory_size} MB ({architecture})")
+                continue
+            logs = journal.logs(memory_size, architecture)
+            self._update_feasibility(memory_size, architecture, logs)
+            aborted = threading.Event()
+            if any(self._is_fatal(log) for log in logs):
+                aborted.set()
+            missing_runs = self.sample_runs - len(logs)
+            if missing_runs > 0 and self.prewarm and not aborted.is_set():
+                cost, warmup_logs = self._prewarm(memory_size, architecture)
+                journal.record_warmup(memory_size, cost, architecture)
                 total_cost += cost
+                self._update_feasibility(memory_size, architecture, warmup_logs)
+                if any(self._is_fatal(log) for log in warmup_logs):
+                    aborted.set()
+            elif missing_runs > 0 and not aborted.is_set():
+                # like the warm-up, create the alias before the concurrent runs would race to create it
+                self._create_alias_if_needed(memory_size, architecture)
+
+            def execute(_):
+                if aborted.is_set():
+                    return None, 0.0
+                log, cost = self._execute_function(memory_size=memory_size, payload=self.payload,
+                                                   architecture=architecture)
+                journal.record(log, cost, region)
+                if self._is_fatal(log):
+                    # the remaining runs of this size would fail the same way
+                    aborted.set()
+                return log, cost
+
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for log, cost in executor.map(execute, range(max(missing_runs, 0))):
+                    if log:
+                        logs.append(log)
+                    total_cost += cost
 
-            self._save_logs(logs, function_name=f'{self.function_name}', filepath=f'./logs/{self.function_name}/{memory_size}MB.csv')
+            alias = self.get_alias_for_memory_size(memory_size, architecture)
+            self._save_logs(logs, function_name=f'{self.function_name}', filepath=f'./logs/{self.function_name}/{alias}.csv')
+            self._update_feasibility(memory_size, architecture, logs)
+            logs = [log for log in logs if not log.failed]
+            if aborted.is_set() or not logs:
+                logger.warning(f"Memory size {memory_size} MB ({architecture}) is infeasible")
+                continue
             avg_duration = sum(log.duration for log in logs) / len(logs)
             avg_billed_duration = sum(log.billed_duration for log in logs) / len(logs)
-            avg_logs.append(ExecutionLog(memory_size=memory_size, duration=avg_duration, billed_duration=avg_billed_duration))
+            avg_logs.append(ExecutionLog(memory_size=memory_size, duration=avg_duration, billed_duration=avg_billed_duration,
+                                         architecture=architecture, region=region))
 
-        # reset to initial memory size
-        self.lambda_function.set_memory_size(initial_memory_size)
+        if not avg_logs:
+            raise ValueError(f"All memory sizes of {self.lambda_function.arn} ({architecture}) failed")
+        self._save_logs(avg_logs[::-1], function_name=self.function_name, filepath=logs_path)
+        return logs_path, total_cost
 
-        logs_path = f'../logs/{self.function_name}/avg.csv'
-        self._save_logs(avg_logs, function_name=self.function_name, filepath=logs_path)
+    def _fingerprint(self):
+        """ Fingerprint of the parameters that determine the samples of a session: payload, deployed code, runs per
+        memory size and load profile
+        """
+        parameters = {'payload': self.payload, 'code': self.lambda_function.get_config().get('CodeSha256'),
+                      'sample_runs': self.sample_runs,
+                      'load_profile': self.load_profile.to_dict() if self.load_profile else None}
+        return SamplingJournal.fingerprint_of(parameters)
 
-        return logs_path, total_cost
+    def _sample(self):
+        """ Samples all memory sizes of all architectures
+        :return dict of architecture -> path of the averaged logs, total sampling cost
+        """
+        # resumes an interrupted session, completed invocations are not repeated
+        journal = SamplingJournal(f'./logs/{self.function_name}/session.jsonl')
+        initial_memory_size = journal.start(self.lambda_function.get_memory_size(),
+                                            self.lambda_function.get_architecture(), self._fingerprint())
+        initial_architecture = journal.original_architecture
+        other_architectures = [architecture for architecture in self.architectures
+                               if architecture != initial_architecture]
+        if other_architectures and not self.change_architecture:
+            raise ValueError(f"{self.lambda_function.arn} is deployed as {initial_architecture}, sampling "
+                             f"{other_architectures} switches the architecture of the live function, pass "
+                             f"change_architecture=True to allow it")
+        # cost of all replayed invocations, including sizes that are not in `memory_sizes`, e.g. the candidates
+        # added by `BayesianRegressionSizer`
+        total_cost = journal.cost()
+        logs_paths = {}
+        try:
+            for architecture in self.architectures:
+                logs_paths[architecture], cost = self._sample_architecture(journal, architecture)
+                total_cost += cost
+        finally:
+            # reset to initial architecture and memory size
+            if initial_architecture:
+                self.lambda_function.set_architecture(initial_architecture)
+            self.lambda_function.set_memory_size(initial_memory_size)
+        journal.finish()
 
-    @staticmethod
-    def _predict(memory_size, func, params):
-        duration = func(memory_size, *params)
-        return ExecutionLog(memory_size=memory_size, duration=duration, billed_duration=math.ceil(duration))
+        return logs_paths, total_cost
+
+    def _predict(self, memory_size, model):
+        duration = float(model.get_duration(memory_size))
+        return ExecutionLog(memory_size=memory_size, duration=duration, billed_duration=math.ceil(duration),
+                            architecture=model.architecture, region=self.lambda_function.region)
 
     @staticmethod
     def _find_cheapest(logs):
@@ -91,39 +323,67 @@ class RegressionSizer(LambdaSizer):
 
         return min(logs, key=lambda log: weighted_sum(log))
 
-    def _save_model(self, model):
-        path = os.path.join(os.path.dirname(__file__), 'performance_model_repository.json')
-        params = list(model)
-        with open(path, 'r') as f:
-            models = json.load(f)
-            models[self.lambda_function.arn] = params
-        with open(path, 'w') as f:
-            json.dump(models, f, indent=4)
+    def _save_model(self, model, architecture: str = X86_64, **metadata):
+        # runtime and package size group similar functions, e.g. for the priors of `BayesianRegressionSizer`
+        config = self.lambda_function.get_config()
+        ModelRepository().put(self.lambda_function.arn, model.params, architecture=architecture, family=model.family,
+                              fit_quality=self.fit_quality, held_out_errors=self.held_out_errors,
+                              min_memory_size=model.min_memory_size,
+                              max_memory_used=self.max_memory_used.get(architecture),
+                              runtime=config.get('Runtime'), code_size=config.get('CodeSize'), **metadata)
 
-    def configure_function(self, logs_path=None, cleanup=False):
-        if not logs_path:
-            logs_path, total_sampling_cost = self._sample()
-        else:
-            total_sampling_cost = 0
+    @staticmethod
+    def _r_squared(ydata, predicted):
+        """ Coefficient of determination of a fit, 1 is a perfect fit """
+        ss_res = np.sum((ydata - predicted) ** 2)
+        ss_tot = np.sum((ydata - np.mean(ydata)) ** 2)
+        return float(1 - ss_res / ss_tot) if ss_tot > 0 else 1.0
 
-        data = np.genfromtxt(logs_path, delimiter=',', skip_header=1)
+    @staticmethod
+    def _read_logs(logs_path: str):
+        """ Returns memory sizes and durations of averaged logs, sorted by memory size """
+        data = np.genfromtxt(logs_path, delimiter=',', skip_header=1, ndmin=2)
         data = data[data[:, 1].argsort()]
-        xdata = data[:, 1].transpose()
-        ydata = data[:, 4].transpose()
+        return data[:, 1].transpose(), data[:, 4].transpose()
 
-        def func(x, a, b, c):
-            return a * np.exp(-b * x) + c
+    def _fit(self, logs_path: str, architecture: str = X86_64):
+        """ Fits all model families, selects the one with the lowest held-out error and saves it
+        :return fitted performance model
+        """
+        xdata, ydata = self._read_logs(logs_path)
 
-        init_values = [50, 0, 1]
-
-        popt, pcov = curve_fit(func, xdata, ydata, p0=init_values, bounds=([0, 0, 0], [100000, 10, min(ydata)]))
+        with get_metrics().phase('fitting', function=self.lambda_function.arn):
+            model, self.held_out_errors = fit_performance_model(xdata, ydata, architecture=architecture,
+                                                                region=self.lambda_function.region)
+        model.min_memory_size = self.min_memory_size(architecture)
+        self.fit_quality = self._r_squared(ydata, model.get_duration(xdata))
 
         # save to repository
-        self._save_model(popt)
+        self._save_model(model, architecture, max_sampled_memory_size=int(max(xdata)))
+        self.models[architecture] = model
+        return model
+
+    def configure_function(self, logs_path=None, cleanup=False):
+        """ Samples (unless `logs_path` is given), fits and recommends the (architecture, memory size) pair
+        :param logs_path: (optional) averaged logs of the first architecture, skips sampling
+        :param cleanup: delete all aliases and versions created by the sizer afterwards
+        :return `SizingResult`, predicted logs, parameters of the recommended architecture's model, sampling cost
+        """
+        if not logs_path:
+            logs_paths, total_sampling_cost = self._sample()
+        else:
+            logs_paths = {self.architectures[0]: logs_path}
+            total_sampling_cost = 0
 
-        memory_step_size = 64
-        all_memory_sizes = list(map(lambda x: x * memory_step_size, range(2, 47)))
-        logs = list(map(lambda x: self._predict(x, func, popt), all_memory_sizes))
+        all_memory_sizes = list(map(lambda x: x * MEMORY_STEP_SIZE,
+                                    range(MIN_MEMORY_SIZE // MEMORY_STEP_SIZE, MAX_MEMORY_SIZE // MEMORY_STEP_SIZE + 1)))
+        logs = []
+        for architecture, path in logs_paths.items():
+            model = self._fit(path, architecture)
+            logs += [self._predict(x, model) for x in all_memory_sizes if x >= model.min_memory_size]
+        if not logs:
+            raise ValueError(f"No feasible memory size for {self.lambda_function.arn}, it needs at least "
+                             f"{min(self.min_memory_size(architecture) for architecture in logs_paths)} MB")
 
         if self.balanced_weight == 0:
             log = self._find_cheapest(logs)
@@ -132,9 +392,9 @@ class RegressionSizer(LambdaSizer):
         else:
             log = self._find_by_weight(logs, self.balanced_weight)
 
-        result = SizingResult(log.memory_size, log.cost, log.duration)
+        result = SizingResult(log.memory_size, log.cost, log.duration, log.architecture)
 
         if cleanup:
-            self.lambda_function.delete_all_lambda_aliases()
+            self.cleaner.teardown(self.lambda_function)
 
-        return result, logs, list(popt), total_sampling_cost
\ No newline at end of file
+        return result, logs, self.models[log.architecture].params, total_sampling_cost
\ No newline at end of file
@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from model.model_repository import ModelRepository, REPOSITORY_PATH
+from model.state_machine import unqualified_lambda_arn
+from model.step_function import StepFunction
+from sizer.population_optimizer import memory_grid
+from sizer.regression_sizer import RegressionSizer
+from sizer.workflow_sizer import WorkflowSizer
+from util.aws_clients import get_client_provider
+from util.cache import LRUCache, SingleFlight
+from util.lambda_constants import MAX_MEMORY_SIZE
+from util.metrics import get_metrics
+from util.pricing import ARCHITECTURES
+
+logger = logging.getLogger(__name__)
+
+
+class ModelNotFoundError(LookupError):
+    pass
+
+
+class InvalidRequestError(ValueError):
+    pass
+
+
+def _canonical(request: dict):
+    return json.dumps(request, sort_keys=True)
+
+
+def _require(request: dict, *fields):
+    """ Raises `InvalidRequestError` if the request is no JSON object or lacks one of the fields """
+    if not isinstance(request, dict):
+        raise InvalidRequestError("Request must be a JSON object")
+    missing = [field for field in fields if field not in request]
+    if missing:
+        raise InvalidRequestError(f"Missing field {', '.join(missing)}")
+
+
+class SizingService:
+    """ Answers sizing requests from fitted models that are kept in memory.
+
+    Performance models, compiled workflows (including the Map iterations and Choice probabilities mined from
+    recent executions) and results are cached. Identical requests arriving while one is computed wait for its
+    result instead of solving again. Models and results are dropped as soon as the repository file changes,
+    compiled workflows are kept since they do not depend on the models.
+    """
+
+    def __init__(self, repository_path: str = REPOSITORY_PATH, cache_size: int = 1024, client_provider=None):
+        """
+        :param cache_size: maximum number of cached results and of cached compiled workflows
+        """
+        self.repository_path = repository_path
+        self.client_provider = client_provider if client_provider else get_client_provider()
+        self.repository = None
+        self._repository_version = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+        # (arn, architecture) -> performance model / payload model
+        self.models = {}
+        self.payload_models = {}
+        self.results = LRUCache(cache_size)
+        self.workflow_sizers = LRUCache(cache_size)
+        self._flights = SingleFlight()
+        self._check_repository()
+
+    def _check_repository(self):
+        """ Reloads the repository if its file changed since it was read, keeps the old one while it is written """
+        try:
+            stat = os.stat(self.repository_path)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None
+        if version == self._repository_version:
+            return
+        with self._lock:
+            if version == self._repository_version:
+                return
+            try:
+                repository = ModelRepository(self.repository_path)
+            except ValueError as e:
+                logger.warning(f"Could not reload {self.repository_path}: {e}")
+                return
+            self.repository = repository
+            self._repository_version = version
+            self.models = {}
+            self.payload_models = {}
+            self.results.clear()
+            self.reloads += 1
+            logger.info(f"Loaded {len(repository.models)} models from {self.repository_path}")
+
+    def _model(self, arn: str, architecture: str = ARCHITECTURES[0]):
+        key = (unqualified_lambda_arn(arn), architecture)
+        if key not in self.models:
+            self.models[key] = self.repository.get(key[0], architecture)
+        return self.models[key]
+
+    def _payload_model(self, arn: str, architecture: str = ARCHITECTURES[0]):
+        key = (unqualified_lambda_arn(arn), architecture)
+        if key not in self.payload_models:
+            self.payload_models[key] = self.repository.get_payload_model(key[0], architecture)
+        return self.payload_models[key]
+
+    def _models(self, arn: str, architectures: list = None):
+        """ Returns the performance models of a function for the given architectures (default all) it has one for """
+        models = [self._model(arn, architecture) for architecture in (architectures or ARCHITECTURES)]
+        return [model for model in models if model]
+
+    def _cached(self, key, compute):
+        self._check_repository()
+        result = self.results.get(key)
+        if result is not None:
+            return result
+        version = self._repository_version
+        result = self._flights.do(key, compute)
+        # results computed from a repository that changed in the meantime are not cached
+        if version == self._repository_version:
+            self.results.put(key, result)
+        return result
+
+    def size_function(self, request: dict):
+        """ Recommends the (architecture, memory size) pair of a function from its models
+        :param request: dict with `arn`, optional `balanced_weight` (default 0.5), `architectures` and
+            `max_memory_size`
+        :return dict with `arn`, `architecture`, `memorySize`, `cost` and `duration`
+        """
+        _require(request, 'arn')
+        return self._cached(('function', _canonical(request)), lambda: self._size_function(request))
+
+    def _size_function(self, request: dict):
+        arn = request['arn']
+        balanced_weight = request.get('balanced_weight', 0.5)
+        max_memory_size = request.get('max_memory_size', MAX_MEMORY_SIZE)
+        models = self._models(arn, request.get('architectures'))
+        if not models:
+            raise ModelNotFoundError(f"No performance model for {arn}")
+        logs = []
+        for model in models:
+            if model.min_memory_size <= max_memory_size:
+                logs += model.create_logs(memory_grid(model.min_memory_size, max_memory_size))
+        if not logs:
+            raise ValueError(f"No feasible memory size for {arn}, it needs at least "
+                             f"{min(model.min_memory_size for model in models)} MB")
+
+        if balanced_weight == 0:
+            log = RegressionSizer._find_cheapest(logs)
+        elif balanced_weight == 1:
+            log = RegressionSizer._find_fastest(logs)
+        else:
+            log = RegressionSizer._find_by_weight(logs, balanced_weight)
+        return {
+            'arn': arn,
+            'architecture': log.architecture,
+            'memorySize': int(log.memory_size),
+            'cost': float(log.cost),
+            'duration': float(log.duration),
+        }
+
+    def size_functions(self, request: dict):
+        """ Recommends memory sizes of several functions
+        :param request: dict with `arns` and the options of `size_function`
+        :return list of results of `size_function`, with `error` for functions without model
+        """
+        _require(request, 'arns')
+        results = []
+        for arn in request['arns']:
+            function_request = dict(request, arn=arn)
+            del function_request['arns']
+            try:
+                results.append(self.size_function(function_request))
+            except ModelNotFoundError as e:
+                results.append({'arn': arn, 'error': str(e)})
+        return results
+
+    def size_workflow(self, request: dict):
+        """ Sizes a workflow from the models of its functions
+        :param request: dict with `arn` and optional `elat_constraint` (default 2000), `definition`, `percentile`,
+            `method`, `max_memory_size`, `map_iterations`, `choice_probabilities` and `input_distribution`, see
+            `WorkflowSizer`, as well as `architectures` (every function uses the model of the first of them it has
+            one for, default x86_64 before arm64)
+        :return dict with `arn`, `sizes`, `elat`, `cost`, `functions` (the Lambda ARNs the sizes belong to) and
+            `architectures` (the architecture of each function's model)
+        """
+        _require(request, 'arn')
+        return self._cached(('workflow', _canonical(request)), lambda: self._size_workflow(request))
+
+    def _compiled(self, request: dict):
+        """ Returns a sizer holding the compiled workflow, the definition and the mined execution statistics """
+        compile_request = {key: request.get(key) for key in
+                           ['arn', 'definition', 'map_iterations', 'choice_probabilities']}
+        key = _canonical(compile_request)
+        sizer = self.workflow_sizers.get(key)
+        if sizer is None:
+            def compile():
+                compiled = WorkflowSizer(request['arn'], elat_constraint=0,
+                                         step_function=StepFunction(arn=request['arn'],
+                                                                    client_provider=self.client_provider),
+                                         definition=request.get('definition'),
+                                         map_iterations=request.get('map_iterations'),
+                                         choice_probabilities=request.get('choice_probabilities'))
+                compiled.compile()
+                self.workflow_sizers.put(key, compiled)
+                return compiled
+
+            sizer = self._flights.do(('compile', key), compile)
+        return sizer
+
+    def _size_workflow(self, request: dict):
+        compiled = self._compiled(request)
+        lambda_arns = compiled.workflow.lambda_arns
+        models = [next(iter(self._models(arn, request.get('architectures'))), None) for arn in lambda_arns]
+        missing = [arn for arn, model in zip(lambda_arns, models) if model is None]
+        if missing:
+            raise ModelNotFoundError(f"No performance models for {missing}")
+        payload_models = None
+        if request.get('input_distribution'):
+            payload_models = [self._payload_model(arn, model.architecture) for arn, model in zip(lambda_arns, models)]
+
+        sizer = WorkflowSizer(request['arn'], request.get('elat_constraint', 2000), performance_models=models,
+                              step_function=compiled.step_function, definition=compiled.definition,
+                              map_iterations=compiled.map_iterations,
+                              choice_probabilities=compiled.choice_probabilities,
+                              percentile=request.get('percentile', 0.95),
+                              input_distribution=request.get('input_distribution'), payload_models=payload_models)
+        sizer.workflow = compiled.workflow
+        sizes, elat, cost = sizer.run(request.get('max_memory_size', MAX_MEMORY_SIZE), method=request.get('method', 'annealing'))
+        return {
+            'arn': request['arn'],
+            'sizes': [int(size) for size in sizes],
+            'elat': float(elat),
+            'cost': float(cost),
+            'functions': lambda_arns,
+            'architectures': [model.architecture for model in models],
+        }
+
+    def invalidate(self, request: dict = None):
+        """ Drops all cached models, results and compiled workflows
+        :return stats of the service
+        """
+        with self._lock:
+            self._repository_version = None
+            self.workflow_sizers.clear()
+        self._check_repository()
+        return self.stats()
+
+    def stats(self):
+        return {
+            'models': len(self.repository.models) if self.repository else 0,
+            'repository_reloads': self.reloads,
+            'results': self.results.to_dict(),
+            'workflows': self.workflow_sizers.to_dict(),
+            'coalesced_requests': self._flights.coalesced,
+        }
+
+
+class SizingRequestHandler(BaseHTTPRequestHandler):
+    """ JSON API of a `SizingService`:
+
+    GET  /health, /stats, /metrics (Prometheus text format)
+    POST /function, /functions, /workflow, /invalidate
+    """
+    service = None
+
+    def _send(self, status: int, body, content_type: str = 'application/json'):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send(200, self.service.stats())
+        elif self.path == '/metrics':
+            self._send(200, get_metrics().to_prometheus(), 'text/plain; version=0.0.4')
+        else:
+            self._send(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        routes = {
+            '/function': self.service.size_function,
+            '/functions': self.service.size_functions,
+            '/workflow': self.service.size_workflow,
+            '/invalidate': self.service.invalidate,
+        }
+        if self.path not in routes:
+            self._send(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            self._send(200, routes[self.path](request))
+        except ModelNotFoundError as e:
+            self._send(404, {'error': str(e)})
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            logger.exception(f"Request to {self.path} failed")
+            self._send(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.path} {format % args}")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # the HTTP handler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+def create_server(service: SizingService, host: str = '127.0.0.1', port: int = 8080, socket_path: str = None):
+    """ Creates a threaded HTTP server for the service, listening on a Unix socket if `socket_path` is given """
+    handler = type('Handler', (SizingRequestHandler,), {'service': service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,216 @@
+import json
+import logging
+import math
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from model.execution_log import compute_cost
+from model.lambda_function import LambdaFunction
+from model.state_machine import qualify_lambda_arns, unqualified_lambda_arn
+from model.step_function import StepFunction, COST_PER_TRANSITION
+from sizer.lambda_sizer import LambdaSizer
+from sizer.workflow_sizer import WorkflowSizer
+from util.aws_clients import get_client_provider
+from util.metrics import get_metrics
+from util.pricing import X86_64, region_of_arn
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkResult:
+    def __init__(self, sizes: dict, predicted_elat: float, predicted_cost: float, percentile: float):
+        self.sizes = sizes
+        self.predicted_elat = predicted_elat
+        self.predicted_cost = predicted_cost
+        self.percentile = percentile
+        self.durations = []
+        self.costs = []
+        self.failures = 0
+
+    def to_dict(self):
+        measured_elat = float(np.percentile(self.durations, self.percentile * 100)) if self.durations else None
+        measured_cost = float(np.mean(self.costs)) if self.costs else None
+        return {
+            'sizes': self.sizes,
+            'executions': len(self.durations),
+            'failures': self.failures,
+            'predicted_elat': self.predicted_elat,
+            'measured_elat': measured_elat,
+            'measured_mean_duration': float(np.mean(self.durations)) if self.durations else None,
+            'elat_error': (measured_elat - self.predicted_elat) / self.predicted_elat
+            if measured_elat is not None and self.predicted_elat else None,
+            'predicted_cost': self.predicted_cost,
+            'measured_cost': measured_cost,
+            'cost_error': (measured_cost - self.predicted_cost) / self.predicted_cost
+            if measured_cost is not None and self.predicted_cost else None,
+        }
+
+
+class WorkflowBenchmark:
+    """ Benchmarks several memory configurations of a workflow at the same time.
+
+    Every configuration gets a temporary copy of the state machine whose Task states invoke the per-size aliases of
+    their functions, so all variants run in parallel and the executions never invoke the live functions. Missing or
+    stale aliases are published from `$LATEST` of a function, its memory size is changed while they are published
+    and restored afterwards. Measured
+    latency is the execution duration, measured cost is derived from the Lambda step durations of the execution
+    history and the state transitions. The temporary state machines are deleted afterwards.
+    """
+
+    def __init__(self, state_machine_arn: str, configurations: list, payload: dict = None,
+                 executions: int = 5, warmup_executions: int = 1, percentile: float = 0.95,
+                 performance_models: list = None, definition: dict = None, client_provider=None,
+                 poll_interval: float = 2):
+        """
+        :param configurations: list of configurations, each a dict of Lambda ARN -> memory size or a list of
+            memory sizes aligned with the Lambda ARNs of the compiled workflow
+        :param payload: input of every execution
+        :param executions: measured executions per configuration
+        :param warmup_executions: executions per configuration before measuring, not recorded
+        :param percentile: latency percentile that is compared with the predicted elat
+        """
+        self.client_provider = client_provider if client_provider else get_client_provider()
+        self.step_function = StepFunction(state_machine_arn, self.client_provider)
+        self.sizer = WorkflowSizer(state_machine_arn, elat_constraint=math.inf, performance_models=performance_models,
+                                   step_function=self.step_function, definition=definition, percentile=percentile)
+        self.configurations = configurations
+        self.payload = payload if payload else {}
+        self.executions = executions
+        self.warmup_executions = warmup_executions
+        self.percentile = percentile
+        self.poll_interval = poll_interval
+
+    def _resolve(self, lambda_arns: list):
+        """ Returns the configurations as dicts of Lambda ARN -> memory size """
+        configurations = []
+        for configuration in self.configurations:
+            if isinstance(configuration, dict):
+                configuration = {unqualified_lambda_arn(arn): size for arn, size in configuration.items()}
+                missing = [arn for arn in lambda_arns if arn not in configuration]
+                if missing:
+                    raise ValueError(f"Configuration {configuration} has no memory size for {missing}")
+            else:
+                if len(configuration) != len(lambda_arns):
+                    raise ValueError(f"Expected {len(lambda_arns)} memory sizes, got {configuration}")
+                configuration = dict(zip(lambda_arns, configuration))
+            configurations.append({arn: int(configuration[arn]) for arn in lambda_arns})
+        return configurations
+
+    def _provision_aliases(self, configurations: list):
+        """ Creates the missing per-size aliases of the deployed architecture of every function and republishes the
+        ones whose version runs older code than `$LATEST`, one function at a time per thread since publishing
+        versions of the same function cannot be parallelized
+        :return dict of Lambda ARN -> deployed architecture
+        """
+        sizes = {}
+        for configuration in configurations:
+            for arn, size in configuration.items():
+                sizes.setdefault(arn, set()).add(size)
+        if not sizes:
+            return {}
+
+        def provision(arn):
+            function = LambdaFunction(arn, self.client_provider.client('lambda'))
+            config = function.get_config()
+            architecture = config.get('Architectures', [X86_64])[0]
+            try:
+                for size in sorted(sizes[arn]):
+                    alias = LambdaSizer.get_alias_for_memory_size(size, architecture)
+                    if function.verify_alias_exists(alias):
+                        if function.get_config(alias)['CodeSha256'] == config['CodeSha256']:
+                            continue
+                        logger.info(f"{alias} of {arn} runs outdated code, republishing it")
+                    function.create_memory_config(value=size, alias=alias, architecture=architecture)
+            finally:
+                function.set_memory_size(config['MemorySize'])
+            return architecture
+
+        with get_metrics().phase('alias_provisioning', function=self.step_function.state_machine_arn), \
+                ThreadPoolExecutor(max_workers=len(sizes)) as executor:
+            return dict(zip(sizes, executor.map(provision, sizes)))
+
+    def _predict(self, workflow, configuration: dict):
+        models = self.sizer.performance_models
+        sizes = [configuration[arn] for arn in workflow.lambda_arns]
+        durations = [model.get_duration(size) for model, size in zip(models, sizes)]
+        costs = [model.get_cost(size) for model, size in zip(models, sizes)]
+        return float(workflow.elat(durations, self.percentile)), float(workflow.cost(costs))
+
+    @staticmethod
+    def _step_cost(qualified_arn: str, duration: float):
+        """ Prices a Lambda step from the memory size and architecture of its alias (`<size>MB[-<architecture>]`) """
+        match = re.search(r':(\d+)MB(?:-(\w+))?$', qualified_arn)
+        if not match:
+            raise ValueError(f"Cannot price step of {qualified_arn}, it does not invoke a per-size alias")
+        return compute_cost(int(match.group(1)), math.ceil(duration), match.group(2) or X86_64,
+                            region_of_arn(qualified_arn))
+
+    def _execute(self, variant: StepFunction):
+        """ Runs one execution of a variant
+        :return duration in ms and cost, or None if the execution failed
+        """
+        execution_arn = variant.invoke(payload=json.dumps(self.payload))['executionArn']
+        description = variant.wait_for_execution(execution_arn, self.poll_interval)
+        if description['status'] != 'SUCCEEDED':
+            logger.warning(f"Execution {execution_arn} {description['status']}")
+            return None
+        duration = (description['stopDate'] - description['startDate']).total_seconds() * 1000
+        steps, transitions = variant.get_task_durations(execution_arn)
+        cost = sum(self._step_cost(arn, step_duration) for arn, step_duration in steps) + \
+            transitions * COST_PER_TRANSITION
+        return duration, cost
+
+    def _run_variant(self, variant: StepFunction, result: BenchmarkResult):
+        # executions of one variant run one after another so they reuse warm execution environments
+        for i in range(self.warmup_executions + self.executions):
+            measured = self._execute(variant)
+            if i < self.warmup_executions:
+                continue
+            if measured is None:
+                result.failures += 1
+            else:
+                result.durations.append(measured[0])
+                result.costs.append(measured[1])
+        return result
+
+    def run(self):
+        """ Benchmarks all configurations in parallel
+        :return list of `BenchmarkResult`, one per configuration
+        """
+        workflow = self.sizer.compile()
+        if not self.sizer.performance_models:
+            self.sizer.performance_models = self.sizer.load_performance_models(workflow.lambda_arns)
+        configurations = self._resolve(workflow.lambda_arns)
+        architectures = self._provision_aliases(configurations)
+
+        name = self.step_function.state_machine_arn.split(':')[-1]
+        token = uuid.uuid4().hex[:8]
+        variants = []
+        results = []
+        try:
+            for i, configuration in enumerate(configurations):
+                qualifiers = {arn: LambdaSizer.get_alias_for_memory_size(size, architectures[arn])
+                              for arn, size in configuration.items()}
+                definition = qualify_lambda_arns(self.sizer.definition, qualifiers)
+                # state machine names have at most 80 characters, the unique suffix must not be cut off
+                suffix = f'-benchmark-{token}-{i}'
+                variants.append(self.step_function.create_variant(f'{name[:80 - len(suffix)]}{suffix}', definition))
+                predicted_elat, predicted_cost = (None, None)
+                if len(self.sizer.performance_models) == len(workflow.lambda_arns):
+                    predicted_elat, predicted_cost = self._predict(workflow, configuration)
+                results.append(BenchmarkResult(configuration, predicted_elat, predicted_cost, self.percentile))
+
+            # newly created state machines may not be executable right away
+            time.sleep(self.poll_interval)
+            with get_metrics().phase('benchmark', function=self.step_function.state_machine_arn), \
+                    ThreadPoolExecutor(max_workers=len(variants)) as executor:
+                list(executor.map(self._run_variant, variants, results))
+        finally:
+            for variant in variants:
+                try:
+                    variant.delete()
+                except Exception as e:
+                    logger.error(f"Could not delete {variant.state_machine_arn}: {e}")
+        return results
@@ -1,65 +1,153 @@
-import json
-from model.step_function import StepFunction, TIME_PER_TRANSITION
-from model.performance_model import PerformanceModel
-from util.lambda_constants import MIN_MEMORY_SIZE
+from model.step_function import StepFunction
+from model.state_machine import compile_workflow
+from model.model_repository import ModelRepository
+from util.lambda_constants import MIN_MEMORY_SIZE, MAX_MEMORY_SIZE
 from scipy.optimize import dual_annealing
+from sizer.population_optimizer import GeneticOptimizer, WorkflowObjective, memory_grid
+from util.metrics import get_metrics
 
 
 class WorkflowSizer:
-    def __init__(self, state_machine_arn: str, elat_constraint: int, performance_models=None):
+    def __init__(self, state_machine_arn: str, elat_constraint: int, performance_models=None, step_function=None,
+                 definition: dict = None, map_iterations: dict = None, choice_probabilities: dict = None,
+                 percentile: float = 0.95, input_distribution: list = None, payload_models: list = None):
+        """
+        :param performance_models: (optional) models aligned with the Lambda ARNs of the compiled workflow
+        :param definition: (optional) state machine definition, fetched from AWS if not given
+        :param map_iterations: (optional) average iterations per Map state, mined from recent executions if not given
+        :param choice_probabilities: (optional) branch probabilities per Choice state, mined from recent executions
+        if not given
+        :param percentile: latency percentile over Choice branches that has to satisfy the elat constraint
+        :param input_distribution: (optional) input classes of the workflow as dicts with `input_size` (in MB) and
+        `weight`, elat and cost are taken over this distribution instead of the sampled payload of each function
+        :param payload_models: (optional) `PayloadPerformanceModel`s aligned with the Lambda ARNs, None for functions
+        sampled with a single payload, loaded from the repository if not given
+        """
         self.state_machine_arn = state_machine_arn
         self.elat_constraint = elat_constraint
-        self.step_function = StepFunction(arn=state_machine_arn)
+        self.step_function = step_function if step_function else StepFunction(arn=state_machine_arn)
         self.performance_models = performance_models
+        self.definition = definition
+        self.map_iterations = map_iterations
+        self.choice_probabilities = choice_probabilities
+        self.percentile = percentile
+        self.input_distribution = input_distribution
+        self.payload_models = payload_models
+        # compiled workflow, reused by later runs
+        self.workflow = None
 
-    def run(self,max_memory_size = 3008):
+    def compile(self):
+        """ Compiles the state machine definition, using observed iteration counts for Map states and observed
+        branch probabilities for Choice states
+        """
+        if self.workflow:
+            return self.workflow
+        if not self.definition:
+            self.definition = self.step_function.get_definition()
+        workflow = compile_workflow(self.definition, self.map_iterations, self.choice_probabilities)
+        if (workflow.map_states and self.map_iterations is None) or \
+                (workflow.choice_states and self.choice_probabilities is None):
+            map_iterations, choice_probabilities = self.step_function.get_execution_statistics()
+            if self.map_iterations is None:
+                self.map_iterations = map_iterations
+            if self.choice_probabilities is None:
+                self.choice_probabilities = choice_probabilities
+            workflow = compile_workflow(self.definition, self.map_iterations, self.choice_probabilities)
+        self.workflow = workflow
+        return workflow
+
+    def run(self, max_memory_size: int = MAX_MEMORY_SIZE, method: str = 'annealing', optimizer: GeneticOptimizer = None):
+        """
+        :param method: 'annealing' (dual annealing on the continuous sizes) or 'genetic' (vectorized genetic algorithm
+        over the memory grid with restarts in parallel processes)
+        :param optimizer: (optional) configured `GeneticOptimizer` for the genetic method, its grid is used instead of
+        the memory grid up to `max_memory_size`
+        """
+        workflow = self.compile()
         if not self.performance_models:
-            lambda_arns = self.step_function.get_lambda_resources()
-            self.performance_models = self.load_performance_models(lambda_arns)
+            self.performance_models = self.load_performance_models(workflow.lambda_arns)
+        if len(self.performance_models) != len(workflow.lambda_arns):
+            raise ValueError(f"Expected {len(workflow.lambda_arns)} performance models, "
+                             f"got {len(self.performance_models)}")
 
         performance_models = self.performance_models
+        input_models, input_weights = self._input_models(workflow.lambda_arns)
+        # every input class has to fit into the memory size of a function
+        min_memory_sizes = [max(models[i].min_memory_size for models in input_models or [performance_models])
+                            for i in range(len(performance_models))]
+        unsizable = [arn for arn, size in zip(workflow.lambda_arns, min_memory_sizes) if size > max_memory_size]
+        if unsizable:
+            raise ValueError(f"Smallest feasible memory size of {unsizable} exceeds {max_memory_size} MB")
 
-        # TODO: generalize this for all workflows
         def get_elat(memory_sizes):
-            elat = TIME_PER_TRANSITION * len(performance_models)
-            elat += performance_models[0].get_duration(memory_sizes[0])
-            # assuming two parallel branches with one function each
-            branches = [performance_models[1].get_duration(memory_sizes[1]),
-                        performance_models[2].get_duration(memory_sizes[2])]
-            elat += max(branches)
-            elat += performance_models[3].get_duration(memory_sizes[3])
-            return elat
+            if input_models:
+                durations = [[model.get_duration(size) for model, size in zip(models, memory_sizes)]
+                             for models in input_models]
+                return workflow.elat_over_inputs(durations, input_weights, self.percentile)
+            durations = [model.get_duration(size) for model, size in zip(performance_models, memory_sizes)]
+            return workflow.elat(durations, self.percentile)
 
         def get_cost(memory_sizes):
             elat_diff = get_elat(memory_sizes) - self.elat_constraint
             if elat_diff > 0:
-                # penalty for violating constraint
-                return 1
-            k = 0
-            for i, size in enumerate(memory_sizes):
-                k += performance_models[i].get_cost(size)
-            return k
+                # penalty for violating constraint, grows with the violation to guide the search back
+                return 1 + elat_diff / self.elat_constraint
+            if input_models:
+                costs = [[model.get_cost(size) for model, size in zip(models, memory_sizes)] for models in input_models]
+                return workflow.cost_over_inputs(costs, input_weights)
+            return workflow.cost([model.get_cost(size) for model, size in zip(performance_models, memory_sizes)])
+
+        if method == 'genetic':
+            if not optimizer:
+                optimizer = GeneticOptimizer(grid=memory_grid(MIN_MEMORY_SIZE, max_memory_size))
+            objective = WorkflowObjective(workflow, performance_models, self.elat_constraint, self.percentile,
+                                          input_models, input_weights)
+            with get_metrics().phase('optimization', function=self.state_machine_arn):
+                selected_sizes, cost, violation = optimizer.minimize(objective, len(performance_models))
+            if violation > 0:
+                raise ValueError(f"No configuration satisfies the elat constraint of {self.elat_constraint}")
+            return selected_sizes, get_elat(selected_sizes), cost
 
-        bounds = [(MIN_MEMORY_SIZE, max_memory_size) for i in performance_models]
+        # sizes below the smallest feasible memory size of a function ran out of memory or timed out
+        bounds = [(min_memory_size, max_memory_size) for min_memory_size in min_memory_sizes]
         # dual annealing enables global optimization, does not support constraints out of the box
         # modified objective function to support constraint
-        result = dual_annealing(get_cost, bounds=bounds, maxiter=1000)
+        with get_metrics().phase('optimization', function=self.state_machine_arn):
+            result = dual_annealing(get_cost, bounds=bounds, maxiter=1000)
         if result.success:
             selected_sizes = list(map(lambda x: int(x), result.x))
             return selected_sizes,get_elat(selected_sizes), result.fun
         else:
             raise ValueError(result.message)
 
+    def _input_models(self, lambda_arns: list):
+        """ Conditions the payload models on the input classes of `input_distribution`, functions without a payload
+        model keep their model for all input classes
+        :return per input class models aligned with the Lambda ARNs and probability of each input class, or None, None
+        """
+        if not self.input_distribution:
+            return None, None
+        if self.payload_models is None:
+            self.payload_models = self.load_payload_models(lambda_arns)
+        total_weight = sum(c.get('weight', 1) for c in self.input_distribution)
+        input_models = [[payload_model.at(c['input_size']) if payload_model else model
+                         for payload_model, model in zip(self.payload_models, self.performance_models)]
+                        for c in self.input_distribution]
+        return input_models, [c.get('weight', 1) / total_weight for c in self.input_distribution]
+
+    @staticmethod
+    def load_payload_models(lambda_arns: list):
+        repo = ModelRepository()
+        return [repo.get_payload_model(arn.replace(":128MB", "")) for arn in lambda_arns]
+
     @staticmethod
     def load_performance_models(lambda_arns: list):
-        with open('./performance_model_repository.json', 'r') as f:
-            repo = json.load(f)
+        repo = ModelRepository()
 
         models = []
 
         for arn in lambda_arns:
             arn = arn.replace(":128MB", "")
             if arn in repo:
-                variables = repo[arn]
-                models.append(PerformanceModel(t0=variables[0], _lambda=variables[1], t_min=variables[2]))
+                models.append(repo.get(arn))
         return models
@@ -0,0 +1,20 @@
+# Tool to delete all aliases and versions created by the sizer and report the reclaimed code storage.
+import json
+import sys
+from model.cleaner import Cleaner
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+
+    if len(argv) > 0 and argv[0] in ['-h', '--help']:
+        print("Usage: [<function-arn> ...]  (defaults to all functions of the account)")
+        exit(0)
+
+    total_bytes = 0
+    total_versions = 0
+    for report in Cleaner().teardown_all(argv):
+        print(json.dumps(report.to_dict()))
+        total_bytes += report.reclaimed_bytes
+        total_versions += len(report.versions)
+    print(f"Deleted {total_versions} versions, reclaimed {total_bytes / 1024 ** 2:.1f} MB of code storage")
@@ -0,0 +1,75 @@
+import threading
+import boto3
+from botocore.config import Config
+from util.metrics import get_metrics
+
+# Lambda invocations are synchronous and can take up to the maximum function timeout
+LAMBDA_READ_TIMEOUT = 900
+
+
+class ClientProvider:
+    """ Shares a single boto3 session and one pooled client/resource per service.
+
+    boto3 clients are thread safe, so all sizers, functions and state machines of a process can use the same
+    clients instead of opening new connections (and paying for new TLS handshakes) per instance.
+    All API calls of the created clients are counted by `metrics`.
+    """
+
+    def __init__(self, session=None, max_pool_connections: int = 50, max_attempts: int = 10,
+                 connect_timeout: int = 10, read_timeout: int = 60, region_name: str = None, metrics=None,
+                 retry_mode: str = 'adaptive'):
+        self.session = session if session else boto3.session.Session(region_name=region_name)
+        self.metrics = metrics if metrics else get_metrics()
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self.retry_mode = retry_mode
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._clients = {}
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def config(self, service: str):
+        """ Returns the botocore configuration used for the given service """
+        read_timeout = LAMBDA_READ_TIMEOUT if service == 'lambda' else self.read_timeout
+        return Config(max_pool_connections=self.max_pool_connections,
+                      retries={'max_attempts': self.max_attempts, 'mode': self.retry_mode},
+                      connect_timeout=self.connect_timeout,
+                      read_timeout=read_timeout)
+
+    def client(self, service: str):
+        """ Returns the shared client for the given service, creating it on first use """
+        with self._lock:
+            if service not in self._clients:
+                client = self.session.client(service, config=self.config(service))
+                self._clients[service] = self.metrics.attach(client)
+            return self._clients[service]
+
+    def resource(self, service: str):
+        """ Returns the shared resource for the given service, creating it on first use """
+        with self._lock:
+            if service not in self._resources:
+                resource = self.session.resource(service, config=self.config(service))
+                self.metrics.attach(resource.meta.client)
+                self._resources[service] = resource
+            return self._resources[service]
+
+
+_default_provider = None
+_default_lock = threading.Lock()
+
+
+def get_client_provider():
+    """ Returns the process wide default `ClientProvider` """
+    global _default_provider
+    with _default_lock:
+        if _default_provider is None:
+            _default_provider = ClientProvider()
+        return _default_provider
+
+
+def set_client_provider(provider: ClientProvider):
+    """ Replaces the process wide default `ClientProvider`, e.g. to change pool size or region """
+    global _default_provider
+    with _default_lock:
+        _default_provider = provider
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """ Thread safe cache that evicts the least recently used entry once it holds `max_size` entries """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def to_dict(self):
+        return {'size': len(self._items), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+class SingleFlight:
+    """ Coalesces concurrent calls with the same key: the first caller computes the result, callers arriving while
+    it is in flight wait for it instead of computing it again
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, function):
+        """ Returns the result of `function()`, or of the call with the same key that is already in flight.
+        Exceptions are raised to all callers.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                future.set_result(function())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        return future.result()
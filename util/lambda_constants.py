@@ -1,4 +1,5 @@
 MIN_MEMORY_SIZE = 128
+MAX_MEMORY_SIZE = 10240
 MIN_COST = 0.0000000021
 STATIC_INVOCATION_COST = 0.0000002
 MEMORY_STEP_SIZE = 64
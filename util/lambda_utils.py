@@ -1,8 +1,13 @@
 import re
 from model.execution_log import ExecutionLog
+from util.pricing import X86_64
 
+OUT_OF_MEMORY_ERROR = 'OutOfMemory'
+TIMEOUT_ERROR = 'Timeout'
+FUNCTION_ERROR = 'FunctionError'
 
-def extract_data_from_log(log):
+
+def extract_data_from_log(log, architecture=X86_64, region=None):
     init_duration = 0
 
     match = re.search('Init Duration: (([0-9]*[.])?[0-9]+) ms', log)
@@ -14,7 +19,28 @@ def extract_data_from_log(log):
     billed_duration = int(match.group(1))
     match = re.search('Memory Size: ([0-9]*) MB', log)
     memory_size = int(match.group(1))
-    return ExecutionLog(duration, billed_duration, memory_size, init_duration)
+    max_memory_used = None
+    match = re.search('Max Memory Used: ([0-9]*) MB', log)
+    if match:
+        max_memory_used = int(match.group(1))
+    return ExecutionLog(duration, billed_duration, memory_size, init_duration, architecture, region,
+                        max_memory_used, extract_error_from_log(log))
+
+
+def extract_error_from_log(log, function_error=None, payload=None):
+    """ Classifies the error of a failed invocation from its log tail and response
+    :param function_error: (optional) `FunctionError` of the invoke response
+    :param payload: (optional) decoded response payload
+    :return `OutOfMemory`, `Timeout`, `FunctionError` or None if the invocation succeeded
+    """
+    text = log + (payload or '')
+    if re.search('Task timed out|Status: timeout', text):
+        return TIMEOUT_ERROR
+    if re.search('OutOfMemory|signal: killed', text):
+        return OUT_OF_MEMORY_ERROR
+    if function_error or re.search('Status: error', log):
+        return FUNCTION_ERROR
+    return None
 
 
 
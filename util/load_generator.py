@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from util.lambda_utils import OUT_OF_MEMORY_ERROR, TIMEOUT_ERROR
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODE = 'TooManyRequestsException'
+
+
+class LoadProfile:
+    """ Load applied to a function while sampling.
+
+    Either closed-loop with `concurrency` workers that invoke back-to-back, or open-loop with arrivals at `rate`
+    requests per second (Poisson or evenly spaced) that do not wait for earlier requests to complete.
+    """
+
+    def __init__(self, concurrency: int = None, rate: float = None, duration: float = 30, warmup: float = 5,
+                 poisson: bool = True, max_workers: int = 64):
+        """
+        :param concurrency: number of concurrent closed-loop workers
+        :param rate: arrivals per second of the open-loop mode
+        :param duration: seconds of measured load
+        :param warmup: seconds of load before `duration` whose invocations are not recorded
+        :param poisson: exponentially distributed inter-arrival times, else evenly spaced
+        :param max_workers: maximum number of in-flight invocations of the open-loop mode
+        """
+        if (concurrency is None) == (rate is None):
+            raise ValueError("Load profile needs either concurrency or rate")
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.warmup = warmup
+        self.poisson = poisson
+        self.max_workers = max_workers
+
+    @staticmethod
+    def from_dict(profile: dict):
+        return LoadProfile(**profile)
+
+    @property
+    def workers(self):
+        return self.concurrency if self.concurrency else self.max_workers
+
+    def to_dict(self):
+        return {'concurrency': self.concurrency, 'rate': self.rate, 'duration': self.duration,
+                'warmup': self.warmup, 'poisson': self.poisson}
+
+
+class LoadResult:
+    """ Latency distribution of the invocations of a load run.
+
+    `durations` are the billed-relevant durations reported by Lambda, `latencies` are measured by the client from
+    the scheduled arrival, so they include queueing in the load generator and throttling.
+    """
+
+    def __init__(self, profile: LoadProfile):
+        self.profile = profile
+        self.logs = []
+        self.latencies = []
+        self.throttles = 0
+        self.errors = 0
+        # out of memory errors and timeouts
+        self.fatal_errors = 0
+        self.cost = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def durations(self):
+        return [log.duration for log in self.logs]
+
+    @staticmethod
+    def statistic(values: list, name: str = 'median'):
+        """ Returns `mean`, `median` or a percentile `p<q>` (e.g. `p95`) of the values """
+        if not values:
+            return float('nan')
+        if name == 'mean':
+            return float(np.mean(values))
+        if name == 'median':
+            return float(np.median(values))
+        if name.startswith('p'):
+            return float(np.percentile(values, float(name[1:])))
+        raise ValueError(f"Unknown statistic {name}")
+
+    def to_dict(self):
+        attempts = len(self.logs) + self.throttles + self.errors
+        summary = {'profile': self.profile.to_dict(), 'invocations': len(self.logs), 'throttles': self.throttles,
+                   'errors': self.errors, 'fatal_errors': self.fatal_errors,
+                   'max_memory_used': max([log.max_memory_used or 0 for log in self.logs], default=None),
+                   'throttle_rate': self.throttles / attempts if attempts else 0.0,
+                   'throughput': len(self.logs) / self.elapsed if self.elapsed else 0.0, 'cost': self.cost}
+        for name in ['mean', 'median', 'p90', 'p95', 'p99']:
+            summary[f'duration_{name}'] = self.statistic(self.durations, name)
+            summary[f'latency_{name}'] = self.statistic(self.latencies, name)
+        return summary
+
+
+class LoadGenerator:
+    """ Drives an invocation function with a `LoadProfile` from the local machine """
+
+    def __init__(self, invoke, profile: LoadProfile, seed: int = None):
+        """
+        :param invoke: function without arguments returning the `ExecutionLog` of one invocation
+        """
+        self.invoke = invoke
+        self.profile = profile
+        self.random = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        # set after the first out of memory error or timeout, the remaining load would fail the same way
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def _is_throttle(error: Exception):
+        return getattr(error, 'response', {}).get('Error', {}).get('Code') == THROTTLING_ERROR_CODE
+
+    def _call(self, scheduled: float, measure_from: float, result: LoadResult):
+        try:
+            log = self.invoke()
+        except Exception as e:
+            with self._lock:
+                if scheduled >= measure_from:
+                    if self._is_throttle(e):
+                        result.throttles += 1
+                    else:
+                        result.errors += 1
+                        logger.warning(f"Invocation failed under load: {e}")
+            return
+        latency = (time.perf_counter() - scheduled) * 1000
+        with self._lock:
+            result.cost += log.cost
+            if log.failed:
+                result.errors += 1
+                if log.error in [OUT_OF_MEMORY_ERROR, TIMEOUT_ERROR]:
+                    result.fatal_errors += 1
+                    self._stopped.set()
+            elif scheduled >= measure_from:
+                result.logs.append(log)
+                result.latencies.append(latency)
+
+    def _arrivals(self, start: float, end: float):
+        """ Yields the scheduled arrival times of the open-loop mode """
+        t = start
+        while True:
+            if self.profile.poisson:
+                t += self.random.exponential(1 / self.profile.rate)
+            else:
+                t += 1 / self.profile.rate
+            if t >= end:
+                return
+            yield t
+
+    def run(self):
+        """ Applies the load profile
+        :return `LoadResult` of the invocations after the warm-up
+        """
+        profile = self.profile
+        result = LoadResult(profile)
+        start = time.perf_counter()
+        measure_from = start + profile.warmup
+        end = measure_from + profile.duration
+
+        with ThreadPoolExecutor(max_workers=profile.workers) as executor:
+            if profile.concurrency:
+                def worker():
+                    while time.perf_counter() < end and not self._stopped.is_set():
+                        self._call(time.perf_counter(), measure_from, result)
+
+                for _ in range(profile.concurrency):
+                    executor.submit(worker)
+            else:
+                for scheduled in self._arrivals(start, end):
+                    if self._stopped.is_set():
+                        break
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    # latency counts from the scheduled arrival, so a saturated pool shows up as queueing
+                    executor.submit(self._call, scheduled, measure_from, result)
+        result.elapsed = max(time.perf_counter() - measure_from, 0.0)
+        logger.info(f"Load run: {len(result.logs)} invocations, {result.throttles} throttles, "
+                    f"{result.errors} errors")
+        return result
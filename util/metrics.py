@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException',
+                        'RequestLimitExceeded', 'SlowDown']
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels.items() if v is not None)
+
+
+class Metrics:
+    """ Thread safe collector for the phases, AWS API calls and invocations of a sizing run.
+
+    Phases are timed with `phase`/`timed`, API calls, throttles and retries are collected from botocore events of
+    all clients passed to `attach` (the `ClientProvider` does this for every client it creates).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        # (phase, function) -> [count, total seconds, max seconds]
+        self.phases = {}
+        # (service, operation) -> count
+        self.api_calls = {}
+        self.throttles = {}
+        self.retries = {}
+        # function -> count / dollars
+        self.invocations = {}
+        self.sampling_cost = {}
+
+    def record_phase(self, name: str, seconds: float, function: str = None):
+        with self._lock:
+            entry = self.phases.setdefault((name, function), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    @contextmanager
+    def phase(self, name: str, function: str = None):
+        """ Measures the wall time of the enclosed block as phase `name` """
+        ts = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - ts, function)
+
+    def timed(self, name: str):
+        """ Decorator measuring the wall time of each call as phase `name` """
+        def decorator(method):
+            def timed(*args, **kw):
+                with self.phase(name):
+                    return method(*args, **kw)
+            return timed
+        return decorator
+
+    def record_invocation(self, function: str, cost: float):
+        with self._lock:
+            self.invocations[function] = self.invocations.get(function, 0) + 1
+            self.sampling_cost[function] = self.sampling_cost.get(function, 0.0) + cost
+
+    def _increment(self, counter: dict, key, value: int = 1):
+        with self._lock:
+            counter[key] = counter.get(key, 0) + value
+
+    def _on_before_call(self, model, **kwargs):
+        self._increment(self.api_calls, (model.service_model.service_name, model.name))
+
+    def _on_after_call(self, model, parsed, **kwargs):
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        if retries:
+            self._increment(self.retries, (model.service_model.service_name, model.name), retries)
+
+    def _on_needs_retry(self, operation, response=None, **kwargs):
+        if response is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLE_ERROR_CODES:
+            self._increment(self.throttles, (operation.service_model.service_name, operation.name))
+        # never influence the retry decision
+        return None
+
+    def attach(self, client):
+        """ Registers the API call hooks on a boto3 client """
+        events = client.meta.events
+        events.register('before-call', self._on_before_call)
+        events.register('after-call', self._on_after_call)
+        events.register('needs-retry', self._on_needs_retry)
+        return client
+
+    def to_dict(self):
+        """ Returns all collected metrics as a JSON serializable dict """
+        with self._lock:
+            return {
+                'wall_time': time.time() - self.started,
+                'phases': [{'phase': name, 'function': function, 'count': v[0], 'total_seconds': v[1],
+                            'max_seconds': v[2]} for (name, function), v in sorted(self.phases.items(), key=str)],
+                'api_calls': [{'service': service, 'operation': operation, 'count': count,
+                               'throttles': self.throttles.get((service, operation), 0),
+                               'retries': self.retries.get((service, operation), 0)}
+                              for (service, operation), count in sorted(self.api_calls.items())],
+                'functions': [{'function': function, 'invocations': count,
+                               'sampling_cost': self.sampling_cost.get(function, 0.0)}
+                              for function, count in sorted(self.invocations.items())],
+            }
+
+    def to_prometheus(self):
+        """ Returns all collected metrics in the Prometheus text exposition format """
+        report = self.to_dict()
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in samples:
+                lines.append(f'{name}{{{labels}}} {value}')
+
+        metric('catsizer_phase_seconds_total', 'Wall time spent per phase.',
+               [(_labels(phase=p['phase'], function=p['function']), p['total_seconds']) for p in report['phases']])
+        metric('catsizer_phase_count_total', 'Number of times a phase was entered.',
+               [(_labels(phase=p['phase'], function=p['function']), p['count']) for p in report['phases']])
+        metric('catsizer_api_calls_total', 'AWS API calls by operation.',
+               [(_labels(service=a['service'], operation=a['operation']), a['count']) for a in report['api_calls']])
+        metric('catsizer_api_throttles_total', 'Throttled AWS API call attempts by operation.',
+               [(_labels(service=a['service'], operation=a['operation']), a['throttles']) for a in report['api_calls']])
+        metric('catsizer_api_retries_total', 'Retried AWS API call attempts by operation.',
+               [(_labels(service=a['service'], operation=a['operation']), a['retries']) for a in report['api_calls']])
+        metric('catsizer_invocations_total', 'Lambda invocations per function.',
+               [(_labels(function=f['function']), f['invocations']) for f in report['functions']])
+        metric('catsizer_sampling_cost_dollars_total', 'Cost of Lambda invocations per function in USD.',
+               [(_labels(function=f['function']), '{0:.10f}'.format(f['sampling_cost'])) for f in report['functions']])
+        return '\n'.join(lines) + '\n'
+
+    def export(self, json_path: str = None, prometheus_path: str = None):
+        """ Writes the JSON report and/or the Prometheus text file """
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=4)
+        if prometheus_path:
+            with open(prometheus_path, 'w') as f:
+                f.write(self.to_prometheus())
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """ Returns the process wide `Metrics` collector """
+    return _metrics
@@ -0,0 +1,27 @@
+X86_64 = 'x86_64'
+ARM64 = 'arm64'
+ARCHITECTURES = [X86_64, ARM64]
+
+# USD per GB-second of duration, per architecture (first pricing tier). Most regions use the `default` prices, only
+# regions with different prices are listed.
+GB_SECOND_PRICES = {
+    'default': {X86_64: 0.0000166667, ARM64: 0.0000133334},
+    'af-south-1': {X86_64: 0.0000221, ARM64: 0.0000177},
+    'ap-east-1': {X86_64: 0.00002865, ARM64: 0.0000229},
+}
+
+
+def gb_second_price(architecture: str = X86_64, region: str = None):
+    """ Returns the price of one GB-second for an architecture in a region, falls back to the default prices for
+    regions missing from `GB_SECOND_PRICES`
+    """
+    prices = GB_SECOND_PRICES.get(region, GB_SECOND_PRICES['default'])
+    if architecture not in prices:
+        raise ValueError(f"No price for architecture {architecture}")
+    return prices[architecture]
+
+
+def region_of_arn(arn: str):
+    """ Returns the region of an ARN, e.g. `eu-central-1` """
+    parts = arn.split(':')
+    return parts[3] if len(parts) > 3 else None
@@ -1,4 +1,5 @@
 import time
+from util.metrics import get_metrics
 
 def get_recursively(search_dict, field):
     """
@@ -32,6 +33,7 @@ def timeit(method):
         ts = time.time()
         result = method(*args, **kw)
         te = time.time()
+        get_metrics().record_phase(method.__name__, te - ts)
         if 'log_time' in kw:
             name = kw.get('log_name', method.__name__.upper())
             kw['log_time'][name] = int((te - ts) * 1000)